@@ -0,0 +1,202 @@
+import argparse
+import bisect
+import csv
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# Список разрешенных (заведомо чистых) исполняемых файлов по SHA256: запуск такого файла не проверяется
+# в VirusTotal и не вызывает оповещения. Источники - CSV с хэшами: наборы NSRL, снимок эталонного образа
+# (Get-FileHash -Algorithm SHA256 | Export-Csv) или просто файл с хэшем в каждой строке.
+# Индекс на диске: фильтр Блума (10 бит на хэш) для быстрого отказа, таблица смещений по первым двум
+# байтам и отсортированный массив 32-байтных хэшей; файл отображается в память (mmap), поэтому
+# миллионы хэшей не занимают память процесса, а проверка - фильтр и поиск в корзине из десятка хэшей.
+
+ALLOWLIST_FILE = "allowlist.idx"  # Индекс разрешенных хэшей
+ALLOWLIST_MAGIC = b"NBZALW1\n"
+HEADER = struct.Struct("<8sQQI")  # сигнатура, число хэшей, бит в фильтре Блума, число проверок фильтра
+BLOOM_BITS_PER_HASH = 10  # ~1% ложных срабатываний фильтра (они отсекаются точным поиском)
+BLOOM_HASHES = 7  # Проверок фильтра: берутся из байтов 4..31 самого SHA256
+PREFIX_BUCKETS = 1 << 16  # Корзин по первым двум байтам
+HASH_SIZE = 32
+BLOOM_WORDS = struct.Struct(f"<{BLOOM_HASHES}I")
+SHA256_COLUMNS = ("sha256", "sha-256", "sha_256", "hash")  # Имена столбца с хэшем в CSV (без учета регистра)
+
+
+# Функция перевода SHA256 из шестнадцатеричной строки в байты (None - не SHA256)
+def sha256_bytes(value):
+    value = value.strip().strip('"')
+    if len(value) != 2 * HASH_SIZE:
+        return None
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        return None
+
+
+def _bloom_positions(digest, bits):
+    return [word % bits for word in BLOOM_WORDS.unpack_from(digest, 4)]
+
+
+# Функция чтения хэшей из CSV: столбец по заголовку, без заголовка - первое поле, похожее на SHA256.
+# Возвращает (хэши, пропущено строк)
+def read_hash_csv(file_name):
+    hashes = set()
+    skipped = 0
+    with open(file_name, "r", encoding="utf-8-sig", newline="") as f:
+        column = None
+        header = True
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            if header:
+                # Первая строка данных может быть заголовком
+                header = False
+                names = [name.strip().lower() for name in row]
+                found = [names.index(name) for name in SHA256_COLUMNS if name in names]
+                if found:
+                    column = found[0]
+                    continue
+            fields = [row[column]] if column is not None and column < len(row) else row
+            for field in fields:
+                digest = sha256_bytes(field)
+                if digest is not None:
+                    hashes.add(digest)
+                    break
+            else:
+                skipped += 1
+    return hashes, skipped
+
+
+# Функция построения индекса из набора хэшей (bytes по 32); файл заменяется атомарно
+def build_index(file_name, hashes):
+    hashes = sorted(hashes)
+    bits = max(64, (len(hashes) * BLOOM_BITS_PER_HASH + 7) // 8 * 8)
+    bloom = bytearray(bits // 8)
+    offsets = array("I", bytes(4 * (PREFIX_BUCKETS + 1)))
+    for digest in hashes:
+        for position in _bloom_positions(digest, bits):
+            bloom[position >> 3] |= 1 << (position & 7)
+        offsets[(digest[0] << 8 | digest[1]) + 1] += 1
+    for prefix in range(PREFIX_BUCKETS):
+        offsets[prefix + 1] += offsets[prefix]
+    if sys.byteorder != "little":
+        offsets.byteswap()
+
+    tmp_name = file_name + ".tmp"
+    with open(tmp_name, "wb") as f:
+        f.write(HEADER.pack(ALLOWLIST_MAGIC, len(hashes), bits, BLOOM_HASHES))
+        f.write(bloom)
+        f.write(offsets.tobytes())
+        f.write(b"".join(hashes))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, file_name)
+    return len(hashes)
+
+
+# Индекс разрешенных хэшей, отображенный в память: sha256 in allowlist
+class Allowlist:
+    def __init__(self, file_name=ALLOWLIST_FILE):
+        self.file_name = file_name
+        self._file = open(file_name, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.bloom_bits, self.bloom_hashes = HEADER.unpack_from(self._map, 0)
+        if magic != ALLOWLIST_MAGIC or self.bloom_hashes != BLOOM_HASHES:
+            self.close()
+            raise ValueError(f"{file_name}: не индекс списка разрешенных или другая версия индекса")
+        self._bloom_start = HEADER.size
+        offsets_start = self._bloom_start + self.bloom_bits // 8
+        self._hashes_start = offsets_start + 4 * (PREFIX_BUCKETS + 1)
+        if len(self._map) != self._hashes_start + HASH_SIZE * self.count:
+            self.close()
+            raise ValueError(f"{file_name}: индекс поврежден (неверный размер)")
+        # Таблица смещений (256 КБ) читается в память, хэши и фильтр остаются в отображении
+        self._offsets = array("I")
+        self._offsets.frombytes(self._map[offsets_start:self._hashes_start])
+        if sys.byteorder != "little":
+            self._offsets.byteswap()
+        self._keys = _HashKeys(self._map, self._hashes_start)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, sha256):
+        digest = sha256_bytes(sha256) if isinstance(sha256, str) else sha256
+        if digest is None or len(digest) != HASH_SIZE:
+            return False
+        bloom = self._map
+        start = self._bloom_start
+        for position in _bloom_positions(digest, self.bloom_bits):
+            if not bloom[start + (position >> 3)] >> (position & 7) & 1:
+                return False
+        prefix = digest[0] << 8 | digest[1]
+        low, high = self._offsets[prefix], self._offsets[prefix + 1]
+        index = bisect.bisect_left(self._keys, digest, low, high)
+        return index < high and self._keys[index] == digest
+
+    # Все хэши индекса по порядку (для объединения с новыми наборами)
+    def hashes(self):
+        for index in range(self.count):
+            yield bytes(self._keys[index])
+
+    def close(self):
+        self._keys = None
+        self._map.close()
+        self._file.close()
+
+
+# Массив хэшей индекса для bisect: элемент - 32 байта из отображения
+class _HashKeys:
+    __slots__ = ("map", "start")
+
+    def __init__(self, file_map, start):
+        self.map = file_map
+        self.start = start
+
+    def __getitem__(self, index):
+        offset = self.start + HASH_SIZE * index
+        return self.map[offset:offset + HASH_SIZE]
+
+
+# Функция загрузки индекса (None - индекса нет, список разрешенных не используется)
+def load_allowlist(file_name=ALLOWLIST_FILE):
+    if not os.path.exists(file_name):
+        print(f"{file_name} не найден, список разрешенных процессов не используется")
+        return None
+    allowlist = Allowlist(file_name)
+    print(f"Список разрешенных процессов: {len(allowlist)} хэшей из {file_name}")
+    return allowlist
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Список разрешенных исполняемых файлов по SHA256")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Построить индекс из CSV с хэшами")
+    build_parser.add_argument("csv_files", nargs="+", help="Файлы CSV (NSRL, Get-FileHash, хэш в строке)")
+    build_parser.add_argument("--index", default=ALLOWLIST_FILE, help="Файл индекса")
+    build_parser.add_argument("--merge", action="store_true", help="Добавить к хэшам существующего индекса")
+    check_parser = subparsers.add_parser("check", help="Проверить хэши по индексу")
+    check_parser.add_argument("hashes", nargs="+")
+    check_parser.add_argument("--index", default=ALLOWLIST_FILE, help="Файл индекса")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        all_hashes = set()
+        if args.merge and os.path.exists(args.index):
+            existing = Allowlist(args.index)
+            all_hashes.update(existing.hashes())
+            existing.close()
+        for csv_file in args.csv_files:
+            file_hashes, skipped = read_hash_csv(csv_file)
+            all_hashes |= file_hashes
+            print(f"{csv_file}: хэшей {len(file_hashes)}, пропущено строк {skipped}")
+        count = build_index(args.index, all_hashes)
+        print(f"Индекс {args.index}: {count} хэшей, {os.path.getsize(args.index)} байт")
+    else:
+        allowlist = Allowlist(args.index)
+        for value in args.hashes:
+            print(f"{value}: {'разрешен' if value in allowlist else 'нет в списке'}")
+        allowlist.close()
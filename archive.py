@@ -0,0 +1,295 @@
+import argparse
+import bisect
+import json
+import os
+import struct
+import zlib
+from array import array
+from datetime import datetime, timedelta
+import datetime as dt
+from cursor_store import atomic_write_json
+from event_store import iter_events
+
+# Архив событий по дням: на каждую категорию и день - один сжатый сегмент с колонками.
+# Время хранится отсортированным массивом double (секунды UTC), остальные поля - словарем
+# значений и массивом кодов, текст сводки - отдельной колонкой, которая читается только по запросу.
+# Индекс archive/index.json хранит min/max времени сегментов, поэтому запрос не открывает
+# сегменты вне диапазона, а словари в заголовке сегмента позволяют пропустить сегмент без
+# распаковки колонок, если искомого значения в нем нет.
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_INDEX_FILE = "index.json"
+SEGMENT_SUFFIX = ".seg"
+SEGMENT_MAGIC = b"NBZSEG1\n"
+TEXT_COLUMNS = {"summary"}  # Поля, которые хранятся как текст без словаря
+TEXT_BLOCK_ROWS = 1024  # Строк текстовой колонки в одном сжатом блоке
+MISSING = 0  # Код отсутствующего значения в словарных колонках
+
+
+def _compress_array(values):
+    return zlib.compress(values.tobytes(), 6)
+
+
+def _decompress_array(typecode, blob):
+    values = array(typecode)
+    values.frombytes(zlib.decompress(blob))
+    return values
+
+
+# Функция записи сегмента: колонки строятся из событий, отсортированных по времени
+def write_segment(path, events):
+    events = sorted(events, key=lambda event: event["time"])
+    times = array("d", (datetime.fromisoformat(event["time"]).timestamp() for event in events))
+    fields = sorted({field for event in events for field in event} - {"time"})
+
+    columns = {}
+    blobs = []
+    offset = 0
+
+    def add_blob(blob):
+        nonlocal offset
+        blobs.append(blob)
+        offset += len(blob)
+        return offset - len(blob), len(blob)
+
+    start, length = add_blob(_compress_array(times))
+    columns["time"] = {"kind": "time", "offset": start, "length": length}
+    for field in fields:
+        if field in TEXT_COLUMNS:
+            # Строки в UTF-8 блоками по TEXT_BLOCK_ROWS, каждый блок сжат отдельно, и массив смещений
+            # строк внутри блока: для найденных строк распаковываются только их блоки
+            encoded = [str(event.get(field) or "").encode("utf-8") for event in events]
+            offsets = array("I")
+            blocks = []
+            for block_start in range(0, len(encoded), TEXT_BLOCK_ROWS):
+                block = encoded[block_start:block_start + TEXT_BLOCK_ROWS]
+                position = 0
+                for item in block:
+                    offsets.append(position)
+                    position += len(item)
+                blocks.append(add_blob(zlib.compress(b"".join(block), 6)))
+            start, length = add_blob(_compress_array(offsets))
+            columns[field] = {"kind": "text", "offset": start, "length": length, "blocks": blocks}
+            continue
+        values = []
+        counts = []
+        codes_by_value = {}
+        codes = array("I")
+        for event in events:
+            value = event.get(field)
+            if value is None:
+                codes.append(MISSING)
+                continue
+            key = value if isinstance(value, (str, int)) else json.dumps(value, ensure_ascii=False)
+            code = codes_by_value.get(key)
+            if code is None:
+                values.append(value)
+                counts.append(0)
+                code = codes_by_value[key] = len(values)
+            counts[code - 1] += 1
+            codes.append(code)
+        # Самый узкий тип кодов, в который помещается словарь
+        typecode = "B" if len(values) < 2**8 else "H" if len(values) < 2**16 else "I"
+        start, length = add_blob(_compress_array(array(typecode, codes)))
+        columns[field] = {"kind": "dict", "offset": start, "length": length, "typecode": typecode,
+                          "values": values, "counts": counts}
+
+    header = json.dumps({
+        "count": len(events),
+        "min_time": times[0] if events else None,
+        "max_time": times[-1] if events else None,
+        "columns": columns
+    }, ensure_ascii=False).encode("utf-8")
+    tmp_name = f"{path}.tmp"
+    with open(tmp_name, "wb") as f:
+        f.write(SEGMENT_MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, path)
+    return len(events), (times[0] if events else None), (times[-1] if events else None)
+
+
+# Сегмент архива: заголовок читается сразу, колонки - по требованию
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                raise ValueError(f"{path}: не сегмент архива")
+            header_length, = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(header_length))
+            self.data_start = len(SEGMENT_MAGIC) + 4 + header_length
+        self.columns = self.header["columns"]
+        self.count = self.header["count"]
+        self._cache = {}
+
+    def _read_blob(self, offset, length):
+        with open(self.path, "rb") as f:
+            f.seek(self.data_start + offset)
+            return f.read(length)
+
+    def column(self, name):
+        if name not in self._cache:
+            column = self.columns.get(name)
+            if column is None:
+                self._cache[name] = None
+            elif column["kind"] == "time":
+                self._cache[name] = _decompress_array("d", self._read_blob(column["offset"], column["length"]))
+            elif column["kind"] == "dict":
+                self._cache[name] = _decompress_array(
+                    column["typecode"], self._read_blob(column["offset"], column["length"])
+                )
+            else:
+                offsets = _decompress_array("I", self._read_blob(column["offset"], column["length"]))
+                self._cache[name] = (offsets, {})
+        return self._cache[name]
+
+    def _text_block(self, column, blocks, number):
+        block = blocks.get(number)
+        if block is None:
+            block = blocks[number] = zlib.decompress(self._read_blob(*column["blocks"][number]))
+        return block
+
+    # Код значения в словаре колонки и число строк с ним; None - значения в сегменте нет
+    def code_of(self, name, value):
+        column = self.columns.get(name)
+        if column is None or column["kind"] != "dict":
+            return None
+        try:
+            code = column["values"].index(value) + 1
+        except ValueError:
+            return None
+        return code, column["counts"][code - 1]
+
+    # Номера строк с заданным кодом: поиск идет внутри массива (array.index), а цикл Python
+    # выполняется только по найденным строкам
+    def rows_with(self, name, code):
+        codes = self.column(name)
+        rows = []
+        row = -1
+        while True:
+            try:
+                row = codes.index(code, row + 1)
+            except ValueError:
+                return rows
+            rows.append(row)
+
+    def value(self, name, row):
+        column = self.columns.get(name)
+        if column is None:
+            return None
+        data = self.column(name)
+        if column["kind"] == "dict":
+            code = data[row]
+            return None if code == MISSING else column["values"][code - 1]
+        if column["kind"] == "time":
+            return datetime.fromtimestamp(data[row], dt.timezone.utc).isoformat()
+        offsets, blocks = data
+        number = row // TEXT_BLOCK_ROWS
+        block = self._text_block(column, blocks, number)
+        end = offsets[row + 1] if (row + 1) % TEXT_BLOCK_ROWS and row + 1 < self.count else len(block)
+        return block[offsets[row]:end].decode("utf-8")
+
+    def all_events(self):
+        return [{name: self.value(name, row) for name in self.columns} for row in range(self.count)]
+
+
+# Архив: сегменты по категориям и дням с индексом min/max времени
+class EventArchive:
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.index_file = os.path.join(directory, ARCHIVE_INDEX_FILE)
+        self.index = {}  # категория -> {день: {"min", "max", "count"}}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+
+    def segment_path(self, category, day):
+        return os.path.join(self.directory, category, f"{day}{SEGMENT_SUFFIX}")
+
+    # Перенос накопительного лога (снимка) в архив; события раскладываются по дням UTC.
+    # Если сегмент дня уже есть, он дополняется
+    def archive_log(self, file_name, category):
+        by_day = {}
+        for event in iter_events(file_name):
+            time_str = event.get("time")
+            if time_str:
+                by_day.setdefault(time_str[:10], []).append(event)
+        if not by_day:
+            return 0
+        os.makedirs(os.path.join(self.directory, category), exist_ok=True)
+        archived = 0
+        for day, events in by_day.items():
+            path = self.segment_path(category, day)
+            if os.path.exists(path):
+                events = Segment(path).all_events() + events
+            count, min_time, max_time = write_segment(path, events)
+            self.index.setdefault(category, {})[day] = {"min": min_time, "max": max_time, "count": count}
+            archived += len(by_day[day])
+        atomic_write_json(self.index_file, self.index)
+        print(f"В архив {category} перенесено {archived} событий ({len(by_day)} дн.)")
+        return archived
+
+    # Запрос событий категории за период с фильтром по полям (равенство);
+    # fields - какие поля вернуть (по умолчанию все)
+    def query(self, category, since=None, until=None, fields=None, **filters):
+        since_ts = since.timestamp() if since else float("-inf")
+        until_ts = until.timestamp() if until else float("inf")
+        results = []
+        for day, meta in sorted(self.index.get(category, {}).items()):
+            if meta["max"] is None or meta["max"] < since_ts or meta["min"] > until_ts:
+                continue
+            segment = Segment(self.segment_path(category, day))
+            wanted = []
+            for name, value in filters.items():
+                found = segment.code_of(name, value)
+                if found is None:
+                    break
+                wanted.append((found[1], name, found[0]))
+            else:
+                times = segment.column("time")
+                first, last = bisect.bisect_left(times, since_ts), bisect.bisect_right(times, until_ts)
+                if wanted:
+                    # Сначала самое редкое значение, остальные условия проверяются по найденным строкам
+                    wanted.sort()
+                    _, name, code = wanted[0]
+                    rows = [row for row in segment.rows_with(name, code) if first <= row < last]
+                    for _, name, code in wanted[1:]:
+                        codes = segment.column(name)
+                        rows = [row for row in rows if codes[row] == code]
+                else:
+                    rows = range(first, last)
+                names = fields or list(segment.columns)
+                results.extend({name: segment.value(name, row) for name in names} for row in rows)
+        return results
+
+
+# Разбор условий вида поле=значение (числа сравниваются как числа)
+def parse_filters(conditions):
+    filters = {}
+    for condition in conditions:
+        name, _, value = condition.partition("=")
+        filters[name] = int(value) if value.isdigit() and name == "event_id" else value
+    return filters
+
+
+# Запрос к архиву из командной строки:
+#   python archive.py events_4624 --days 30 event_id=4624 logon_type=10 user=ivanov
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запрос к архиву событий")
+    parser.add_argument("category", help="Категория (имя лога без расширения), например events_4624")
+    parser.add_argument("conditions", nargs="*", help="Условия поле=значение")
+    parser.add_argument("--days", type=int, default=30, help="За сколько последних дней")
+    parser.add_argument("--archive", default=ARCHIVE_DIR, help="Каталог архива")
+    args = parser.parse_intermixed_args()
+
+    archive = EventArchive(args.archive)
+    since = datetime.now(dt.timezone.utc) - timedelta(days=args.days)
+    events = archive.query(args.category, since=since, **parse_filters(args.conditions))
+    for event in events:
+        print(f"{event['time']}: {event.get('summary') or event}")
+    print(f"Найдено событий: {len(events)}")
@@ -0,0 +1,245 @@
+import asyncio
+import itertools
+import time
+from datetime import datetime
+import datetime as dt
+from event_source import EVT_CHANNELS
+from metrics import BACKFILL_RECORDS, STAGE_SECONDS
+
+# Догоняющее чтение после перерыва в работе (перезагрузка, сбой, устаревшая блокировка): записи между
+# сохраненным курсором канала и началом обычного окна TIME_RANGE_MINUTES обрабатываются перед обычным
+# режимом. Каналы читаются пачками по BACKFILL_CHUNK_RECORDS записей (память ограничена размером пачки),
+# скорость ограничена BACKFILL_MAX_RATE записей в секунду, курсоры фиксируются после каждой пачки -
+# прерванное чтение продолжается с места остановки. Оповещения пропуска не отправляются по одному,
+# а собираются в одну сводку; записи обычного окна остаются обычному режиму. Короткий пропуск (меньше
+# BACKFILL_MIN_GAP_WINDOWS окон) догоняющим чтением не считается: обычный режим сам читает от курсора.
+
+BACKFILL_MAX_HOURS = 24  # Записи старше этого не обрабатываются (курсор проходит их без оповещений)
+BACKFILL_CHUNK_RECORDS = 2000  # Записей канала за одну пачку
+BACKFILL_MAX_RATE = 5000  # Записей в секунду не больше (журналы и диск нужны и остальной системе)
+BACKFILL_SUMMARY_TOP = 15  # Видов оповещений в сводке
+BACKFILL_SUMMARY_SAMPLES = 3  # Полных оповещений каждого вида в сводке
+BACKFILL_MIN_GAP_WINDOWS = 5  # Догоняющее чтение - только если пропуск длиннее стольких окон TIME_RANGE_MINUTES
+
+
+# Сводка оповещений пропуска: вместо отправки оповещения считаются по видам (вид - имя обработчика,
+# отправившего оповещение), первые samples оповещений вида сохраняются полностью;
+# сообщения об ошибках (📋) отправляются сразу
+class BacklogSummary:
+    def __init__(self, send_message_func, samples=BACKFILL_SUMMARY_SAMPLES):
+        self.send_message_func = send_message_func
+        self.samples = samples
+        self.kinds = {}  # вид -> [число, первые полные оповещения]
+        self.total = 0
+        self.kind = None  # Обработчик, который выполняется сейчас
+
+    # Обработчики движка помечают свои оповещения видом - своим именем
+    def track(self, scanner):
+        scanner.handlers = [(name, self._tagged(name, handler)) for name, handler in scanner.handlers]
+
+    def _tagged(self, name, handler):
+        async def tagged(records):
+            self.kind = name
+            try:
+                await handler(records)
+            finally:
+                self.kind = None
+        return tagged
+
+    # kind - вид оповещения, отправленного не обработчиком (например, вердикта VirusTotal)
+    async def send_message(self, message, kind=None):
+        if message.startswith("📋"):
+            await self.send_message_func(message)
+            return
+        entry = self.kinds.setdefault(kind or self.kind or "Прочие", [0, []])
+        entry[0] += 1
+        if len(entry[1]) < self.samples:
+            entry[1].append(message)
+        self.total += 1
+
+    # Строки сводки: виды по убыванию числа, под каждым - сохраненные оповещения
+    def lines(self, top=BACKFILL_SUMMARY_TOP):
+        kinds = sorted(self.kinds.items(), key=lambda item: item[1][0], reverse=True)
+        lines = []
+        for kind, (count, samples) in kinds[:top]:
+            lines.append(f"{kind}: ×{count}" + (f", первые {len(samples)}:" if count > len(samples) else ":"))
+            lines.extend("• " + sample.replace("\n", "\n  ") for sample in samples)
+        if len(kinds) > top:
+            lines.append(f"И ещё видов: {len(kinds) - top} (×{sum(count for _, (count, _) in kinds[top:])})")
+        return lines
+
+
+# Статистика канала за догоняющее чтение
+class ChannelBacklog:
+    __slots__ = ("channel", "after", "position", "read", "processed", "skipped", "first", "last", "done")
+
+    def __init__(self, channel, after):
+        self.channel = channel
+        self.after = after  # Курсор до чтения (None - позиции не было)
+        self.position = after
+        self.read = 0  # Записей пропуска прочитано
+        self.processed = 0  # Передано обработчикам
+        self.skipped = 0  # Старше предела BACKFILL_MAX_HOURS
+        self.first = None  # Время первой и последней записи пропуска (с)
+        self.last = None
+        self.done = False
+
+
+def _clock(timestamp):
+    return datetime.fromtimestamp(timestamp, dt.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Догоняющее чтение каналов движка просмотра журналов; обработчики движка зарегистрированы
+# с функцией отправки сводки (BacklogSummary), курсоры - общие с обычным режимом
+class CatchUp:
+    # window_minutes - окно обычного режима (его записи не трогаются); since - начало чтения для каналов
+    # без курсора (None - такие каналы не читаются: пропуск отсчитывается от обработанной позиции);
+    # min_gap_minutes - канал с курсором догоняется, только если его пропуск до окна длиннее этого
+    # (None - BACKFILL_MIN_GAP_WINDOWS окон)
+    def __init__(self, scanner, window_minutes, since=None, max_hours=BACKFILL_MAX_HOURS,
+                 chunk_records=BACKFILL_CHUNK_RECORDS, max_rate=BACKFILL_MAX_RATE, min_gap_minutes=None):
+        self.scanner = scanner
+        self.window_minutes = window_minutes
+        if min_gap_minutes is None:
+            min_gap_minutes = window_minutes * BACKFILL_MIN_GAP_WINDOWS
+        self.min_gap_minutes = min_gap_minutes
+        self.since = since
+        self.max_hours = max_hours
+        self.chunk_records = chunk_records
+        self.max_rate = max_rate
+        self.channels = []  # [ChannelBacklog]
+        self.cutoff = None  # Начало окна обычного режима (с): записи с этого момента не читаются
+        self.elapsed = 0.0
+
+    # Чтение очередной пачки канала (в рабочем потоке): записи для обработчиков;
+    # на записи обычного окна или в конце журнала канал завершается
+    def _take(self, backlog, reader, horizon, cutoff):
+        records = []
+        count = 0
+        for record in reader:
+            if record.timestamp >= cutoff:
+                # Курсор остается на последней записи пропуска: эту запись прочитает обычный режим
+                backlog.done = True
+                break
+            if backlog.first is None:
+                backlog.first = record.timestamp
+            backlog.last = record.timestamp
+            if record.record_number is not None:
+                backlog.position = record.record_number
+            backlog.read += 1
+            count += 1
+            if record.timestamp < horizon:
+                backlog.skipped += 1
+            elif record.event_id in self.scanner.routes.get(backlog.channel, {}):
+                records.append(record)
+            if count >= self.chunk_records:
+                return records
+        else:
+            backlog.done = True
+        return records
+
+    # Записи канала после курсора, а без курсора - с момента since (None - журнал пуст). Классические
+    # каналы без курсора читаются от новых к старым, поэтому для них чтение идет от самой старой записи
+    # журнала (не от 0: иначе источник сообщал бы о перезаписанном журнале при каждом первом запуске)
+    def _open(self, channel, after, since):
+        source = self.scanner.source
+        if after is None and channel not in EVT_CHANNELS:
+            oldest = source.oldest_record_number(channel)
+            if oldest is None:
+                return None
+            after = oldest - 1
+        return source.read_channel(channel, since, after, query=self.scanner.channel_query(channel))
+
+    async def run(self, send_message_func=None):
+        scanner = self.scanner
+        started = time.time()
+        cutoff = self.cutoff = started - self.window_minutes * 60
+        horizon = started - self.max_hours * 3600
+        if self.since is not None:
+            horizon = max(horizon, self.since.timestamp())
+        since = datetime.fromtimestamp(horizon, dt.timezone.utc)
+
+        readers = {}
+        opened = []
+        for channel in scanner.routes:
+            after = scanner.cursors.get(channel) if scanner.cursors else None
+            if after is None and self.since is None:
+                print(f"Канал {channel}: нет сохраненной позиции, догоняющее чтение не нужно")
+                continue
+            reader = self._open(channel, after, since)
+            if reader is None:
+                print(f"Канал {channel}: журнал пуст")
+                continue
+            opened.append(reader)
+            if after is not None:
+                # Пропуск канала - от первой записи после курсора до начала окна; короткий пропуск
+                # (запуск по расписанию) остается обычному режиму, который читает от того же курсора
+                first = next(reader, None)
+                if first is None or first.timestamp >= cutoff - self.min_gap_minutes * 60:
+                    print(f"Канал {channel}: пропуск короче {self.min_gap_minutes:g} мин, его прочитает обычный режим")
+                    continue
+                reader = itertools.chain((first,), reader)
+            self.channels.append(ChannelBacklog(channel, after))
+            readers[channel] = reader
+
+        processed_total = 0
+        perf_started = time.perf_counter()
+        try:
+            while any(not backlog.done for backlog in self.channels):
+                # Пачка - по одной порции от каждого незавершенного канала
+                slices = [[] for _ in scanner.handlers]
+                positions = {}
+                channels = set()
+                for backlog in self.channels:
+                    if backlog.done:
+                        continue
+                    read_before = backlog.read
+                    records = await asyncio.to_thread(self._take, backlog, readers[backlog.channel], horizon, cutoff)
+                    if backlog.read == read_before:
+                        continue
+                    if backlog.position is not None:
+                        positions[backlog.channel] = backlog.position
+                    channels.add(backlog.channel)
+                    for record in records:
+                        for index in scanner.routes[backlog.channel].get(record.event_id, ()):
+                            slices[index].append(record)
+                    backlog.processed += len(records)
+                    processed_total += len(records)
+                    BACKFILL_RECORDS.inc(len(records), result="processed")
+                if not channels:
+                    break
+                failed = await scanner.run_handlers(slices, channels, positions, send_message_func)
+                # Курсор канала с ошибкой обработчика не сдвинут: дальше этот канал читает обычный режим от него
+                for backlog in self.channels:
+                    if backlog.channel in failed:
+                        backlog.done = True
+                print(f"Догоняющее чтение: обработано {processed_total} записей, позиции {positions}")
+
+                # Ограничение скорости: пачка не начинается раньше, чем позволяет BACKFILL_MAX_RATE; считаются
+                # все прочитанные записи - нагрузку на журналы дают и записи, не нужные обработчикам
+                read_total = sum(backlog.read for backlog in self.channels)
+                delay = read_total / self.max_rate - (time.perf_counter() - perf_started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        finally:
+            for reader in opened:
+                reader.close()
+            self.elapsed = time.perf_counter() - perf_started
+            STAGE_SECONDS.observe(self.elapsed, stage="backfill", name="")
+            for backlog in self.channels:
+                BACKFILL_RECORDS.inc(backlog.skipped, result="skipped")
+        return processed_total
+
+    # Строки сводки по каналам с пропуском (пусто - пропуска не было)
+    def lines(self):
+        lines = []
+        for backlog in self.channels:
+            if not backlog.read:
+                print(f"Канал {backlog.channel}: пропуска нет")
+                continue
+            line = (f"{backlog.channel}: с {_clock(backlog.first)} по {_clock(backlog.last)} (UTC),"
+                    f" записей {backlog.read}, обработано {backlog.processed}")
+            if backlog.skipped:
+                line += f", старше {self.max_hours:g} ч пропущено {backlog.skipped}"
+            lines.append(line)
+        return lines
@@ -0,0 +1,1221 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+import datetime as dt
+
+# Нагрузочные замеры компонентов мониторинга; запускаются без Windows и без сети:
+#   python benchmark.py store --events 100000
+# Сводный замер всех обработчиков на синтетической записи журналов с сохранением результатов
+# и сравнением с прошлым запуском:
+#   python benchmark.py suite --results bench_results.json
+
+BENCH_RESULTS_FILE = "bench_results.json"  # История результатов suite
+REGRESSION_TOLERANCE = 0.2  # Падение скорости больше этой доли отмечается как регрессия
+STARTUP_BUDGET_MS = 200  # Бюджет импорта main.py (до отложенных импортов - 330-430 мс)
+# Модули, которые не должны загружаться при старте: нужны только отчету, VirusTotal, отправке и метрикам
+STARTUP_DEFERRED = ("reportlab", "pkg_resources", "requests", "telegram", "xmltodict", "http.server", "cProfile")
+SUITE_RATES = {4624: 600, 4672: 120, 4698: 10, 4697: 10, 7045: 10, 6005: 10, 1: 300}  # Событий в минуту
+
+
+# Замер добавления событий в хранилище: время на каждую пачку должно оставаться постоянным
+def bench_store(args):
+    from event_store import EventStore, iter_events
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, "events_bench.jsonl")
+        store = EventStore()
+        start_time = datetime.now(dt.timezone.utc)
+        chunk = max(args.events // 10, 1)
+        chunk_started = time.perf_counter()
+        started = chunk_started
+        for i in range(args.events):
+            store.append(file_name, {
+                "time": (start_time + timedelta(milliseconds=i)).isoformat(),
+                "summary": f"Пользователь: user{i % 100}, Тип: 2, Домен: DOMAIN"
+            })
+            if (i + 1) % chunk == 0:
+                now = time.perf_counter()
+                print(f"  {i + 1:>8} событий: пачка {chunk} за {now - chunk_started:.3f} с")
+                chunk_started = now
+        store.close()
+        elapsed = time.perf_counter() - started
+        print(f"Запись: {args.events} событий за {elapsed:.3f} с ({args.events / elapsed:.0f} событий/с)")
+
+        started = time.perf_counter()
+        count = sum(1 for _ in iter_events(file_name))
+        elapsed = time.perf_counter() - started
+        print(f"Потоковое чтение: {count} событий за {elapsed:.3f} с ({count / elapsed:.0f} событий/с)")
+
+
+# Имитация telegram.Bot: отправка без сети с заданной задержкой
+class FakeBot:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(self.delay)
+        self.sent.append((chat_id, text))
+
+    async def send_document(self, chat_id, document):
+        await asyncio.sleep(self.delay)
+        self.sent.append((chat_id, document.name))
+
+
+# Замер очереди доставки: пачка оповещений уходит сводками, постановка в очередь не ждёт сети
+def bench_delivery(args):
+    from bot import DeliveryQueue
+
+    async def run():
+        fake_bot = FakeBot(args.delay)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            queue = DeliveryQueue(fake_bot, "bench", os.path.join(tmp_dir, "spool.jsonl"))
+            await queue.start()
+            started = time.perf_counter()
+            for i in range(args.messages):
+                await queue.put(f"⚠️ Запущен процесс: C:\\Windows\\System32\\cmd.exe\nАргументы: /c job {i}")
+            enqueued = time.perf_counter() - started
+            await queue.stop(timeout=600)
+            elapsed = time.perf_counter() - started
+        print(f"Постановка {args.messages} оповещений: {enqueued:.3f} с")
+        print(f"Доставка: {len(fake_bot.sent)} сообщений Telegram за {elapsed:.3f} с")
+
+    asyncio.run(run())
+
+
+# Локальная заглушка API VirusTotal: отвечает с задержкой, как медленный сервер
+def start_vt_stub(delay):
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            sha256 = self.path.rsplit("/", 1)[-1]
+            if sha256.startswith("0"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = json.dumps({"data": {"attributes": {"last_analysis_stats": {"malicious": 0, "undetected": 70}}}})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Замер конвейера VirusTotal против локальной заглушки
+def bench_vt(args):
+    from virustotal import VirusTotalClient, VerdictCache
+
+    server = start_vt_stub(args.delay)
+    api_url = f"http://127.0.0.1:{server.server_port}/api/v3/files/{{}}"
+    hashes = [f"{i % args.unique:064x}" for i in range(args.lookups)]
+
+    async def run():
+        verdicts = []
+
+        async def on_verdict(sha256, verdict, contexts):
+            verdicts.append((sha256, verdict, len(contexts)))
+
+        cache = VerdictCache(os.path.join(tmp_dir, "vt_cache.sqlite3"))
+        client = VirusTotalClient("bench", cache, on_verdict, api_url=api_url,
+                                  requests_per_minute=args.quota, concurrency=args.concurrency)
+        client.start()
+        started = time.perf_counter()
+        for i, sha256 in enumerate(hashes):
+            client.submit(sha256, f"process{i}.exe")
+        submitted = time.perf_counter() - started
+        await client.stop(timeout=600)
+        elapsed = time.perf_counter() - started
+        print(f"Постановка {len(hashes)} проверок ({args.unique} уникальных хэшей): {submitted:.4f} с")
+        print(f"Получено {len(verdicts)} вердиктов за {elapsed:.3f} с"
+              f" (параллельность {args.concurrency}, задержка сервера {args.delay} с)")
+
+        # Повторная проверка тех же хэшей обслуживается кэшем, включая ответы 404
+        started = time.perf_counter()
+        cached = sum(1 for sha256 in hashes if cache.get(sha256) is not None)
+        elapsed = time.perf_counter() - started
+        print(f"Повторно из кэша: {cached}/{len(hashes)} за {elapsed:.4f} с; {cache.stats()}")
+        cache.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(run())
+    server.shutdown()
+
+
+SYSMON_XML_TEMPLATE = (
+    "<Event xmlns='http://schemas.microsoft.com/win/2004/08/events/event'><System>"
+    "<Provider Name='Microsoft-Windows-Sysmon' Guid='{{5770385f-c22a-43e0-bf4c-06f5698ffbd9}}'/>"
+    "<EventID>{event_id}</EventID><Version>5</Version><Level>4</Level><Task>{event_id}</Task>"
+    "<Opcode>0</Opcode><Keywords>0x8000000000000000</Keywords>"
+    "<TimeCreated SystemTime='{time}'/><EventRecordID>{record}</EventRecordID><Correlation/>"
+    "<Execution ProcessID='3120' ThreadID='4388'/><Channel>Microsoft-Windows-Sysmon/Operational</Channel>"
+    "<Computer>BUILD-01</Computer><Security UserID='S-1-5-18'/></System><EventData>"
+    "<Data Name='RuleName'>-</Data><Data Name='UtcTime'>{utc}</Data>"
+    "<Data Name='ProcessGuid'>{{7f1c0b2e-1a2b-6650-{record:04x}-000000004800}}</Data>"
+    "<Data Name='ProcessId'>{record}</Data><Data Name='Image'>C:\\Program Files\\Git\\cmd\\git.exe</Data>"
+    "<Data Name='FileVersion'>2.45.1</Data><Data Name='Description'>Git for Windows</Data>"
+    "<Data Name='Product'>Git</Data><Data Name='Company'>The Git Development Community</Data>"
+    "<Data Name='OriginalFileName'>git.exe</Data>"
+    "<Data Name='CommandLine'>git.exe rev-parse --git-dir &amp;&amp; echo {record}</Data>"
+    "<Data Name='CurrentDirectory'>D:\\agent\\_work\\1\\s\\</Data><Data Name='User'>NT AUTHORITY\\SYSTEM</Data>"
+    "<Data Name='LogonGuid'>{{7f1c0b2e-0000-0000-e703-000000000000}}</Data><Data Name='LogonId'>0x3e7</Data>"
+    "<Data Name='TerminalSessionId'>0</Data><Data Name='IntegrityLevel'>System</Data>"
+    "<Data Name='Hashes'>SHA1=2A3B,MD5=9C0D,SHA256={record:064X},IMPHASH=0E1F</Data>"
+    "<Data Name='ParentProcessGuid'>{{7f1c0b2e-1a2b-6650-0000-000000004700}}</Data>"
+    "<Data Name='ParentProcessId'>3120</Data><Data Name='ParentImage'>C:\\agent\\bin\\Agent.Worker.exe</Data>"
+    "<Data Name='ParentCommandLine'>Agent.Worker.exe spawnclient 3000 3004</Data>"
+    "<Data Name='ParentUser'>NT AUTHORITY\\SYSTEM</Data></EventData></Event>"
+)
+
+
+# Корпус XML Sysmon: записанная фикстура (JSON Lines) или синтетические события (ID 1, 3, 5 и 11)
+def load_sysmon_corpus(args):
+    if args.corpus:
+        from event_source import JsonEventSource, SYSMON_CHANNEL
+        source = JsonEventSource(args.corpus)
+        since = datetime.min.replace(tzinfo=dt.timezone.utc)
+        return [record.xml for record in source.read_channel(SYSMON_CHANNEL, since) if record.xml]
+    start_time = datetime.now(dt.timezone.utc)
+    corpus = []
+    for i in range(args.events):
+        event_time = start_time + timedelta(milliseconds=i)
+        corpus.append(SYSMON_XML_TEMPLATE.format(
+            event_id=(1, 1, 3, 5, 11)[i % 5],
+            time=event_time.strftime("%Y-%m-%dT%H:%M:%S.%f0Z"),
+            utc=event_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            record=i + 1
+        ))
+    return corpus
+
+
+# Замер разбора XML Sysmon: быстрый декодер против xmltodict (если установлен) и ElementTree
+def bench_sysmon(args):
+    import xml.etree.ElementTree as ET
+    from sysmon_decoder import decode_process_create
+
+    corpus = load_sysmon_corpus(args)
+    print(f"Корпус: {len(corpus)} событий Sysmon")
+
+    def etree_decode(xml_str):
+        root = ET.fromstring(xml_str)
+        ns = "{http://schemas.microsoft.com/win/2004/08/events/event}"
+        if root.find(f"{ns}System/{ns}EventID").text != "1":
+            return None
+        return {d.get("Name"): d.text for d in root.iter(f"{ns}Data")}
+
+    decoders = [("sysmon_decoder", decode_process_create), ("ElementTree", etree_decode)]
+    try:
+        import xmltodict
+        decoders.append(("xmltodict", xmltodict.parse))
+    except ImportError:
+        print("xmltodict не установлен, сравнение с ним пропущено")
+
+    for name, decode in decoders:
+        started = time.perf_counter()
+        decoded = sum(1 for xml_str in corpus if decode(xml_str) is not None)
+        elapsed = time.perf_counter() - started
+        print(f"  {name:<15} {elapsed:.3f} с ({len(corpus) / elapsed:.0f} событий/с), разобрано {decoded}")
+
+
+# Замер индекса ProcessGuid: память на миллион GUID, скорость поиска, запись и загрузка корзин
+def bench_guids(args):
+    import sys
+    import uuid
+    from guid_index import GuidIndex
+
+    guids = [f"{{{uuid.uuid4()}}}".upper() for _ in range(args.guids)]
+    misses = [f"{{{uuid.uuid4()}}}".upper() for _ in range(min(args.guids, 100000))]
+    now = datetime.now(dt.timezone.utc)
+    step = GuidIndex("").window / len(guids)
+
+    # Прежний формат: строка GUID -> datetime
+    strings = {guid: now - i * step for i, guid in enumerate(guids)}
+    strings_memory = sys.getsizeof(strings) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in strings.items())
+    del strings
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = GuidIndex(os.path.join(tmp_dir, "seen"))
+        for i, guid in enumerate(guids):
+            index.add(guid, now - i * step)
+        scale = 1000000 / len(guids)
+        print(f"Память на миллион GUID: словарь строк {strings_memory * scale / 2**20:.0f} МБ,"
+              f" индекс {index.memory_size() * scale / 2**20:.0f} МБ ({len(index.buckets)} корзин)")
+
+        sample = guids[:len(misses)]
+        for name, batch in (("найденные", sample), ("отсутствующие", misses)):
+            started = time.perf_counter()
+            found = sum(1 for guid in batch if index.contains(guid))
+            elapsed = time.perf_counter() - started
+            print(f"Поиск ({name}): {len(batch) / elapsed:.0f} в секунду, найдено {found}")
+
+        started = time.perf_counter()
+        index.flush()
+        print(f"Запись корзин: {time.perf_counter() - started:.3f} с")
+        started = time.perf_counter()
+        loaded = GuidIndex(index.directory)
+        loaded.load(now)
+        print(f"Загрузка корзин: {time.perf_counter() - started:.3f} с")
+        started = time.perf_counter()
+        expired = loaded.expire(now + timedelta(hours=12))
+        print(f"Удаление {expired} устаревших корзин: {time.perf_counter() - started:.4f} с")
+
+
+# Замер построения PDF-отчета по накопительным логам за день
+def bench_report(args):
+    from event_store import EventStore
+    from report import build_report
+
+    day = datetime.now(dt.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    step = timedelta(days=1) / args.events
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sysmon_log = os.path.join(tmp_dir, "events_sysmon.jsonl")
+        logon_log = os.path.join(tmp_dir, "events_4624.jsonl")
+        store = EventStore()
+        for i in range(args.events):
+            event_time = (day + i * step).isoformat()
+            if i % 10:
+                image = f"C:\\Tools\\tool{i % 300}.exe"
+                sha256 = f"{i % 500:064X}"
+                store.append(sysmon_log, {
+                    "time": event_time,
+                    "summary": f"Процесс: {image}, Аргументы: --job {i}, SHA256: {sha256}, VirusTotal: 0/70",
+                    "user": "S-1-5-18", "image": image, "sha256": sha256
+                })
+            else:
+                store.append(logon_log, {
+                    "time": event_time,
+                    "summary": f"Пользователь: user{i % 40}, Тип: 2, Домен: DOMAIN",
+                    "user": f"user{i % 40}"
+                })
+        store.close()
+
+        categories = [
+            (logon_log, "Входы в систему", ["user"]),
+            (sysmon_log, "Запуск процессов (Sysmon)", ["user", "image", "sha256"])
+        ]
+        output_file = os.path.join(tmp_dir, "report.pdf")
+        started = time.perf_counter()
+        build_report(output_file, day.date(), categories)
+        elapsed = time.perf_counter() - started
+        print(f"Отчет по {args.events} событиям: {elapsed:.3f} с, размер {os.path.getsize(output_file) / 1024:.0f} КБ")
+
+
+# Замер архива: запрос «удалённые входы пользователя за 30 дней» против просмотра JSON Lines
+def bench_archive(args):
+    from archive import EventArchive
+    from event_store import EventStore, iter_events
+
+    now = datetime.now(dt.timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archive = EventArchive(os.path.join(tmp_dir, "archive"))
+        all_log = os.path.join(tmp_dir, "events_4624_all.jsonl")
+        store = EventStore()
+        started = time.perf_counter()
+        for day in range(args.days, 0, -1):
+            day_log = os.path.join(tmp_dir, f"events_4624.{day}.jsonl")
+            day_start = (now - timedelta(days=day)).replace(hour=0, minute=0, second=0, microsecond=0)
+            step = timedelta(days=1) / args.events_per_day
+            for i in range(args.events_per_day):
+                user = f"user{i % 200}"
+                logon_type = ("2", "7", "10", "15")[i % 4]
+                event = {
+                    "time": (day_start + i * step).isoformat(),
+                    "summary": f"Пользователь: {user}, Тип: {logon_type}, Домен: DOMAIN",
+                    "event_id": 4624, "user": user, "domain": "DOMAIN", "logon_type": logon_type
+                }
+                store.append(day_log, event)
+                store.append(all_log, event)
+            store.flush()
+            archive.archive_log(day_log, "events_4624")
+        store.close()
+        total = args.days * args.events_per_day
+        print(f"Архивирование {total} событий: {time.perf_counter() - started:.3f} с")
+
+        segment_size = sum(os.path.getsize(os.path.join(archive.directory, "events_4624", name))
+                           for name in os.listdir(os.path.join(archive.directory, "events_4624")))
+        print(f"Размер: JSON Lines {os.path.getsize(all_log) / 2**20:.1f} МБ, архив {segment_size / 2**20:.1f} МБ")
+
+        since = now - timedelta(days=30)
+        started = time.perf_counter()
+        found = archive.query("events_4624", since=since, event_id=4624, logon_type="10", user="user42")
+        elapsed = time.perf_counter() - started
+        print(f"Запрос к архиву: {len(found)} событий за {elapsed * 1000:.1f} мс")
+
+        started = time.perf_counter()
+        scanned = [event for event in iter_events(all_log)
+                   if datetime.fromisoformat(event["time"]) >= since and event["event_id"] == 4624
+                   and event["logon_type"] == "10" and event["user"] == "user42"]
+        elapsed = time.perf_counter() - started
+        print(f"Просмотр JSON Lines: {len(scanned)} событий за {elapsed * 1000:.1f} мс")
+
+
+# Замер параллельного чтения каналов: источник с блокирующей задержкой на каждую пачку записей,
+# как у EvtNext/ReadEventLog; одновременно проверяется, что цикл событий не простаивает
+def bench_collect(args):
+    from event_source import MemoryEventSource, SECURITY_CHANNEL, SYSTEM_CHANNEL, SYSMON_CHANNEL
+    from scanner import EventScanner
+
+    class SlowEventSource(MemoryEventSource):
+        def read_channel(self, channel, since, after=None, query=None):
+            for i, record in enumerate(super().read_channel(channel, since, after, query)):
+                if i % args.batch == 0:
+                    time.sleep(args.delay * CHANNEL_COST[channel])
+                yield record
+
+    CHANNEL_COST = {SECURITY_CHANNEL: 1.0, SYSTEM_CHANNEL: 0.5, SYSMON_CHANNEL: 2.0}
+    source = SlowEventSource()
+    for channel in CHANNEL_COST:
+        for i in range(args.records):
+            source.add(channel, 4624 if channel == SECURITY_CHANNEL else 1, [str(i)])
+
+    async def run(max_workers):
+        scanner = EventScanner(source, max_workers=max_workers)
+        handled = []
+
+        async def handler(records):
+            handled.append(len(records))
+
+        scanner.register("bench", {channel: [4624, 1] for channel in CHANNEL_COST}, handler)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker_task = asyncio.create_task(ticker())
+        since = datetime.now(dt.timezone.utc) - timedelta(days=1)
+        started = time.perf_counter()
+        await scanner.scan(since)
+        elapsed = time.perf_counter() - started
+        ticker_task.cancel()
+        scanner.close()
+        print(f"Потоков {max_workers}: {elapsed:.3f} с, записей {sum(handled)},"
+              f" срабатываний таймера цикла событий {ticks} (ожидалось ~{elapsed / 0.01:.0f})")
+
+    for max_workers in sorted({1, args.workers}):
+        asyncio.run(run(max_workers))
+
+
+# Замер сборщика: имитируемые компьютеры с сетевой задержкой чтения, обработчики только считают записи;
+# сравнивается время прохода по всем компьютерам при разной степени параллельности
+def bench_hosts(args):
+    from collector import HostCollector
+    from cursor_store import CursorStore
+    from event_source import SimulatedEventSource, SECURITY_CHANNEL, SYSTEM_CHANNEL, SYSMON_CHANNEL
+    from scanner import EventScanner
+
+    hosts = [{"name": f"sim{number:03d}", "server": None} for number in range(1, args.hosts + 1)]
+
+    async def run(max_parallel, directory):
+        handled = {}
+
+        def make_scanner(host, executor, handler_lock, send_message_func):
+            source = SimulatedEventSource(host["name"], args.events_per_minute, args.latency)
+            cursors = CursorStore(os.path.join(directory, f"{host['name']}.json"))
+            scanner = EventScanner(source, cursors, executor=executor, handler_lock=handler_lock)
+
+            async def handler(records):
+                handled[host["name"]] = handled.get(host["name"], 0) + len(records)
+
+            scanner.register("bench", {SECURITY_CHANNEL: [4624], SYSTEM_CHANNEL: [7036], SYSMON_CHANNEL: [1]},
+                             handler)
+            return scanner
+
+        async def send_message(message):
+            pass
+
+        async def flush(send_message_func):
+            pass
+
+        collector = HostCollector(hosts, make_scanner, send_message, flush, 1, max_parallel=max_parallel)
+        rounds = []
+        try:
+            for _ in range(args.rounds):
+                elapsed, _ = await collector.run_once()
+                rounds.append(elapsed)
+        finally:
+            collector.close()
+        print(f"Параллельно {max_parallel} компьютеров: проходы {', '.join(f'{r:.2f}' for r in rounds)} с,"
+              f" обработано записей {sum(handled.values())} с {len(handled)} компьютеров")
+
+    for max_parallel in sorted({1, args.parallel}):
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(run(max_parallel, directory))
+
+
+# Замер правил обнаружения: поток синтетических записей Security/System, большая часть которых
+# не интересна ни одному правилу (как в реальном журнале); сравнивается таблица EventID -> правила
+# с перебором всех правил для каждой записи
+def bench_rules(args):
+    import random
+    from event_source import EventRecord, SECURITY_CHANNEL, SYSTEM_CHANNEL
+    from rules import load_rules
+
+    rule_set = load_rules(args.rules)
+    rng = random.Random(1)
+    now = datetime.now(dt.timezone.utc)
+    users = [f"user{i}" for i in range(50)] + ["SYSTEM"]
+    records = []
+    for number in range(args.records):
+        kind = rng.random()
+        if kind < 0.2:
+            inserts = ["S-1-5-18", "WS$", "CORP", "0x3e7", "S-1-5-21-1", rng.choice(users), "CORP", "0x1234",
+                       rng.choice(["2", "3", "3", "3", "5", "7", "10"]), "User32"]
+            records.append(EventRecord(SECURITY_CHANNEL, number, 4624, now, inserts))
+        elif kind < 0.25:
+            inserts = ["S-1-5-21-1", rng.choice(users), "CORP", "0x1234", "SeDebugPrivilege\r\nSeBackupPrivilege"]
+            records.append(EventRecord(SECURITY_CHANNEL, number, 4672, now, inserts))
+        elif kind < 0.26:
+            records.append(EventRecord(SYSTEM_CHANNEL, number, 7045, now, ["svc", "C:\\svc.exe", "2", "own", "LocalSystem",
+                                                                            rng.choice(users)]))
+        else:
+            # Неинтересные события: выход, фильтрация WFP, проверка учетных данных
+            event_id = rng.choice([4634, 5156, 5158, 4776, 4688])
+            records.append(EventRecord(SECURITY_CHANNEL, number, event_id, now, ["x"] * 12))
+
+    started = time.perf_counter()
+    matched = sum(len(rule_set.match(record)) for record in records)
+    elapsed = time.perf_counter() - started
+    print(f"Таблица EventID: {len(records)} записей за {elapsed:.3f} с ({len(records) / elapsed:,.0f} записей/с),"
+          f" совпадений {matched}")
+
+    started = time.perf_counter()
+    matched = 0
+    for record in records:
+        for rule in rule_set.rules:
+            if rule.event_id == record.event_id and rule.channel == record.channel and rule.match(record) is not None:
+                matched += 1
+    elapsed = time.perf_counter() - started
+    print(f"Перебор правил: {len(records)} записей за {elapsed:.3f} с ({len(records) / elapsed:,.0f} записей/с),"
+          f" совпадений {matched}")
+
+
+# Замер отбора событий Sysmon на сервере: доставка каждой записи в Python стоит времени (EvtNext и
+# EvtRender), поэтому источник ждёт render_us на запись; сравнивается чтение с запросом по EventID
+# и чтение всего канала с отбором в Python
+def bench_query(args):
+    from cursor_store import CursorStore
+    from event_source import MemoryEventSource, SYSMON_CHANNEL, record_from_xml
+    from scanner import EventScanner
+    from sysmon_decoder import decode_process_create
+
+    class RenderingEventSource(MemoryEventSource):
+        def __init__(self, server_filter):
+            super().__init__()
+            self.server_filter = server_filter
+
+        def read_channel(self, channel, since, after=None, query=None):
+            records = super().read_channel(channel, since, after, query if self.server_filter else None)
+            for i, record in enumerate(records):
+                if i % 100 == 0:
+                    time.sleep(args.render_us * 100 / 1e6)
+                yield record
+
+    start_time = datetime.now(dt.timezone.utc)
+    xml_corpus = []
+    for i in range(args.events):
+        event_time = start_time + timedelta(milliseconds=i)
+        xml_corpus.append(SYSMON_XML_TEMPLATE.format(
+            event_id=(1, 3, 3, 3, 5, 7, 7, 11, 11, 13)[i % 10],
+            time=event_time.strftime("%Y-%m-%dT%H:%M:%S.%f0Z"),
+            utc=event_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            record=i + 1
+        ))
+
+    async def run(server_filter, directory):
+        source = RenderingEventSource(server_filter)
+        for xml in xml_corpus:
+            record = record_from_xml(SYSMON_CHANNEL, xml)
+            source.add(SYSMON_CHANNEL, record.event_id, time=record.time, xml=xml)
+        cursors = CursorStore(os.path.join(directory, "cursors.json"))
+        cursors.set(SYSMON_CHANNEL, 0)
+        scanner = EventScanner(source, cursors)
+        decoded = 0
+
+        async def handler(records):
+            nonlocal decoded
+            decoded += sum(1 for record in records if decode_process_create(record.xml) is not None)
+
+        scanner.register("bench", {SYSMON_CHANNEL: [1]}, handler)
+        started = time.perf_counter()
+        await scanner.scan(start_time)
+        elapsed = time.perf_counter() - started
+        scanner.close()
+        print(f"{'Отбор на сервере' if server_filter else 'Отбор в Python'}: {elapsed:.3f} с,"
+              f" событий ID 1: {decoded} (запрос {scanner.channel_query(SYSMON_CHANNEL)})")
+
+    for server_filter in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(run(server_filter, directory))
+
+
+# Замер агрегации повторных запусков: сборка запускает args.burst процессов cl.exe за минуту на фоне
+# обычных запусков; без агрегации каждое событие - оповещение (и проверка VirusTotal для нового хэша)
+def bench_burst(args):
+    import random
+    from burst import ALERT, BurstDetector
+
+    rng = random.Random(1)
+    start = datetime.now(dt.timezone.utc).timestamp()
+    users = [f"S-1-5-21-{i}" for i in range(20)]
+    images = [f"C:\\Program Files\\App{i}\\app{i}.exe" for i in range(args.images)]
+    events = []
+    for _ in range(args.background):
+        image = rng.randrange(args.images)
+        events.append((start + rng.random() * args.minutes * 60, ("", images[image], f"{image:064x}", rng.choice(users))))
+    cl_key = ("", "C:\\BuildTools\\cl.exe", "c1" * 32, users[0])
+    burst_start = start + args.minutes * 30
+    for _ in range(args.burst):
+        events.append((burst_start + rng.random() * 60, cl_key))
+    events.sort(key=lambda event: event[0])
+
+    detector = BurstDetector()
+    alerts = spikes = rollups = 0
+    started = time.perf_counter()
+    for timestamp, key in events:
+        decision, spike_started = detector.observe(key, timestamp)
+        alerts += decision == ALERT
+        spikes += spike_started
+        if detector.rollup(timestamp) is not None:
+            rollups += 1
+    elapsed = time.perf_counter() - started
+    print(f"Событий: {len(events)} за {elapsed:.3f} с ({elapsed / len(events) * 1e6:.2f} мкс/событие), ключей {len(detector.keys)}")
+    print(f"Сообщений без агрегации: {len(events)}, с агрегацией: {alerts + spikes + rollups}"
+          f" (первых запусков {alerts}, всплесков {spikes}, сводок {rollups})")
+
+    # Стоимость события не зависит от числа ключей: переполнение вытесняет давно не встречавшиеся
+    detector = BurstDetector(max_keys=1000)
+    started = time.perf_counter()
+    for number in range(args.background):
+        detector.observe(("", f"C:\\tmp\\{number}.exe", "", ""), start + number * 0.01)
+    elapsed = time.perf_counter() - started
+    print(f"Уникальные процессы: {args.background} за {elapsed:.3f} с ({elapsed / args.background * 1e6:.2f} мкс/событие),"
+          f" ключей в памяти {len(detector.keys)}")
+
+
+# Замер корреляции сеансов входа: перемешанные во времени сеансы на нескольких компьютерах (вход, привилегии,
+# задачи, службы, запуски процессов) проходят через правила и корреляцию, как в обработчиках; выдача - раз
+# в --flush секунд времени событий. Сравнивается число сообщений без корреляции и с ней
+def bench_correlation(args):
+    import random
+    import tracemalloc
+    from correlation import PROCESS_EVENT_ID, Correlator, SessionEvent
+    from event_source import EventRecord, SECURITY_CHANNEL, SYSTEM_CHANNEL
+    from rules import load_rules
+
+    rule_set = load_rules(args.rules)
+    rng = random.Random(1)
+    start = datetime.now(dt.timezone.utc) - timedelta(minutes=args.minutes)
+    hosts = [f"WS{number:03d}" for number in range(args.hosts)]
+    users = [f"user{number}" for number in range(200)]
+    events = []  # (время, компьютер, запись или None для запуска процесса, LogonId)
+    for number in range(args.sessions):
+        host = rng.choice(hosts)
+        user = rng.choice(users)
+        sid = f"S-1-5-21-1000-{users.index(user)}"
+        logon_id = f"0x{number + 0x10000:x}"
+        at = start + timedelta(seconds=rng.random() * args.minutes * 60)
+        logon_type = rng.choice(["2", "7", "10", "10"])
+        session = [(at, 4624, ["S-1-5-18", f"{host}$", "CORP", "0x3e7", sid, user, "CORP", logon_id, logon_type,
+                               "User32", "Negotiate", host])]
+        if rng.random() < 0.5:
+            at += timedelta(seconds=rng.random() * 2)
+            session.append((at, 4672, [sid, user, "CORP", logon_id, "SeDebugPrivilege\r\n\t\t\tSeBackupPrivilege"]))
+            if rng.random() < 0.3:
+                at += timedelta(seconds=rng.random() * 120)
+                session.append((at, 4698, [sid, user, "CORP", logon_id, f"\\Task{number}", "<Task/>"]))
+            if rng.random() < 0.2:
+                at += timedelta(seconds=rng.random() * 30)
+                session.append((at, 7045, [f"svc{number}", "C:\\svc.exe", "demand start", "user mode service",
+                                           "LocalSystem", user]))
+        for _ in range(rng.randrange(args.processes + 1)):
+            session.append((at + timedelta(seconds=rng.random() * 40), PROCESS_EVENT_ID, None))
+        for event_time, event_id, inserts in session:
+            if event_id == PROCESS_EVENT_ID:
+                events.append((event_time, host, None, logon_id))
+            else:
+                channel = SYSTEM_CHANNEL if event_id == 7045 else SECURITY_CHANNEL
+                events.append((event_time, host, EventRecord(channel, 0, event_id, event_time, inserts), logon_id))
+    # Фон: сетевые входы (не проходят правила) и запуски процессов вне отслеживаемых сеансов
+    for _ in range(args.background):
+        event_time = start + timedelta(seconds=rng.random() * args.minutes * 60)
+        inserts = ["S-1-5-18", "WS$", "CORP", "0x3e7", "S-1-5-21-1", rng.choice(users), "CORP",
+                   f"0x{rng.getrandbits(32):x}", "3", "NtLmSsp", "NTLM", "SRV"]
+        events.append((event_time, rng.choice(hosts), EventRecord(SECURITY_CHANNEL, 0, 4624, event_time, inserts), None))
+    events.sort(key=lambda event: event[0])
+
+    def run(correlator):
+        alerts = messages = peak = 0
+        next_flush = None
+        for event_time, host, record, logon_id in events:
+            timestamp = event_time.timestamp()
+            if next_flush is None:
+                next_flush = timestamp + args.flush
+            elif timestamp >= next_flush:
+                messages += len(correlator.flush(timestamp))
+                peak = max(peak, len(correlator.sessions))
+                next_flush = timestamp + args.flush
+            if record is None:
+                alerts += 1
+                event = SessionEvent(timestamp, PROCESS_EVENT_ID, "Запуск процесса", "C:\\Tools\\tool.exe", "сообщение")
+                if not correlator.observe(host, logon_id, event, opens=False):
+                    messages += 1
+                continue
+            for rule, values in rule_set.match(record):
+                message = rule.format_message(record, values) if rule.alerts(values) else None
+                alerts += message is not None
+                event = SessionEvent(timestamp, rule.event_id, rule.name, rule.log_entry(record, values)["summary"],
+                                     message)
+                if values.get("logon_id"):
+                    taken = correlator.observe(host, values["logon_id"], event, values.get("user"),
+                                               values.get("domain"), values.get("logon_type"))
+                else:
+                    taken = message is not None and correlator.observe_host(host, event)
+                if not taken and message is not None:
+                    messages += 1
+        messages += len(correlator.flush_all())
+        return alerts, messages, max(peak, len(correlator.sessions))
+
+    # Правила без корреляции - для цены корреляции на событие
+    started = time.perf_counter()
+    for _, _, record, _ in events:
+        if record is not None:
+            for rule, values in rule_set.match(record):
+                rule.log_entry(record, values)
+                if rule.alerts(values):
+                    rule.format_message(record, values)
+    baseline = time.perf_counter() - started
+
+    started = time.perf_counter()
+    alerts, messages, peak = run(Correlator())
+    elapsed = time.perf_counter() - started
+    print(f"Событий: {len(events)} (сеансов {args.sessions}, компьютеров {args.hosts}) за {elapsed:.3f} с"
+          f" ({elapsed / len(events) * 1e6:.2f} мкс/событие, из них корреляция"
+          f" {(elapsed - baseline) / len(events) * 1e6:.2f} мкс), сеансов в памяти не больше {peak}")
+    print(f"Сообщений без корреляции: {alerts}, с корреляцией: {messages}")
+
+    # Память и стоимость события ограничены: при переполнении вытесняются давно не активные сеансы
+    def fill(correlator):
+        timestamp = start.timestamp()
+        for number in range(args.unique):
+            event = SessionEvent(timestamp + number * 0.01, 4624, "Вход пользователя", "Пользователь: user, Тип: 10")
+            correlator.observe("WS001", f"0x{number:x}", event, "user", "CORP", "10")
+            if number % 1000 == 0:
+                correlator.flush(timestamp + number * 0.01)
+
+    correlator = Correlator(max_sessions=args.max_sessions)
+    started = time.perf_counter()
+    fill(correlator)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    fill(Correlator(max_sessions=args.max_sessions))
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Разные сеансы: {args.unique} за {elapsed:.3f} с ({elapsed / args.unique * 1e6:.2f} мкс/событие),"
+          f" сеансов в памяти {len(correlator.sessions)}, пик памяти {peak_memory / 1024 / 1024:.1f} МБ")
+
+
+# Замер догоняющего чтения: синтетическая история журналов за --hours часов, курсоры - на начале истории;
+# обработчики только считают записи и оповещения. Проверяется размер пачки, соблюдение ограничения
+# скорости и передача последних --window минут обычному режиму
+def bench_backfill(args):
+    import contextlib
+    from backfill import BacklogSummary, CatchUp
+    from cursor_store import CursorStore
+    from event_source import MemoryEventSource
+    from replay import generate_records
+    from scanner import EventScanner
+
+    records = generate_records(args.hours * 60, seed=1)
+    source = MemoryEventSource()
+    for record in records:
+        source.records.setdefault(record.channel, []).append(record)
+    first_timestamp = records[0].timestamp
+
+    async def run(max_rate, directory):
+        cursors = CursorStore(os.path.join(directory, "cursors.json"))
+        for channel in source.records:
+            cursors.set(channel, 0)
+        scanner = EventScanner(source, cursors)
+        sent = []
+        summary = BacklogSummary(lambda message: sent.append(message))
+        chunk_sizes = []
+
+        async def handler(batch):
+            chunk_sizes.append(len(batch))
+            for record in batch:
+                await summary.send_message(f"Событие {record.event_id}: {record.record_number}")
+
+        routes = {}
+        for record in records:
+            routes.setdefault(record.channel, set()).add(record.event_id)
+        scanner.register("bench", {channel: sorted(event_ids) for channel, event_ids in routes.items()}, handler)
+        summary.track(scanner)
+        catch_up = CatchUp(scanner, args.window, chunk_records=args.chunk, max_rate=max_rate)
+        with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+            processed = await catch_up.run()
+        left = sum(1 for record in records if record.record_number > cursors.get(record.channel))
+        read = sum(backlog.read for backlog in catch_up.channels)
+        print(f"Ограничение {max_rate:,.0f} записей/с: прочитано {read}, обработано {processed} за {catch_up.elapsed:.3f} с"
+              f" ({read / catch_up.elapsed:,.0f} записей/с), пачек {len(chunk_sizes)},"
+              f" наибольшая у обработчика {max(chunk_sizes)} записей (все каналы); оповещений {summary.total} -> сообщений {len(sent) + 1}")
+        expected_left = sum(1 for record in records if record.timestamp >= catch_up.cutoff)
+        print(f"  обычному режиму оставлено {left} записей (за последние {args.window} мин: {expected_left})")
+
+    print(f"История: {len(records)} записей за {args.hours} ч"
+          f" (с {datetime.fromtimestamp(first_timestamp, dt.timezone.utc):%Y-%m-%d %H:%M} UTC)")
+    for max_rate in (float("inf"), args.rate):
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(run(max_rate, directory))
+
+
+# Замер списка разрешенных хэшей: построение индекса, размер файла, проверка известных и неизвестных хэшей
+# и память процесса после открытия (хэши остаются в отображенном файле)
+def bench_allowlist(args):
+    import tracemalloc
+    from allowlist import Allowlist, build_index
+
+    hashes = [os.urandom(32) for _ in range(args.hashes)]
+    with tempfile.TemporaryDirectory() as directory:
+        index_file = os.path.join(directory, "allowlist.idx")
+        started = time.perf_counter()
+        build_index(index_file, hashes)
+        elapsed = time.perf_counter() - started
+        print(f"Построение: {args.hashes} хэшей за {elapsed:.2f} с, файл {os.path.getsize(index_file) / 2**20:.1f} МБ")
+
+        tracemalloc.start()
+        allowlist = Allowlist(index_file)
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"Память после открытия: {memory / 2**10:.0f} КБ")
+
+        known = [digest.hex().upper() for digest in hashes[:args.lookups]]
+        unknown = [os.urandom(32).hex().upper() for _ in range(args.lookups)]
+        for title, values in (("Известные", known), ("Неизвестные", unknown)):
+            started = time.perf_counter()
+            found = sum(value in allowlist for value in values)
+            elapsed = time.perf_counter() - started
+            print(f"{title}: {len(values)} проверок за {elapsed:.3f} с ({elapsed / len(values) * 1e6:.2f} мкс),"
+                  f" найдено {found}")
+        allowlist.close()
+
+
+# Замер сохранения состояния пачек: каждое хранилище пишет и сбрасывает на диск само (как до единицы работы)
+# против единицы работы с одной записью журнала на пачку; считаются открытия файлов, fsync и замены файлов
+def bench_journal(args):
+    import builtins
+    import contextlib
+    import json
+    import uuid
+    from cursor_store import CursorStore, atomic_write_json
+    from guid_index import GuidIndex
+    from journal import UnitOfWork, JOURNAL_FILE
+
+    categories = [f"events_{name}.jsonl" for name in ("4624", "4672", "service", "sysmon")]
+    now = datetime.now(dt.timezone.utc)
+    batches = []
+    for number in range(args.batches):
+        events = [(categories[i % len(categories)], {
+            "time": (now + timedelta(seconds=number, microseconds=i)).isoformat(),
+            "summary": f"Пользователь: user{i % 50}, Тип: 2, Домен: DOMAIN", "user": f"user{i % 50}"
+        }) for i in range(args.events)]
+        guids = [f"{{{uuid.uuid4()}}}".upper() for _ in range(args.guids)]
+        batches.append((events, guids))
+
+    calls = {"open": 0, "fsync": 0, "replace": 0}
+    real_open, real_fsync, real_replace = builtins.open, os.fsync, os.replace
+
+    def counted(name, func):
+        def wrapper(*func_args, **kwargs):
+            calls[name] += 1
+            return func(*func_args, **kwargs)
+        return wrapper
+
+    def run(directory, use_unit):
+        unit = UnitOfWork(os.path.join(directory, JOURNAL_FILE)) if use_unit else None
+        cursors = CursorStore(os.path.join(directory, "cursors.json"))
+        index = GuidIndex(os.path.join(directory, "seen"))
+        check_file = os.path.join(directory, "last_check.log")
+        for number, (events, guids) in enumerate(batches):
+            lines = {}
+            for category, event in events:
+                lines.setdefault(os.path.join(directory, category), []).append(
+                    (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+            for guid in guids:
+                index.add(guid, now)
+            cursors.set("Security", number + 1)
+            if use_unit:
+                for file_name, data in lines.items():
+                    unit.append(file_name, b"".join(data))
+                index.flush(unit)
+                unit.replace(check_file, now.isoformat().encode("utf-8"))
+                cursors.commit(unit)
+                unit.commit()
+            else:
+                for file_name, data in lines.items():
+                    with open(file_name, "ab") as f:
+                        f.write(b"".join(data))
+                        f.flush()
+                        os.fsync(f.fileno())
+                index.flush()
+                with open(check_file, "w") as f:
+                    f.write(now.isoformat())
+                cursors.commit()
+        if use_unit:
+            unit.close()
+        return sum(os.path.getsize(os.path.join(directory, category)) for category in categories)
+
+    print(f"{args.batches} пачек: {args.events} событий, {args.guids} GUID, курсор и время проверки в каждой")
+    results = {}
+    for title, use_unit in (("по отдельности", False), ("единица работы", True)):
+        with tempfile.TemporaryDirectory() as directory:
+            calls.update(open=0, fsync=0, replace=0)
+            builtins.open, os.fsync, os.replace = (counted("open", real_open), counted("fsync", real_fsync),
+                                                   counted("replace", real_replace))
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    started = time.perf_counter()
+                    size = run(directory, use_unit)
+                    elapsed = time.perf_counter() - started
+            finally:
+                builtins.open, os.fsync, os.replace = real_open, real_fsync, real_replace
+            results[title] = dict(calls)
+            print(f"{title:<16} {elapsed:.3f} с ({elapsed / args.batches * 1000:.2f} мс на пачку), "
+                  f"open {calls['open']}, fsync {calls['fsync']}, replace {calls['replace']}, логи {size} байт")
+    before, after = results["по отдельности"], results["единица работы"]
+    print(f"fsync на пачку: {before['fsync'] / args.batches:.1f} -> {after['fsync'] / args.batches:.2f}")
+
+
+# Функция сводки замеров: скорость по всем событиям и задержка обработки пачки (мс)
+def _suite_result(events, durations):
+    durations = sorted(durations)
+    total = sum(durations)
+    return {
+        "events": events,
+        "events_per_sec": round(events / total, 1) if total else None,
+        "p50_ms": round(durations[len(durations) // 2] * 1000, 3) if durations else None,
+        "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000, 3) if durations else None
+    }
+
+
+# Сводный замер: чтение через эмуляцию win32evtlog, обработчики по пачкам, накопительный лог,
+# PDF-отчет и конвейер VirusTotal (против локальной заглушки). Результаты дописываются в args.results
+# и сравниваются с последним запуском с теми же параметрами
+def bench_suite(args):
+    import contextlib
+    import json
+    import event_logger
+    from event_source import Win32EventSource, ChannelQuery, SECURITY_CHANNEL, SYSTEM_CHANNEL, SYSMON_CHANNEL
+    from replay import EmulatedWin32EvtLog, emulated_win32evtlog, generate_records
+    from virustotal import VirusTotalClient, VerdictCache
+
+    records = generate_records(args.minutes, SUITE_RATES, seed=args.seed)
+    rule_set = event_logger.load_rule_set()
+    since = min(record.time for record in records)
+    results = {}
+    sent = []
+
+    async def send_message(message):
+        sent.append(message)
+
+    async def send_document(file_path):
+        sent.append(file_path)
+
+    def batches(selected):
+        return [selected[start:start + args.batch] for start in range(0, len(selected), args.batch)]
+
+    async def measure(name, handler, selected):
+        durations = []
+        for batch in batches(selected):
+            started = time.perf_counter()
+            await handler(batch)
+            durations.append(time.perf_counter() - started)
+        results[name] = _suite_result(len(selected), durations)
+
+    async def run(directory):
+        # Чтение: классический канал целиком и канал EvtQuery с запросом по EventID
+        with emulated_win32evtlog(EmulatedWin32EvtLog(records)):
+            source = Win32EventSource()
+            for name, channel, query in (("read_classic", SECURITY_CHANNEL, None),
+                                         ("read_evtquery", SYSMON_CHANNEL, ChannelQuery([1]))):
+                started = time.perf_counter()
+                count = sum(1 for _ in source.read_channel(channel, since, after=0, query=query))
+                results[name] = _suite_result(count, [time.perf_counter() - started])
+
+        by_id = {}
+        for record in records:
+            by_id.setdefault(record.event_id, []).append(record)
+        rule_records = [record for record in records if record.event_id in rule_set.table]
+
+        await measure("startup", lambda batch: event_logger.handle_system_startup(batch, send_message, send_document),
+                      by_id.get(6005, []))
+        await measure("rules", lambda batch: event_logger.handle_rule_events(batch, rule_set, send_message),
+                      rule_records)
+        await measure("sysmon", lambda batch: event_logger.handle_sysmon_process(batch, send_message),
+                      by_id.get(1, []))
+
+        durations = []
+        for number in range(args.log_events):
+            started = time.perf_counter()
+            await event_logger.log_event_to_json("events_bench.jsonl", {
+                "time": since.isoformat(), "summary": f"Пользователь: user{number % 50}", "user": f"user{number % 50}"
+            }, send_message)
+            durations.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await event_logger.flush_event_logs(send_message)
+        durations.append(time.perf_counter() - started)
+        results["log_event_to_json"] = _suite_result(args.log_events, durations)
+
+        logged = sum(1 for file_name, _, _ in event_logger.REPORT_CATEGORIES if os.path.exists(file_name)
+                     for _ in open(file_name, encoding="utf-8"))
+        started = time.perf_counter()
+        await event_logger.generate_pdf_report(since.date(), send_message, send_document)
+        await event_logger.wait_pdf_reports()
+        results["generate_pdf_report"] = _suite_result(logged, [time.perf_counter() - started])
+
+        # VirusTotal: задержка - от постановки хэша до вердикта
+        server = start_vt_stub(args.vt_delay)
+        submitted = {}
+        latencies = []
+
+        async def on_verdict(sha256, verdict, contexts):
+            latencies.append(time.perf_counter() - submitted[sha256])
+
+        cache = VerdictCache(os.path.join(directory, "vt_bench.sqlite3"))
+        client = VirusTotalClient("bench", cache, on_verdict,
+                                  api_url=f"http://127.0.0.1:{server.server_port}/api/v3/files/{{}}",
+                                  requests_per_minute=args.vt_quota, concurrency=8)
+        client.start()
+        started = time.perf_counter()
+        for number in range(args.vt_lookups):
+            sha256 = f"{number % (args.vt_lookups // 4 or 1) + 1:064x}"
+            submitted.setdefault(sha256, time.perf_counter())
+            client.submit(sha256, f"process{number}.exe")
+        await client.stop(timeout=600)
+        elapsed = time.perf_counter() - started
+        cache.close()
+        server.shutdown()
+        results["vt"] = _suite_result(args.vt_lookups, latencies)
+        results["vt"]["events_per_sec"] = round(args.vt_lookups / elapsed, 1)
+
+    cwd = os.getcwd()
+    results_file = os.path.abspath(args.results)
+    with tempfile.TemporaryDirectory() as directory:
+        # Обработчики пишут состояние и логи в текущий каталог
+        os.chdir(directory)
+        try:
+            with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+                asyncio.run(run(directory))
+        finally:
+            event_logger.EVENT_STORE.close()
+            os.chdir(cwd)
+
+    params = {"minutes": args.minutes, "batch": args.batch, "seed": args.seed, "log_events": args.log_events,
+              "vt_lookups": args.vt_lookups, "vt_delay": args.vt_delay, "vt_quota": args.vt_quota}
+    history = []
+    if os.path.exists(results_file):
+        with open(results_file, "r", encoding="utf-8") as f:
+            history = json.load(f)
+    previous = next((run for run in reversed(history) if run["params"] == params), None)
+
+    regressions = []
+    print(f"{'Замер':<22}{'событий':>9}{'событий/с':>14}{'p50, мс':>11}{'p95, мс':>11}  изменение")
+    for name, result in results.items():
+        change = ""
+        before = previous["results"].get(name) if previous else None
+        if before and before["events_per_sec"] and result["events_per_sec"]:
+            ratio = result["events_per_sec"] / before["events_per_sec"] - 1
+            change = f"{ratio:+.0%}"
+            if ratio < -args.tolerance:
+                change += " ⚠️ регрессия"
+                regressions.append(name)
+        print(f"{name:<22}{result['events']:>9}{result['events_per_sec'] or 0:>14,.0f}"
+              f"{result['p50_ms'] or 0:>11.3f}{result['p95_ms'] or 0:>11.3f}  {change}")
+    print(f"Сообщений отправлено бы: {len(sent)}")
+
+    history.append({"time": datetime.now(dt.timezone.utc).isoformat(), "params": params, "results": results})
+    with open(results_file, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=1)
+    print(f"Результаты добавлены в {args.results}" +
+          (f" (сравнение с запуском {previous['time']})" if previous else ""))
+    if regressions and args.strict:
+        raise SystemExit(f"Регрессии: {', '.join(regressions)}")
+
+
+# Замер запуска: python -X importtime -c "import main" (медиана по нескольким запускам) против
+# STARTUP_BUDGET_MS и проверка, что тяжелые зависимости не загружаются при старте
+def bench_startup(args):
+    import statistics
+    import subprocess
+    import sys
+
+    code = "import sys, main; print(' '.join(sys.modules))"
+    totals = []
+    for _ in range(args.runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                                capture_output=True, text=True, check=True)
+        # Строки importtime: "import time: собственное | накопленное | имя" (вложенность - отступом имени)
+        entries = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                entries.append((int(cumulative), len(name) - len(name.lstrip()), name.strip()))
+        main_index = next(index for index, (_, depth, name) in enumerate(entries) if name == "main" and depth == 1)
+        totals.append(entries[main_index][0] / 1000)
+        loaded = set(result.stdout.split())
+    # Вложенные модули печатаются перед родителем: прямые импорты main - от предыдущего модуля верхнего уровня
+    start = max((index for index, (_, depth, _) in enumerate(entries[:main_index]) if depth == 1), default=-1) + 1
+    children = [(cumulative, name) for cumulative, depth, name in entries[start:main_index] if depth == 3]
+
+    median = statistics.median(totals)
+    print(f"Импорт main: медиана {median:.1f} мс по {args.runs} запускам (бюджет {args.budget} мс)")
+    print("Самые дорогие прямые импорты main:")
+    for cumulative, name in sorted(children, reverse=True)[:args.top]:
+        print(f"  {name:<20}{cumulative / 1000:>8.1f} мс")
+    deferred = [name for name in STARTUP_DEFERRED if name in loaded]
+    if deferred:
+        print(f"⚠️ Загружены при старте: {', '.join(deferred)}")
+    if median > args.budget or deferred:
+        raise SystemExit("Бюджет запуска превышен")
+    print("Бюджет запуска соблюден")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочные замеры мониторинга")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    store_parser = subparsers.add_parser("store", help="Добавление событий в накопительный лог")
+    store_parser.add_argument("--events", type=int, default=100000)
+    store_parser.set_defaults(func=bench_store)
+
+    delivery_parser = subparsers.add_parser("delivery", help="Очередь доставки в Telegram (с имитацией бота)")
+    delivery_parser.add_argument("--messages", type=int, default=200)
+    delivery_parser.add_argument("--delay", type=float, default=0.05, help="Задержка одного запроса к Telegram (с)")
+    delivery_parser.set_defaults(func=bench_delivery)
+
+    vt_parser = subparsers.add_parser("vt", help="Конвейер VirusTotal против локальной заглушки")
+    vt_parser.add_argument("--lookups", type=int, default=200)
+    vt_parser.add_argument("--unique", type=int, default=40)
+    vt_parser.add_argument("--delay", type=float, default=0.2, help="Задержка ответа заглушки (с)")
+    vt_parser.add_argument("--quota", type=int, default=6000, help="Запросов в минуту")
+    vt_parser.add_argument("--concurrency", type=int, default=8)
+    vt_parser.set_defaults(func=bench_vt)
+
+    sysmon_parser = subparsers.add_parser("sysmon", help="Разбор XML событий Sysmon")
+    sysmon_parser.add_argument("--events", type=int, default=50000, help="Размер синтетического корпуса")
+    sysmon_parser.add_argument("--corpus", help="Записанная фикстура (JSON Lines) вместо синтетического корпуса")
+    sysmon_parser.set_defaults(func=bench_sysmon)
+
+    guids_parser = subparsers.add_parser("guids", help="Индекс обработанных ProcessGuid")
+    guids_parser.add_argument("--guids", type=int, default=1000000)
+    guids_parser.set_defaults(func=bench_guids)
+
+    report_parser = subparsers.add_parser("report", help="Построение PDF-отчета")
+    report_parser.add_argument("--events", type=int, default=100000)
+    report_parser.set_defaults(func=bench_report)
+
+    archive_parser = subparsers.add_parser("archive", help="Запрос к архиву событий по дням")
+    archive_parser.add_argument("--days", type=int, default=30)
+    archive_parser.add_argument("--events-per-day", type=int, default=10000)
+    archive_parser.set_defaults(func=bench_archive)
+
+    collect_parser = subparsers.add_parser("collect", help="Параллельное чтение каналов (медленный источник)")
+    collect_parser.add_argument("--records", type=int, default=2000, help="Записей в каждом канале")
+    collect_parser.add_argument("--batch", type=int, default=100, help="Записей на одну блокирующую задержку")
+    collect_parser.add_argument("--delay", type=float, default=0.05, help="Задержка на пачку (с)")
+    collect_parser.add_argument("--workers", type=int, default=3)
+    collect_parser.set_defaults(func=bench_collect)
+
+    hosts_parser = subparsers.add_parser("hosts", help="Сборщик с имитируемыми компьютерами")
+    hosts_parser.add_argument("--hosts", type=int, default=120)
+    hosts_parser.add_argument("--parallel", type=int, default=16)
+    hosts_parser.add_argument("--rounds", type=int, default=3)
+    hosts_parser.add_argument("--events-per-minute", type=int, default=60, help="Записей в минуту в каждом канале")
+    hosts_parser.add_argument("--latency", type=float, default=0.05, help="Задержка чтения канала (с)")
+    hosts_parser.set_defaults(func=bench_hosts)
+
+    rules_parser = subparsers.add_parser("rules", help="Правила обнаружения на синтетических записях")
+    rules_parser.add_argument("--records", type=int, default=500000)
+    rules_parser.add_argument("--rules", default="rules.json", help="Файл правил")
+    rules_parser.set_defaults(func=bench_rules)
+
+    query_parser = subparsers.add_parser("query", help="Отбор событий Sysmon на сервере (XPath) и в Python")
+    query_parser.add_argument("--events", type=int, default=50000)
+    query_parser.add_argument("--render-us", type=float, default=20, help="Стоимость доставки одной записи (мкс)")
+    query_parser.set_defaults(func=bench_query)
+
+    burst_parser = subparsers.add_parser("burst", help="Агрегация повторных запусков процессов")
+    burst_parser.add_argument("--burst", type=int, default=5000, help="Запусков cl.exe за минуту")
+    burst_parser.add_argument("--background", type=int, default=50000, help="Обычных запусков")
+    burst_parser.add_argument("--images", type=int, default=200, help="Разных обычных процессов")
+    burst_parser.add_argument("--minutes", type=int, default=60)
+    burst_parser.set_defaults(func=bench_burst)
+
+    correlation_parser = subparsers.add_parser("correlation", help="Корреляция событий по сеансам входа")
+    correlation_parser.add_argument("--sessions", type=int, default=5000, help="Сеансов входа")
+    correlation_parser.add_argument("--hosts", type=int, default=50)
+    correlation_parser.add_argument("--processes", type=int, default=6, help="Запусков процессов в сеансе (до)")
+    correlation_parser.add_argument("--background", type=int, default=100000, help="Сетевых входов вне правил")
+    correlation_parser.add_argument("--minutes", type=int, default=60)
+    correlation_parser.add_argument("--flush", type=float, default=10, help="Период выдачи сообщений (с)")
+    correlation_parser.add_argument("--unique", type=int, default=200000, help="Разных сеансов для замера памяти")
+    correlation_parser.add_argument("--max-sessions", type=int, default=5000)
+    correlation_parser.add_argument("--rules", default="rules.json")
+    correlation_parser.set_defaults(func=bench_correlation)
+
+    backfill_parser = subparsers.add_parser("backfill", help="Догоняющее чтение истории журналов пачками")
+    backfill_parser.add_argument("--hours", type=int, default=12, help="Длительность истории")
+    backfill_parser.add_argument("--chunk", type=int, default=2000, help="Записей канала в пачке")
+    backfill_parser.add_argument("--rate", type=float, default=20000, help="Ограничение скорости (записей/с)")
+    backfill_parser.add_argument("--window", type=int, default=1, help="Окно обычного режима (мин)")
+    backfill_parser.set_defaults(func=bench_backfill)
+
+    allowlist_parser = subparsers.add_parser("allowlist", help="Индекс списка разрешенных хэшей")
+    allowlist_parser.add_argument("--hashes", type=int, default=1000000)
+    allowlist_parser.add_argument("--lookups", type=int, default=100000)
+    allowlist_parser.set_defaults(func=bench_allowlist)
+
+    journal_parser = subparsers.add_parser("journal", help="Сохранение состояния пачек: по отдельности и единицей работы")
+    journal_parser.add_argument("--batches", type=int, default=500)
+    journal_parser.add_argument("--events", type=int, default=100, help="Событий в пачке")
+    journal_parser.add_argument("--guids", type=int, default=20, help="Новых ProcessGuid в пачке")
+    journal_parser.set_defaults(func=bench_journal)
+
+    suite_parser = subparsers.add_parser("suite", help="Все обработчики на синтетической записи, с историей результатов")
+    suite_parser.add_argument("--minutes", type=float, default=10, help="Длительность синтетической записи")
+    suite_parser.add_argument("--batch", type=int, default=100, help="Записей в пачке обработчика")
+    suite_parser.add_argument("--seed", type=int, default=1)
+    suite_parser.add_argument("--log-events", type=int, default=20000)
+    suite_parser.add_argument("--vt-lookups", type=int, default=200)
+    suite_parser.add_argument("--vt-delay", type=float, default=0.01, help="Задержка ответа заглушки (с)")
+    suite_parser.add_argument("--vt-quota", type=int, default=60000, help="Запросов в минуту")
+    suite_parser.add_argument("--results", default=BENCH_RESULTS_FILE, help="Файл истории результатов")
+    suite_parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                              help="Допустимое падение скорости (доля)")
+    suite_parser.add_argument("--strict", action="store_true", help="Код возврата 1 при регрессии")
+    suite_parser.set_defaults(func=bench_suite)
+
+    startup_parser = subparsers.add_parser("startup", help="Время импорта main.py (python -X importtime)")
+    startup_parser.add_argument("--runs", type=int, default=5)
+    startup_parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS, help="Бюджет (мс)")
+    startup_parser.add_argument("--top", type=int, default=10)
+    startup_parser.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
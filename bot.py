@@ -1,10 +1,74 @@
 import asyncio
-from telegram import Bot
+import json
+import os
+import time
+from datetime import timedelta
 from config import TELEGRAM_TOKEN, CHAT_ID
+from metrics import TELEGRAM_MESSAGES, TELEGRAM_QUEUE, STAGE_SECONDS
+
+# Настройки доставки сообщений
+DELIVERY_QUEUE_SIZE = 1000  # Ёмкость очереди исходящих сообщений
+CHAT_RATE_PER_SECOND = 1.0  # Сообщений в секунду в один чат (ограничение Telegram)
+CHAT_RATE_BURST = 3  # Сколько сообщений можно отправить подряд без ожидания
+MAX_MESSAGE_LENGTH = 4096  # Максимальная длина сообщения Telegram
+DIGEST_DELAY = 1.0  # Сколько ждать (с) попутных сообщений для объединения в сводку
+DIGEST_SEPARATOR = "\n\n"
+MAX_SEND_ATTEMPTS = 5  # Попыток отправки до отказа (сообщение остаётся в спуле и повторяется позже)
+RETRY_BASE_DELAY = 2.0  # Начальная задержка повтора при сетевых ошибках (с), удваивается
+SPOOL_FILE = "telegram_spool.jsonl"  # Неотправленные сообщения, переживают перезапуск
+SPOOL_COMPACT_LINES = 10000  # Спул переписывается без подтверждённых сообщений, когда их строк в нём столько
+SPOOL_RETRY_INTERVAL = 300  # Через сколько (с) повторять сообщения, не отправленные за MAX_SEND_ATTEMPTS попыток
+
+# Бот Telegram: python-telegram-bot загружается при первой отправке, а не при каждом запуске
+class LazyBot:
+    def __init__(self, token):
+        self.token = token
+        self._bot = None
+
+    def _get(self):
+        if self._bot is None:
+            from telegram import Bot
+            self._bot = Bot(token=self.token)
+        return self._bot
+
+    async def send_message(self, **kwargs):
+        return await self._get().send_message(**kwargs)
+
+    async def send_document(self, **kwargs):
+        return await self._get().send_document(**kwargs)
+
+
+# Ошибки Telegram на случай, когда python-telegram-bot не установлен (замеры и проверки с заглушкой бота)
+class FallbackRetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Превышен лимит, повтор через {retry_after} с")
+        self.retry_after = retry_after
+
+
+class FallbackBadRequest(Exception):
+    pass
+
+
+_telegram_errors = None  # (RetryAfter, BadRequest) - загружаются при первой отправке
+
+
+# Функция получения классов ошибок Telegram (загружаются один раз, вместе с ботом)
+def telegram_errors():
+    global _telegram_errors
+    if _telegram_errors is None:
+        try:
+            from telegram.error import RetryAfter, BadRequest
+            _telegram_errors = (RetryAfter, BadRequest)
+        except ImportError:
+            _telegram_errors = (FallbackRetryAfter, FallbackBadRequest)
+    return _telegram_errors
+
 
 # Инициализация бота
 try:
-    bot = Bot(token=TELEGRAM_TOKEN)
+    if not TELEGRAM_TOKEN or not isinstance(TELEGRAM_TOKEN, str):
+        raise ValueError("TELEGRAM_TOKEN не задан или имеет неверный тип")
+    bot = LazyBot(TELEGRAM_TOKEN)
     if not CHAT_ID or not isinstance(CHAT_ID, (str, int)):
         raise ValueError("CHAT_ID не задан или имеет неверный тип")
     print(f"Бот инициализирован с CHAT_ID: {CHAT_ID}")
@@ -12,20 +76,307 @@ except Exception as e:
     print(f"Ошибка инициализации бота: {e}")
     exit(1)
 
+
+# Ограничитель скорости «ведро с токенами»
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    # Пауза по требованию сервера (RetryAfter): токены обнуляются до истечения паузы
+    def pause(self, seconds):
+        self.tokens = -seconds * self.rate
+        self.updated = time.monotonic()
+
+
+# Функция разбиения длинного текста на части не длиннее MAX_MESSAGE_LENGTH
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+# Спул неотправленных сообщений: строки {"id", "chat_id", "text"} и отметки {"ack": id}.
+# Файл переписывается только с неподтверждёнными сообщениями при загрузке и по мере подтверждений
+# (когда подтвержденных строк в нем набирается compact_lines), поэтому в режиме службы он не растёт
+# бесконечно, а большая очередь неотправленных не переписывается при каждом подтверждении
+class MessageSpool:
+    def __init__(self, file_name=SPOOL_FILE, compact_lines=SPOOL_COMPACT_LINES):
+        self.file_name = file_name
+        self.compact_lines = compact_lines
+        self.next_id = 1
+        self.handle = None
+        self.pending = {}  # id -> неподтверждённое сообщение
+        self.lines = 0  # Строк в файле спула
+
+    # Чтение неподтверждённых сообщений и перезапись спула только с ними
+    def load(self):
+        pending = {}
+        if os.path.exists(self.file_name):
+            with open(self.file_name, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "ack" in entry:
+                        pending.pop(entry["ack"], None)
+                    else:
+                        pending[entry["id"]] = entry
+        self.pending = pending
+        self.next_id = max(pending, default=0) + 1
+        self.compact()
+        return list(pending.values())
+
+    # Перезапись спула только с неподтверждёнными сообщениями
+    def compact(self):
+        if self.handle:
+            self.handle.close()
+        tmp_name = f"{self.file_name}.tmp"
+        with open(tmp_name, "w", encoding="utf-8") as f:
+            for entry in self.pending.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_name, self.file_name)
+        self.lines = len(self.pending)
+        self.handle = open(self.file_name, "a", encoding="utf-8")
+
+    def _write(self, entry):
+        self.handle.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.handle.flush()
+        self.lines += 1
+
+    def add(self, chat_id, text):
+        entry = {"id": self.next_id, "chat_id": chat_id, "text": text}
+        self.next_id += 1
+        self.pending[entry["id"]] = entry
+        self._write(entry)
+        return entry
+
+    def ack(self, entry_ids):
+        for entry_id in entry_ids:
+            self.pending.pop(entry_id, None)
+            self._write({"ack": entry_id})
+        if self.lines - len(self.pending) >= self.compact_lines:
+            self.compact()
+
+    def close(self):
+        if self.handle:
+            os.fsync(self.handle.fileno())
+            self.handle.close()
+            self.handle = None
+
+
+# Очередь доставки: фоновая отправка с ограничением скорости по чатам,
+# объединением пачек в сводки, повторами и спулом на диске
+class DeliveryQueue:
+    # errors - классы ошибок (RetryAfter, BadRequest) бота; по умолчанию - из python-telegram-bot
+    def __init__(self, bot, chat_id, spool_file=SPOOL_FILE, queue_size=DELIVERY_QUEUE_SIZE, errors=None,
+                 retry_interval=SPOOL_RETRY_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.errors = errors
+        self.retry_interval = retry_interval
+        self.spool = MessageSpool(spool_file)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.buckets = {}
+        self.sender_task = None
+        self.retry_task = None
+        self.held = None  # Сообщение, не вошедшее в предыдущую сводку
+        self.failed = []  # Не отправленные за MAX_SEND_ATTEMPTS попыток (повторяются через retry_interval)
+
+    def bucket(self, chat_id):
+        if chat_id not in self.buckets:
+            self.buckets[chat_id] = TokenBucket(CHAT_RATE_PER_SECOND, CHAT_RATE_BURST)
+        return self.buckets[chat_id]
+
+    async def start(self):
+        pending = self.spool.load()
+        if pending:
+            print(f"Из спула {self.spool.file_name} восстановлено {len(pending)} неотправленных сообщений")
+        self.sender_task = asyncio.create_task(self._sender())
+        self.retry_task = asyncio.create_task(self._retry_failed())
+        for entry in pending:
+            await self.queue.put(entry)
+
+    async def put(self, text, chat_id=None):
+        entry = self.spool.add(chat_id or self.chat_id, text)
+        await self.queue.put(entry)
+        TELEGRAM_MESSAGES.inc(result="queued")
+        TELEGRAM_QUEUE.set(self.queue.qsize())
+
+    # Сборка сводки: сообщения одного чата, пришедшие в течение DIGEST_DELAY, до MAX_MESSAGE_LENGTH
+    async def _next_digest(self):
+        first = self.held or await self.queue.get()
+        self.held = None
+        entries = [first]
+        length = len(first["text"])
+        deadline = time.monotonic() + DIGEST_DELAY
+        while length < MAX_MESSAGE_LENGTH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and self.queue.empty():
+                break
+            try:
+                if self.queue.empty():
+                    entry = await asyncio.wait_for(self.queue.get(), timeout=remaining)
+                else:
+                    entry = self.queue.get_nowait()
+            except asyncio.TimeoutError:
+                break
+            added = len(DIGEST_SEPARATOR) + len(entry["text"])
+            if entry["chat_id"] != first["chat_id"] or length + added > MAX_MESSAGE_LENGTH:
+                self.held = entry
+                break
+            entries.append(entry)
+            length += added
+        return entries
+
+    async def _send_text(self, chat_id, text):
+        RetryAfter, BadRequest = self.errors or telegram_errors()
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            await self.bucket(chat_id).acquire()
+            try:
+                with STAGE_SECONDS.time(stage="telegram_send", name=""):
+                    await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                TELEGRAM_MESSAGES.inc(result="retry_after")
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                print(f"Превышен лимит Telegram, пауза {retry_after} с")
+                self.bucket(chat_id).pause(retry_after)
+            except BadRequest as e:
+                # Сообщение отклонено сервером - повтор не поможет
+                print(f"Сообщение отклонено Telegram: {e}")
+                return True
+            except Exception as e:
+                delay = RETRY_BASE_DELAY * 2 ** (attempt - 1)
+                print(f"Ошибка отправки сообщения (попытка {attempt}/{MAX_SEND_ATTEMPTS}): {e}")
+                await asyncio.sleep(delay)
+        return False
+
+    async def _sender(self):
+        while True:
+            entries = await self._next_digest()
+            try:
+                await self._deliver(entries)
+            except Exception as e:
+                print(f"Ошибка очереди отправки: {e}")
+            for _ in entries:
+                self.queue.task_done()
+
+    # Периодический повтор неотправленных сообщений: они снова встают в очередь (и остаются в спуле до отправки)
+    async def _retry_failed(self):
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            if not self.failed:
+                continue
+            entries, self.failed = self.failed, []
+            print(f"Повтор отправки {len(entries)} сообщений из спула")
+            for entry in entries:
+                await self.queue.put(entry)
+
+    async def _deliver(self, entries):
+        chat_id = entries[0]["chat_id"]
+        text = DIGEST_SEPARATOR.join(entry["text"] for entry in entries)
+        parts = split_message(text)
+        sent = 0
+        for part in parts:
+            if not await self._send_text(chat_id, part):
+                break
+            sent += 1
+        TELEGRAM_QUEUE.set(self.queue.qsize())
+        if sent == len(parts):
+            TELEGRAM_MESSAGES.inc(len(entries), result="sent")
+            self.spool.ack(entry["id"] for entry in entries)
+            print(f"Отправлено сообщений: {len(entries)} (одним сообщением)" if len(entries) > 1
+                  else f"Сообщение отправлено: {text}")
+        elif sent:
+            # Часть длинного сообщения уже отправлена: в спуле остается только неотправленный остаток,
+            # иначе при повторе получатель увидел бы отправленные части ещё раз
+            TELEGRAM_MESSAGES.inc(len(entries), result="failed")
+            rest = self.spool.add(chat_id, "\n".join(parts[sent:]))
+            self.spool.ack(entry["id"] for entry in entries)
+            self.failed.append(rest)
+            print(f"Отправлено частей: {sent} из {len(parts)}, остаток останется в спуле"
+                  f" (повтор через {self.retry_interval:g} с)")
+        else:
+            TELEGRAM_MESSAGES.inc(len(entries), result="failed")
+            self.failed.extend(entries)
+            print(f"Не удалось отправить {len(entries)} сообщений, они останутся в спуле"
+                  f" (повтор через {self.retry_interval:g} с)")
+
+    # Остановка: дожидаемся отправки очереди (не дольше timeout), остальное остаётся в спуле
+    async def stop(self, timeout=30):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Очередь отправки не опустела за {timeout} с, остаток сохранён в спуле")
+        tasks = [task for task in (self.sender_task, self.retry_task) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.spool.close()
+
+
+delivery = None  # Очередь доставки; без неё сообщения отправляются сразу
+
+
+# Запуск фоновой доставки сообщений
+async def start_delivery():
+    global delivery
+    delivery = DeliveryQueue(bot, CHAT_ID)
+    await delivery.start()
+
+
+# Остановка фоновой доставки с отправкой накопленного
+async def stop_delivery():
+    global delivery
+    if delivery is not None:
+        await delivery.stop()
+        delivery = None
+
+
 # Функция отправки сообщения в Telegram
 async def send_message(message):
+    if delivery is not None:
+        await delivery.put(message)
+        return
     try:
-        await bot.send_message(chat_id=CHAT_ID, text=message)
+        with STAGE_SECONDS.time(stage="telegram_send", name=""):
+            await bot.send_message(chat_id=CHAT_ID, text=message)
+        TELEGRAM_MESSAGES.inc(result="sent")
         print(f"Сообщение отправлено: {message}")
     except Exception as e:
+        TELEGRAM_MESSAGES.inc(result="failed")
         print(f"Ошибка отправки сообщения: {e}")
 
 # Функция отправки документа в Telegram
 async def send_document(file_path):
     try:
-        with open(file_path, 'rb') as f:
+        if delivery is not None:
+            await delivery.bucket(CHAT_ID).acquire()
+        with open(file_path, 'rb') as f, STAGE_SECONDS.time(stage="telegram_send", name="document"):
             await bot.send_document(chat_id=CHAT_ID, document=f)
         print(f"Документ отправлен: {file_path}")
     except Exception as e:
         print(f"Ошибка отправки документа: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,151 @@
+import json
+import os
+from collections import OrderedDict
+from cursor_store import atomic_write_json
+
+# Агрегация запусков процессов между разбором Sysmon и оповещениями. Ключ - (компьютер, Image, SHA256,
+# пользователь). Для каждого ключа - скользящее окно из кольца счетчиков, поэтому стоимость события
+# постоянна, а число ключей ограничено (давно не встречавшиеся вытесняются). О первом запуске ключа
+# оповещение отправляется как обычно, повторы в течение периода подавления только считаются
+# и уходят периодической сводкой; резкий рост частоты отмечается отдельным оповещением.
+
+BURST_STATE_FILE = "burst_state.json"  # Состояние между запусками
+BURST_SLOT_SECONDS = 5  # Ширина ячейки окна (с)
+BURST_WINDOW_SLOTS = 12  # Ячеек в окне (окно - 1 минута)
+BURST_MAX_KEYS = 10000  # Ключей в памяти не больше
+BURST_SUPPRESS_SECONDS = 3600  # Период подавления повторов после оповещения (с)
+BURST_ROLLUP_SECONDS = 300  # Период сводки подавленных запусков (с)
+BURST_ROLLUP_TOP = 10  # Строк в сводке
+BURST_SPIKE_MIN = 50  # Всплеск: запусков за окно не меньше...
+BURST_SPIKE_FACTOR = 5  # ...и во столько раз больше обычной частоты ключа
+BURST_BASELINE_ALPHA = 0.1  # Сглаживание обычной частоты (доля нового окна)
+
+# Решения по событию
+ALERT = "alert"  # Первый запуск в периоде: обычное оповещение (и проверка VirusTotal)
+SUPPRESS = "suppress"  # Повтор: только счетчики и сводка
+
+
+# Состояние ключа: кольцо счетчиков окна и подавление
+class KeyState:
+    __slots__ = ("slots", "slot", "window", "baseline", "suppress_until", "suppressed", "spiking")
+
+    def __init__(self):
+        self.slots = [0] * BURST_WINDOW_SLOTS
+        self.slot = None  # Номер текущей ячейки (время // BURST_SLOT_SECONDS)
+        self.window = 0  # Сумма ячеек окна
+        self.baseline = 0.0  # Обычное число запусков за окно
+        self.suppress_until = 0.0
+        self.suppressed = 0  # Подавлено с последней сводки
+        self.spiking = False
+
+    # Сдвиг окна к ячейке slot: обнуляется не больше BURST_WINDOW_SLOTS ячеек
+    def advance(self, slot):
+        if self.slot is None:
+            self.slot = slot
+            return
+        steps = slot - self.slot
+        if steps <= 0:
+            return
+        for step in range(1, min(steps, BURST_WINDOW_SLOTS) + 1):
+            # Окно, закончившееся на предыдущей ячейке, уходит в обычную частоту
+            self.baseline += BURST_BASELINE_ALPHA * (self.window - self.baseline)
+            index = (self.slot + step) % BURST_WINDOW_SLOTS
+            self.window -= self.slots[index]
+            self.slots[index] = 0
+        if steps > BURST_WINDOW_SLOTS:
+            # Долгий перерыв: окна без запусков тянут обычную частоту к нулю
+            self.baseline *= (1 - BURST_BASELINE_ALPHA) ** (steps - BURST_WINDOW_SLOTS)
+        self.slot = slot
+
+    def to_list(self):
+        return [self.slots, self.slot, self.window, self.baseline, self.suppress_until, self.suppressed, self.spiking]
+
+    @classmethod
+    def from_list(cls, data):
+        state = cls()
+        (state.slots, state.slot, state.window, state.baseline,
+         state.suppress_until, state.suppressed, state.spiking) = data
+        return state
+
+
+class BurstDetector:
+    def __init__(self, max_keys=BURST_MAX_KEYS):
+        self.max_keys = max_keys
+        self.keys = OrderedDict()  # ключ -> KeyState, от давно не встречавшихся к недавним
+        self.evicted_suppressed = 0  # Подавленные запуски вытесненных ключей (попадают в сводку общим числом)
+        self.last_rollup = None
+
+    # Учет события (timestamp - секунды UTC); возвращает (решение, всплеск начался)
+    def observe(self, key, timestamp):
+        state = self.keys.get(key)
+        if state is None:
+            state = self.keys[key] = KeyState()
+            if len(self.keys) > self.max_keys:
+                _, evicted = self.keys.popitem(last=False)
+                self.evicted_suppressed += evicted.suppressed
+        else:
+            self.keys.move_to_end(key)
+
+        slot = int(timestamp // BURST_SLOT_SECONDS)
+        state.advance(slot)
+        if slot >= state.slot - BURST_WINDOW_SLOTS + 1:
+            # Запоздавшие события за пределами окна не считаются в частоту
+            state.slots[slot % BURST_WINDOW_SLOTS] += 1
+            state.window += 1
+
+        # Всплеск заканчивается, только когда частота опустится ниже порога: пока окно растет,
+        # обычная частота догоняет его, и без этого оповещение повторялось бы
+        spike_started = False
+        if state.spiking:
+            state.spiking = state.window >= BURST_SPIKE_MIN
+        elif state.window >= BURST_SPIKE_MIN and state.window >= BURST_SPIKE_FACTOR * state.baseline:
+            state.spiking = spike_started = True
+
+        if timestamp >= state.suppress_until:
+            state.suppress_until = timestamp + BURST_SUPPRESS_SECONDS
+            return ALERT, spike_started
+        state.suppressed += 1
+        return SUPPRESS, spike_started
+
+    def window_count(self, key):
+        state = self.keys.get(key)
+        return state.window if state else 0
+
+    # Сводка подавленных запусков раз в BURST_ROLLUP_SECONDS: [(ключ, подавлено, за окно, всплеск)] и
+    # число запусков вытесненных ключей; None - время сводки ещё не пришло или подавленных нет
+    def rollup(self, now):
+        if self.last_rollup is None:
+            self.last_rollup = now
+        if now - self.last_rollup < BURST_ROLLUP_SECONDS:
+            return None
+        self.last_rollup = now
+        entries = [(key, state.suppressed, state.window, state.spiking)
+                   for key, state in self.keys.items() if state.suppressed]
+        other = self.evicted_suppressed
+        if not entries and not other:
+            return None
+        entries.sort(key=lambda entry: entry[1], reverse=True)
+        for key, _, _, _ in entries:
+            self.keys[key].suppressed = 0
+        self.evicted_suppressed = 0
+        top = entries[:BURST_ROLLUP_TOP]
+        other += sum(suppressed for _, suppressed, _, _ in entries[BURST_ROLLUP_TOP:])
+        return top, other
+
+    def save(self, file_name=BURST_STATE_FILE):
+        atomic_write_json(file_name, {
+            "last_rollup": self.last_rollup,
+            "evicted_suppressed": self.evicted_suppressed,
+            "keys": [[list(key), state.to_list()] for key, state in self.keys.items()]
+        })
+
+    def load(self, file_name=BURST_STATE_FILE):
+        if not os.path.exists(file_name):
+            return
+        with open(file_name, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.last_rollup = data.get("last_rollup")
+        self.evicted_suppressed = data.get("evicted_suppressed", 0)
+        for key, state in data.get("keys", [])[-self.max_keys:]:
+            self.keys[tuple(key)] = KeyState.from_list(state)
+        print(f"Загружено состояние подавления повторов: {len(self.keys)} ключей из {file_name}")
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import datetime as dt
+from daemon import install_signal_handlers
+from scanner import MAX_COLLECT_WORKERS
+
+# Сборщик событий с нескольких компьютеров: один процесс опрашивает журналы всех компьютеров
+# из списка, у каждого компьютера свои курсоры и состояние (каталог hosts/<имя>),
+# а кэш VirusTotal, очередь Telegram и накопительные логи общие.
+
+HOSTS_FILE = "hosts.json"  # Список компьютеров
+HOSTS_STATE_DIR = "hosts"  # Каталог состояния компьютеров (курсоры, время включения, ProcessGuid)
+COLLECTOR_MAX_PARALLEL = 16  # Сколько компьютеров опрашивается одновременно
+COLLECTOR_INTERVAL = 60  # Интервал опроса компьютера в режиме службы (секунды)
+
+
+# Функция пути к файлу состояния компьютера; без компьютера (локальный режим) - прежнее имя файла
+def host_state_path(host, name):
+    if host is None:
+        return name
+    directory = os.path.join(HOSTS_STATE_DIR, host)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+# Функция чтения списка компьютеров: строки (имя = адрес) или объекты {"name", "server"}
+def load_inventory(file_name=HOSTS_FILE):
+    with open(file_name, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    hosts = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"name": entry}
+        name = entry["name"]
+        hosts.append({"name": name, "server": entry.get("server") or name})
+    names = [host["name"] for host in hosts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{file_name}: имена компьютеров повторяются")
+    return hosts
+
+
+# Отправка сообщений от имени компьютера: к тексту добавляется имя, а одинаковые ошибки
+# (например, недоступный компьютер) отправляются один раз, пока компьютер не ответит без ошибок
+class HostNotifier:
+    def __init__(self, host, send_message_func):
+        self.host = host
+        self.send_message_func = send_message_func
+        self.reported = set()  # Ошибки, уже отправленные в Telegram
+        self.errors = set()  # Ошибки текущего прохода
+
+    async def send(self, message):
+        if message.startswith("📋"):
+            self.errors.add(message)
+            if message in self.reported:
+                print(f"[{self.host}] Повторная ошибка не отправляется: {message}")
+                return
+        await self.send_message_func(f"[{self.host}] {message}")
+
+    # Конец прохода: запоминаются ошибки, которые были в нем; исчезнувшие можно отправить снова
+    def end_round(self):
+        self.reported = self.errors
+        self.errors = set()
+        return len(self.reported)
+
+
+class HostCollector:
+    # make_scanner(host, executor, handler_lock, send_message_func) -> EventScanner компьютера
+    def __init__(self, hosts, make_scanner, send_message_func, flush_func, time_range_minutes,
+                 max_parallel=COLLECTOR_MAX_PARALLEL, interval=COLLECTOR_INTERVAL):
+        self.hosts = hosts
+        self.flush_func = flush_func
+        self.send_message_func = send_message_func
+        self.time_range_minutes = time_range_minutes
+        self.interval = interval
+        self.semaphore = asyncio.Semaphore(max_parallel)
+        # Общий пул чтения: каналы всех опрашиваемых компьютеров
+        self.executor = ThreadPoolExecutor(max_workers=max_parallel * MAX_COLLECT_WORKERS,
+                                           thread_name_prefix="collect")
+        # Сбор идёт параллельно, обработчики разных компьютеров - по очереди (общие файлы и кэши)
+        self.handler_lock = asyncio.Lock()
+        self.notifiers = {host["name"]: HostNotifier(host["name"], send_message_func) for host in hosts}
+        self.scanners = {
+            host["name"]: make_scanner(host, self.executor, self.handler_lock, self.notifiers[host["name"]].send)
+            for host in hosts
+        }
+        self.stop_event = asyncio.Event()
+
+    def stop(self):
+        if not self.stop_event.is_set():
+            print("Получен сигнал остановки, завершаем текущие проверки...")
+            self.stop_event.set()
+
+    # Сброс накопленного (события, GUID, курсоры, отчеты) под блокировкой обработчиков: иначе фиксация
+    # общей единицы работы могла бы попасть в середину пачки другого компьютера, обработчики которого
+    # ждут отправки сообщения, и сохранить ее записи без курсоров
+    async def flush(self):
+        async with self.handler_lock:
+            await self.flush_func(self.send_message_func)
+
+    # Проверка одного компьютера; возвращает True, если проход прошел без ошибок
+    async def check_host(self, name):
+        notifier = self.notifiers[name]
+        async with self.semaphore:
+            since = datetime.now(dt.timezone.utc) - timedelta(minutes=self.time_range_minutes)
+            try:
+                await self.scanners[name].scan(since, notifier.send)
+            except Exception as e:
+                print(f"[{name}] Ошибка проверки: {e}")
+                await notifier.send(f"📋 Ошибка: не удалось проверить компьютер - {str(e)}")
+        return notifier.end_round() == 0
+
+    # Один проход по всем компьютерам (однократная проверка и нагрузочный прогон)
+    async def run_once(self):
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.check_host(host["name"]) for host in self.hosts))
+        await self.flush()
+        elapsed = time.perf_counter() - started
+        failed = results.count(False)
+        print(f"Проход по {len(self.hosts)} компьютерам: {elapsed:.3f} с, с ошибками: {failed}")
+        return elapsed, failed
+
+    # Режим службы: у каждого компьютера свой цикл, поэтому медленный компьютер не задерживает остальные
+    async def host_loop(self, name):
+        loop = asyncio.get_running_loop()
+        while not self.stop_event.is_set():
+            started = loop.time()
+            await self.check_host(name)
+            await self.flush()
+            delay = max(self.interval - (loop.time() - started), 0)
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        install_signal_handlers(self.stop)
+        print(f"Сборщик запущен: {len(self.hosts)} компьютеров, опрос каждые {self.interval} с")
+        tasks = [asyncio.create_task(self.host_loop(host["name"])) for host in self.hosts]
+        await self.stop_event.wait()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.flush()
+        print("Сборщик остановлен")
+
+    def close(self):
+        for scanner in self.scanners.values():
+            scanner.close()
+        self.executor.shutdown(wait=True)
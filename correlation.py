@@ -0,0 +1,245 @@
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime
+import datetime as dt
+from cursor_store import atomic_write_json
+
+# Корреляция событий по сеансам входа: вход (4624), назначение привилегий (4672), создание задач (4698),
+# установка служб (4697, 7045) и запуски процессов (Sysmon) одного сеанса - ключ (компьютер, LogonId) -
+# собираются вместе. Оповещения событий сеанса придерживаются, пока сеанс активен, и уходят одним
+# сообщением, когда в сеансе наступает пауза (или истекает предельное время задержки).
+# Одиночное событие уходит своим обычным сообщением. 7045 не содержит LogonId и привязывается к
+# последнему сеансу с привилегиями на том же компьютере. Число сеансов ограничено (давно не активные
+# вытесняются, их придержанные оповещения отправляются), число строк сеанса в сообщении - тоже.
+
+CORRELATION_STATE_FILE = "correlation_state.json"  # Состояние между запусками
+CORRELATION_IDLE_SECONDS = 60  # Сообщение о сеансе - после паузы в событиях сеанса (с)...
+CORRELATION_MAX_HOLD_SECONDS = 300  # ...но оповещение не задерживается дольше этого (с)
+CORRELATION_WINDOW_SECONDS = 1800  # Сколько помнить сеанс после последнего события (с)
+CORRELATION_LINK_SECONDS = 300  # Окно привязки событий без LogonId (7045) к сеансу с привилегиями (с)
+CORRELATION_MAX_SESSIONS = 5000  # Сеансов в памяти не больше
+CORRELATION_MAX_LINES = 10  # Строк событий в сообщении о сеансе (остальные - счетчиками)
+
+LOGON_EVENT_ID = 4624
+PRIVILEGE_EVENT_ID = 4672
+PERSISTENCE_EVENT_IDS = {4698, 4697, 7045}  # Создание задач и служб
+PROCESS_EVENT_ID = 1  # Sysmon: запуск процесса
+LOGON_TYPES = {"2": "локальный", "7": "разблокировка", "10": "RDP", "11": "кэшированный", "15": "RDP"}
+
+
+# Событие сеанса: строка для сообщения о сеансе и собственное оповещение (None - событие без оповещения)
+class SessionEvent:
+    __slots__ = ("timestamp", "event_id", "name", "line", "message")
+
+    def __init__(self, timestamp, event_id, name, line, message=None):
+        self.timestamp = timestamp
+        self.event_id = event_id
+        self.name = name
+        self.line = line
+        self.message = message
+
+    def to_list(self):
+        return [self.timestamp, self.event_id, self.name, self.line, self.message]
+
+
+class Session:
+    __slots__ = ("host", "logon_id", "user", "domain", "logon_type", "started", "last", "privileged",
+                 "pending", "omitted", "alerts", "persistence", "first_pending", "reported")
+
+    def __init__(self, host, logon_id, timestamp):
+        self.host = host
+        self.logon_id = logon_id
+        self.user = None
+        self.domain = None
+        self.logon_type = None
+        self.started = timestamp
+        self.last = timestamp
+        self.privileged = False
+        self.pending = []  # Придержанные события (не больше CORRELATION_MAX_LINES)
+        self.omitted = {}  # Не вошедшие в pending: имя события -> число
+        self.alerts = 0  # Придержанных оповещений
+        self.persistence = False  # Среди придержанных есть создание задачи или службы
+        self.first_pending = None  # Время первого придержанного события (по часам обработки)
+        self.reported = False  # Сообщение о сеансе уже отправлялось
+
+    def add(self, event, now):
+        if self.first_pending is None:
+            self.first_pending = now
+        if len(self.pending) < CORRELATION_MAX_LINES:
+            self.pending.append(event)
+        else:
+            self.omitted[event.name] = self.omitted.get(event.name, 0) + 1
+        if event.message is not None:
+            self.alerts += 1
+        if event.event_id in PERSISTENCE_EVENT_IDS:
+            self.persistence = True
+
+    def to_list(self):
+        return [self.host, self.logon_id, self.user, self.domain, self.logon_type, self.started, self.last,
+                self.privileged, [event.to_list() for event in self.pending], self.omitted, self.alerts,
+                self.persistence, self.first_pending, self.reported]
+
+    @classmethod
+    def from_list(cls, data):
+        (host, logon_id, user, domain, logon_type, started, last, privileged, pending, omitted, alerts,
+         persistence, first_pending, reported) = data
+        session = cls(host, logon_id, started)
+        session.user, session.domain, session.logon_type = user, domain, logon_type
+        session.last, session.privileged = last, privileged
+        session.pending = [SessionEvent(*event) for event in pending]
+        session.omitted, session.alerts, session.persistence = omitted, alerts, persistence
+        session.first_pending, session.reported = first_pending, reported
+        return session
+
+
+def _clock(timestamp):
+    return datetime.fromtimestamp(timestamp, dt.timezone.utc).strftime("%H:%M:%S")
+
+
+class Correlator:
+    def __init__(self, max_sessions=CORRELATION_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()  # (компьютер, LogonId) -> Session, от давно не активных к недавним
+        self.held = set()  # Ключи сеансов с придержанными событиями (выдача не обходит все сеансы)
+        self.privileged = {}  # компьютер -> ключ последнего сеанса с привилегиями
+        self.ready = []  # Сообщения вытесненных сеансов (уходят со следующей выдачей)
+
+    # Учет события сеанса; True - событие взято в сеанс (его оповещение придержано до сообщения о сеансе).
+    # opens=False - событие только присоединяется к уже известному сеансу (запуски процессов).
+    # now - время обработки (с) для предельной задержки; по умолчанию - время события
+    def observe(self, host, logon_id, event, user=None, domain=None, logon_type=None, opens=True, now=None):
+        if not logon_id:
+            return False
+        key = (host or "", logon_id.lower())
+        session = self.sessions.get(key)
+        if session is None:
+            if not opens:
+                return False
+            session = self.sessions[key] = Session(key[0], key[1], event.timestamp)
+            if len(self.sessions) > self.max_sessions:
+                self._evict()
+        else:
+            self.sessions.move_to_end(key)
+        return self._add(key, session, event, user, domain, logon_type, now)
+
+    # Событие без LogonId (7045): в последний сеанс с привилегиями на компьютере, если он был недавно
+    def observe_host(self, host, event, now=None):
+        key = self.privileged.get(host or "")
+        session = self.sessions.get(key) if key else None
+        if session is None or event.timestamp - session.last > CORRELATION_LINK_SECONDS:
+            return False
+        self.sessions.move_to_end(key)
+        return self._add(key, session, event, None, None, None, now)
+
+    def _add(self, key, session, event, user, domain, logon_type, now):
+        if event.event_id == LOGON_EVENT_ID:
+            session.logon_type = logon_type
+            session.started = min(session.started, event.timestamp)
+        session.user = session.user or user
+        session.domain = session.domain or domain
+        if event.event_id == PRIVILEGE_EVENT_ID:
+            session.privileged = True
+            self.privileged[key[0]] = key
+        session.last = max(session.last, event.timestamp)
+        session.add(event, event.timestamp if now is None else now)
+        self.held.add(key)
+        return True
+
+    def _forget(self, key):
+        self.held.discard(key)
+        if self.privileged.get(key[0]) == key:
+            del self.privileged[key[0]]
+
+    def _evict(self):
+        key, session = self.sessions.popitem(last=False)
+        self._forget(key)
+        message = self._message(session)
+        if message is not None:
+            self.ready.append(message)
+
+    # Сообщения о сеансах, в которых наступила пауза или истекла предельная задержка; сеансы без событий
+    # дольше CORRELATION_WINDOW_SECONDS забываются (с начала порядка - от давно не активных)
+    def flush(self, now):
+        messages, self.ready = self.ready, []
+        for key in list(self.held):
+            session = self.sessions[key]
+            if (now - session.last >= CORRELATION_IDLE_SECONDS
+                    or now - session.first_pending >= CORRELATION_MAX_HOLD_SECONDS):
+                self.held.discard(key)
+                message = self._message(session)
+                if message is not None:
+                    messages.append(message)
+        while self.sessions:
+            key, session = next(iter(self.sessions.items()))
+            if key in self.held or now - session.last < CORRELATION_WINDOW_SECONDS:
+                break
+            del self.sessions[key]
+            self._forget(key)
+        return messages
+
+    # Все придержанные сообщения, независимо от паузы в сеансах
+    def flush_all(self):
+        messages, self.ready = self.ready, []
+        for key in self.held:
+            message = self._message(self.sessions[key])
+            if message is not None:
+                messages.append(message)
+        self.held = set()
+        return messages
+
+    # Сообщение о придержанных событиях сеанса (None - оповещать не о чем); придержанное очищается
+    def _message(self, session):
+        pending, omitted, alerts, persistence = session.pending, session.omitted, session.alerts, session.persistence
+        session.pending, session.omitted, session.alerts, session.first_pending = [], {}, 0, None
+        session.persistence = False
+        if not alerts:
+            return None
+        reported = session.reported
+        if len(pending) == 1 and not omitted and not reported:
+            return pending[0].message
+        session.reported = True
+        pending.sort(key=lambda event: event.timestamp)
+
+        # Цепочка: вход с последующим созданием задачи или службы в том же сеансе
+        if persistence and session.logon_type is not None:
+            title = "🚨 Цепочка в сеансе"
+        else:
+            title = "🧩 Сеанс (продолжение)" if reported else "🧩 Сеанс"
+        user = f"{session.domain}\\{session.user}" if session.domain else (session.user or "<неизвестно>")
+        logon = LOGON_TYPES.get(session.logon_type, session.logon_type)
+        lines = [
+            f"{title}: {user}" + (f" на {session.host}" if session.host else "") +
+            f", LogonId {session.logon_id}" + (f", вход: {logon}" if logon else "") +
+            (", с привилегиями" if session.privileged else ""),
+            f"Событий: {len(pending) + sum(omitted.values())}, с {_clock(pending[0].timestamp)}"
+            f" по {_clock(pending[-1].timestamp)} (UTC)"
+        ]
+        lines.extend(f"{_clock(event.timestamp)} {event.name}: {event.line}" for event in pending)
+        if omitted:
+            lines.append("И ещё: " + ", ".join(f"{name} ×{count}" for name, count in omitted.items()))
+        return "\n".join(lines)
+
+    def save(self, file_name=CORRELATION_STATE_FILE):
+        atomic_write_json(file_name, {
+            "sessions": [session.to_list() for session in self.sessions.values()],
+            "privileged": [list(key) for key in self.privileged.values()],
+            "ready": self.ready
+        })
+
+    def load(self, file_name=CORRELATION_STATE_FILE):
+        if not os.path.exists(file_name):
+            return
+        with open(file_name, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for item in data.get("sessions", [])[-self.max_sessions:]:
+            session = Session.from_list(item)
+            key = (session.host, session.logon_id)
+            self.sessions[key] = session
+            if session.pending:
+                self.held.add(key)
+        for key in data.get("privileged", []):
+            if tuple(key) in self.sessions:
+                self.privileged[key[0]] = tuple(key)
+        self.ready = data.get("ready", [])
+        print(f"Загружено состояние корреляции: {len(self.sessions)} сеансов из {file_name}")
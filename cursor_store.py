@@ -0,0 +1,52 @@
+import json
+import os
+
+CURSOR_FILE = "cursors.json"  # Файл с позициями чтения (номер последней обработанной записи) по каналам
+
+
+# Функция атомарной записи JSON: временный файл + fsync + os.replace
+def atomic_write_json(file_name, data):
+    tmp_name = f"{file_name}.tmp"
+    with open(tmp_name, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, file_name)
+
+
+# Хранилище курсоров: номер последней обработанной записи для каждого канала
+class CursorStore:
+    def __init__(self, file_name=CURSOR_FILE):
+        self.file_name = file_name
+        self.cursors = {}
+        self.dirty = False
+        if os.path.exists(file_name):
+            try:
+                with open(file_name, "r", encoding="utf-8") as f:
+                    self.cursors = {channel: int(value) for channel, value in json.load(f).items()}
+                print(f"Загружены курсоры из {file_name}: {self.cursors}")
+            except Exception as e:
+                # Повреждённый файл: начинаем заново с окна TIME_RANGE_MINUTES
+                print(f"Ошибка чтения курсоров из {file_name}: {e}")
+                self.cursors = {}
+
+    def get(self, channel):
+        return self.cursors.get(channel)
+
+    def set(self, channel, record_number):
+        if record_number is None or self.cursors.get(channel) == record_number:
+            return
+        self.cursors[channel] = record_number
+        self.dirty = True
+
+    # Сохранение курсоров; вызывается только после обработки прочитанных записей.
+    # С единицей работы (unit) файл заменяется при ее фиксации, вместе с записями обработчиков
+    def commit(self, unit=None):
+        if not self.dirty:
+            return
+        if unit is not None:
+            unit.replace(self.file_name, json.dumps(self.cursors, ensure_ascii=False).encode("utf-8"))
+        else:
+            atomic_write_json(self.file_name, self.cursors)
+        self.dirty = False
+        print(f"Курсоры сохранены в {self.file_name}: {self.cursors}")
@@ -0,0 +1,116 @@
+import asyncio
+import signal
+from datetime import datetime, timedelta
+import datetime as dt
+from event_source import SECURITY_CHANNEL, SYSTEM_CHANNEL, SYSMON_CHANNEL
+from subscription import STREAM_QUEUE_SIZE, REPLAY_POLL_INTERVAL, next_batch
+
+# Интервалы опроса каналов в режиме службы (секунды)
+CHANNEL_INTERVALS = {
+    SECURITY_CHANNEL: 30,
+    SYSTEM_CHANNEL: 60,
+    SYSMON_CHANNEL: 15
+}
+DEFAULT_INTERVAL = 60  # Интервал для каналов, не указанных в CHANNEL_INTERVALS
+IDLE_TICK_INTERVAL = 60  # Потоковый режим: как часто вызывать все обработчики (смена дня, очистка кэшей)
+
+
+# Установка обработчика сигналов остановки (Ctrl+C, завершение службы)
+def install_signal_handlers(stop):
+    loop = asyncio.get_running_loop()
+    signals = [signal.SIGINT, signal.SIGTERM]
+    if hasattr(signal, "SIGBREAK"):
+        signals.append(signal.SIGBREAK)
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, stop)
+        except (NotImplementedError, RuntimeError):
+            # Windows: add_signal_handler не поддерживается
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(stop))
+
+
+# Планировщик режима службы: каждый канал опрашивается по своему интервалу в одном процессе,
+# поэтому кэши, шрифты и бот инициализируются один раз
+class MonitorDaemon:
+    def __init__(self, scanner, send_message_func, flush_func, time_range_minutes, intervals=None):
+        self.scanner = scanner
+        self.send_message_func = send_message_func
+        self.flush_func = flush_func
+        self.time_range_minutes = time_range_minutes
+        self.intervals = intervals or CHANNEL_INTERVALS
+        self.stop_event = asyncio.Event()
+        # Проверки разных каналов не перекрываются: обработчики делят файлы и кэши
+        self.scan_lock = asyncio.Lock()
+
+    def stop(self):
+        if not self.stop_event.is_set():
+            print("Получен сигнал остановки, завершаем текущие проверки...")
+            self.stop_event.set()
+
+    def install_signal_handlers(self):
+        install_signal_handlers(self.stop)
+
+    async def check_channel(self, channel):
+        async with self.scan_lock:
+            since = datetime.now(dt.timezone.utc) - timedelta(minutes=self.time_range_minutes)
+            await self.scanner.scan(since, self.send_message_func, channels=[channel])
+            await self.flush_func(self.send_message_func)
+
+    async def channel_loop(self, channel):
+        interval = self.intervals.get(channel, DEFAULT_INTERVAL)
+        loop = asyncio.get_running_loop()
+        print(f"Канал {channel}: опрос каждые {interval} с")
+        while not self.stop_event.is_set():
+            started = loop.time()
+            try:
+                await self.check_channel(channel)
+            except Exception as e:
+                print(f"Ошибка проверки канала {channel}: {e}")
+            delay = max(interval - (loop.time() - started), 0)
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        self.install_signal_handlers()
+        print("Режим службы запущен")
+        tasks = [asyncio.create_task(self.channel_loop(channel)) for channel in self.scanner.routes]
+        await self.stop_event.wait()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.flush_func(self.send_message_func)
+        print("Режим службы остановлен")
+
+    # Потоковый режим: записи приходят из подписки (или воспроизведения) и обрабатываются микропакетами
+    async def run_stream(self, subscription):
+        self.install_signal_handlers()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        await subscription.start(queue)
+        print("Потоковый режим запущен")
+        last_tick = loop.time()
+        finished = getattr(subscription, "finished", None)
+        # Воспроизведение может закончиться в любой момент - проверяем это чаще
+        wait_timeout = IDLE_TICK_INTERVAL if finished is None else REPLAY_POLL_INTERVAL
+        while not self.stop_event.is_set():
+            batch = await next_batch(queue, self.stop_event, timeout=wait_timeout)
+            channels = {record.channel for record in batch}
+            if loop.time() - last_tick >= IDLE_TICK_INTERVAL:
+                channels.update(self.scanner.routes)
+                last_tick = loop.time()
+            if channels:
+                async with self.scan_lock:
+                    await self.scanner.dispatch(batch, self.send_message_func, channels=channels)
+                    await self.flush_func(self.send_message_func)
+            if batch:
+                # Задержка от создания события до окончания его обработки (включая отправку)
+                now = datetime.now(dt.timezone.utc).timestamp()
+                delays = [now - record.timestamp for record in batch]
+                print(f"Микропакет: {len(batch)} записей, задержка средняя {sum(delays) / len(delays):.3f} с,"
+                      f" максимальная {max(delays):.3f} с")
+            elif finished is not None and finished.is_set() and queue.empty():
+                print("Воспроизведение завершено")
+                break
+        subscription.stop()
+        await self.flush_func(self.send_message_func)
+        print("Потоковый режим остановлен")
@@ -1,50 +1,73 @@
-import win32evtlog
+import asyncio
+import time
 from datetime import datetime, timedelta
 import datetime as dt
+import json
 import os
 import re
-import xmltodict
-import json
-import requests
 from config import VIRUSTOTAL_API_KEY
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-import pkg_resources
+from event_source import SYSTEM_CHANNEL, SYSMON_CHANNEL
+from event_store import EventStore
+from journal import UnitOfWork
+from guid_index import GuidIndex
+from report import build_report
+from archive import EventArchive, ARCHIVE_DIR
+from collector import host_state_path
+from cursor_store import atomic_write_json
+from allowlist import ALLOWLIST_FILE, load_allowlist
+from burst import BURST_STATE_FILE, BURST_ROLLUP_SECONDS, SUPPRESS, BurstDetector
+from correlation import CORRELATION_STATE_FILE, PROCESS_EVENT_ID, Correlator, SessionEvent
+from metrics import (ALERTS, ALLOWLIST_HITS, BURST_EVENTS, BURST_KEYS, CORRELATION_EVENTS, CORRELATION_SESSIONS,
+                     STAGE_SECONDS)
+from rules import RULES_FILE, load_rules
+from sysmon_config import SYSMON_CONFIG_FILE, SysmonConfig, check_sysmon_config
+from sysmon_decoder import PROCESS_CREATE_EVENT_ID, decode_process_create, sha256_from_hashes
+from virustotal import VirusTotalClient, VerdictCache
 
 # Конфигурация
 TIME_RANGE_MINUTES = 1  # Временной диапазон для поиска (1 минута)
 STARTUP_LOG_FILE = "last_startup.log"  # Файл для хранения времени последнего включения
-LOGON_LOG_FILE = "last_logon.log"  # Файл для хранения времени последнего входа
-PRIVILEGE_LOG_FILE = "last_privilege.log"  # Файл для хранения времени последнего события 4672
-TASK_LOG_FILE = "last_task.log"  # Файл для хранения времени последнего события 4698
-SERVICE_LOG_FILE = "last_service.log"  # Файл для хранения времени последнего события 4697/7045
-SYSMON_LOG_FILE = "sysmon_seen.log"  # Файл для хранения ProcessGuid событий Sysmon
-SYSMON_CACHE_FILE = "vt_cache.json"  # Файл для кэша VirusTotal
-
-# Новые файлы для накопительного логирования
-EVENTS_6005_LOG = "events_6005.json"  # Лог для включений ПК
-EVENTS_4624_LOG = "events_4624.json"  # Лог для входов
-EVENTS_4672_LOG = "events_4672.json"  # Лог для привилегий
-EVENTS_4698_LOG = "events_4698.json"  # Лог для задач
-EVENTS_SERVICE_LOG = "events_service.json"  # Лог для служб
-EVENTS_SYSMON_LOG = "events_sysmon.json"  # Лог для Sysmon
-
-# Регистрация шрифта DejaVuSans для поддержки кириллицы
-try:
-    font_path = pkg_resources.resource_filename('reportlab', 'fonts/DejaVuSans.ttf')
-    if not os.path.exists(font_path):
-        # Альтернативный путь к шрифту (нужно скачать и указать)
-        font_path = os.path.join(os.path.dirname(__file__), "DejaVuSans.ttf")
-    pdfmetrics.registerFont(TTFont("DejaVuSans", font_path))
-    print("Шрифт DejaVuSans зарегистрирован")
-except Exception as e:
-    print(f"Ошибка регистрации шрифта DejaVuSans: {e}. Убедитесь, что файл DejaVuSans.ttf доступен.")
+LAST_CHECK_FILE = "last_check.log"  # Файл для хранения времени проверки смены дня
+SYSMON_SEEN_DIR = "sysmon_seen"  # Каталог с корзинами обработанных ProcessGuid событий Sysmon
+SYSMON_LOG_FILE = "sysmon_seen.log"  # Прежний файл ProcessGuid, переносится при первом запуске
+SYSMON_CACHE_FILE = "vt_cache.sqlite3"  # Файл для кэша VirusTotal
+LEGACY_SYSMON_CACHE_FILE = "vt_cache.json"  # Прежний кэш VirusTotal, переносится при первом запуске
+VT_BACKLOG_FILE = "vt_backlog.json"  # Хэши догоняющего чтения, не проверенные до конца запуска
+
+# Отбор событий Sysmon по процессу (точные пути): применяется в запросе к журналу и повторно в обработчике
+SYSMON_IMAGE_INCLUDE = []  # Отслеживаемые процессы (пусто - все)
+SYSMON_IMAGE_EXCLUDE = []  # Процессы, о запуске которых не нужно оповещать
+
+# Файлы для накопительного логирования (JSON Lines, только добавление); в них же пишут правила из rules.json
+EVENTS_6005_LOG = "events_6005.jsonl"  # Лог для включений ПК
+EVENTS_4624_LOG = "events_4624.jsonl"  # Лог для входов
+EVENTS_4672_LOG = "events_4672.jsonl"  # Лог для привилегий
+EVENTS_4698_LOG = "events_4698.jsonl"  # Лог для задач
+EVENTS_SERVICE_LOG = "events_service.jsonl"  # Лог для служб
+EVENTS_SYSMON_LOG = "events_sysmon.jsonl"  # Лог для Sysmon
+
+# Разделы PDF-отчета: лог, заголовок и поля для таблиц «топ»
+# (поле host есть только у событий, собранных с нескольких компьютеров)
+REPORT_CATEGORIES = [
+    (EVENTS_6005_LOG, "Включение компьютера", ["host"]),
+    (EVENTS_4624_LOG, "Входы в систему", ["host", "user"]),
+    (EVENTS_4672_LOG, "Назначение привилегий", ["host", "user"]),
+    (EVENTS_4698_LOG, "Создание задач", ["host", "user", "task"]),
+    (EVENTS_SERVICE_LOG, "Установка/изменение служб", ["host", "user", "service"]),
+    (EVENTS_SYSMON_LOG, "Запуск процессов (Sysmon)", ["host", "user", "image", "sha256"])
+]
+
+# Единица работы запуска: события, GUID, курсоры и время последних событий пачки фиксируются вместе
+UNIT = UnitOfWork()
+# Хранилище накопительных логов (строки фиксируются вместе с пачкой)
+EVENT_STORE = EventStore(UNIT)
 
 
 # Функция для чтения последнего времени из файла
 def read_last_event_time(file_name):
+    pending = UNIT.pending(file_name)
+    if pending is not None:
+        return datetime.fromisoformat(pending.decode("utf-8"))
     if not os.path.exists(file_name):
         return None
     try:
@@ -67,373 +90,262 @@ def read_last_event_time(file_name):
         return None
 
 
-# Функция для записи времени события в файл (перезапись)
+# Функция для записи времени события в файл (перезапись при фиксации пачки)
 async def write_last_event_time(file_name, event_time, send_message_func):
     try:
-        with open(file_name, "w") as f:
-            f.write(event_time.isoformat())
+        UNIT.replace(file_name, event_time.isoformat().encode("utf-8"))
         print(f"Время события сохранено в {file_name}: {event_time}")
     except Exception as e:
         print(f"Ошибка записи в {file_name}: {e}")
         await send_message_func(f"📋 Ошибка: не удалось записать время события в {file_name} - {str(e)}")
 
 
-# Функция для накопительного логирования событий
-async def log_event_to_json(file_name, event_data, send_message_func):
+# Функция для накопительного логирования событий (добавление строки в JSON Lines);
+# в режиме сборщика к событию добавляется имя компьютера
+async def log_event_to_json(file_name, event_data, send_message_func, host=None):
+    if host is not None:
+        event_data["host"] = host
     try:
-        # Инициализируем пустой список, если файл не существует
-        if not os.path.exists(file_name):
-            with open(file_name, "w") as f:
-                json.dump([], f)
-
-        # Читаем существующие события
-        with open(file_name, "r") as f:
-            events = json.load(f)
-
-        # Добавляем новое событие
-        events.append(event_data)
-
-        # Записываем обновленный список
-        with open(file_name, "w") as f:
-            json.dump(events, f, indent=4)
+        with STAGE_SECONDS.time(stage="log_append", name=file_name):
+            EVENT_STORE.append(file_name, event_data)
         print(f"Событие добавлено в {file_name}: {event_data}")
     except Exception as e:
         print(f"Ошибка записи в {file_name}: {e}")
         await send_message_func(f"📋 Ошибка: не удалось записать событие в {file_name} - {str(e)}")
 
 
-# Функция для очистки накопительных логов
-async def clear_event_logs(send_message_func):
-    log_files = [
-        EVENTS_6005_LOG, EVENTS_4624_LOG, EVENTS_4672_LOG,
-        EVENTS_4698_LOG, EVENTS_SERVICE_LOG, EVENTS_SYSMON_LOG
-    ]
-    for file_name in log_files:
+# Функция фиксации накопленных событий (в конце каждого запуска, после пачки) и построения отчетов,
+# запрошенных обработчиками этой пачки
+async def flush_event_logs(send_message_func):
+    await commit_event_logs(send_message_func)
+    await start_scheduled_reports()
+
+
+async def commit_event_logs(send_message_func):
+    try:
+        with STAGE_SECONDS.time(stage="log_flush", name=""):
+            EVENT_STORE.flush()
+    except Exception as e:
+        print(f"Ошибка сброса накопительных логов: {e}")
+        await send_message_func(f"📋 Ошибка: не удалось сохранить накопительные логи - {str(e)}")
+
+
+# Функция повтора журнала единицы работы после сбоя (при запуске, до чтения курсоров и индексов)
+def recover_state():
+    applied = UNIT.recover()
+    if applied:
+        print(f"Из журнала {UNIT.journal_file} повторно применено зафиксированных пачек: {applied}")
+
+
+# Функция фиксации оставшихся записей и контрольной точки журнала (в конце работы процесса)
+async def close_event_logs(send_message_func):
+    try:
+        EVENT_STORE.close()
+    except Exception as e:
+        print(f"Ошибка закрытия накопительных логов: {e}")
+        await send_message_func(f"📋 Ошибка: не удалось сохранить накопительные логи - {str(e)}")
+
+
+# Функция переноса накопительных логов в снимки за день: запись новых событий продолжается
+# в пустые логи, пока отчет строится из снимков
+async def rotate_event_logs(date, send_message_func):
+    snapshots = []
+    for file_name, title, top_fields in REPORT_CATEGORIES:
+        snapshot_name = f"{os.path.splitext(file_name)[0]}.{date.strftime('%Y-%m-%d')}.jsonl"
+        try:
+            if EVENT_STORE.rotate(file_name, snapshot_name):
+                print(f"Лог {file_name} перенесен в {snapshot_name}")
+        except Exception as e:
+            print(f"Ошибка переноса {file_name}: {e}")
+            await send_message_func(f"📋 Ошибка: не удалось перенести лог {file_name} - {str(e)}")
+        snapshots.append((snapshot_name, title, top_fields))
+    return snapshots
+
+
+# Функция удаления снимков логов после отправки отчета
+async def clear_event_logs(snapshots, send_message_func):
+    for file_name, _, _ in snapshots:
         try:
-            with open(file_name, "w") as f:
-                json.dump([], f)
-            print(f"Лог {file_name} очищен")
+            if os.path.exists(file_name):
+                os.remove(file_name)
+                print(f"Лог {file_name} очищен")
         except Exception as e:
             print(f"Ошибка очистки {file_name}: {e}")
             await send_message_func(f"📋 Ошибка: не удалось очистить лог {file_name} - {str(e)}")
 
 
-# Функция для генерации PDF-отчета
-async def generate_pdf_report(date, send_message_func, send_document_func):
+# Функция переноса снимков логов в архив по дням (вызывается в рабочем потоке)
+def archive_event_logs(snapshots):
+    archive = EventArchive(ARCHIVE_DIR)
+    for (file_name, _, _), (snapshot_name, _, _) in zip(REPORT_CATEGORIES, snapshots):
+        archive.archive_log(snapshot_name, os.path.splitext(file_name)[0])
+
+
+_report_tasks = set()  # Отчеты, которые строятся в фоне
+_scheduled_reports = []  # Отчеты, запрошенные обработчиками: (дата, функции отправки)
+
+
+# Функция построения и отправки PDF-отчета по снимкам логов (построение - в рабочем потоке)
+async def send_pdf_report(date, snapshots, send_message_func, send_document_func):
     output_file = f"report_{date.strftime('%Y-%m-%d')}.pdf"
-    c = canvas.Canvas(output_file, pagesize=letter)
-    c.setFont("DejaVuSans", 12)
-    y = 750
-    c.drawString(100, y, f"Отчет по событиям за {date.strftime('%Y-%m-%d')}")
-    y -= 30
-
-    # Собираем все события
-    log_files = [
-        (EVENTS_6005_LOG, "Включение компьютера"),
-        (EVENTS_4624_LOG, "Входы в систему"),
-        (EVENTS_4672_LOG, "Назначение привилегий"),
-        (EVENTS_4698_LOG, "Создание задач"),
-        (EVENTS_SERVICE_LOG, "Установка/изменение служб"),
-        (EVENTS_SYSMON_LOG, "Запуск процессов (Sysmon)")
-    ]
-
-    for log_file, title in log_files:
-        try:
-            with open(log_file, "r") as f:
-                events = json.load(f)
-            # Фильтруем события по дате
-            events = [e for e in events if datetime.fromisoformat(e["time"]).date() == date]
-            if events:
-                c.drawString(100, y, f"{title}:")
-                y -= 20
-                for event in events:
-                    if y < 50:  # Новая страница, если мало места
-                        c.showPage()
-                        c.setFont("DejaVuSans", 12)
-                        y = 750
-                    summary = event.get("summary", str(event))
-                    c.drawString(100, y, f"{event['time']}: {summary}")
-                    y -= 20
-                y -= 10
-        except Exception as e:
-            print(f"Ошибка чтения {log_file} для отчета: {e}")
-            await send_message_func(f"📋 Ошибка: не удалось прочитать {log_file} - {str(e)}")
+    try:
+        with STAGE_SECONDS.time(stage="report", name=""):
+            await asyncio.to_thread(build_report, output_file, date, snapshots)
+    except Exception as e:
+        print(f"Ошибка создания PDF-отчета: {e}")
+        await send_message_func(f"📋 Ошибка: не удалось создать PDF-отчет - {str(e)}")
+        return
 
-    c.save()
-    print(f"PDF-отчет создан: {output_file}")
+    # Снимки сохраняются в архиве - после отправки отчета история остается доступной для запросов
+    try:
+        with STAGE_SECONDS.time(stage="archive", name=""):
+            await asyncio.to_thread(archive_event_logs, snapshots)
+    except Exception as e:
+        print(f"Ошибка переноса логов в архив: {e}")
+        await send_message_func(f"📋 Ошибка: не удалось перенести логи в архив - {str(e)}")
+        archived = False
+    else:
+        archived = True
 
     # Отправка PDF в Telegram
     try:
         await send_document_func(output_file)
         print(f"PDF-отчет отправлен: {output_file}")
-        # Очистка логов после отправки
-        await clear_event_logs(send_message_func)
+        # Очистка логов после отправки (если они сохранены в архиве)
+        if archived:
+            await clear_event_logs(snapshots, send_message_func)
     except Exception as e:
         print(f"Ошибка отправки PDF: {e}")
         await send_message_func(f"📋 Ошибка: не удалось отправить PDF-отчет - {str(e)}")
 
 
-# Функция поиска событий в журнале Security (4624, 4672, 4698)
-async def check_security_events(send_message_func):
-    print(f"Начало проверки событий Security (4624, 4672, 4698) за последнюю минуту...")
-
-    try:
-        security_log = win32evtlog.OpenEventLog("localhost", "Security")
-        print("Журнал Security открыт")
-    except Exception as e:
-        print(f"Ошибка открытия журнала Security: {e}")
-        await send_message_func(f"📋 Ошибка: не удалось открыть журнал Security - {str(e)}")
-        return [], [], []
-
-    flags = win32evtlog.EVENTLOG_BACKWARDS_READ | win32evtlog.EVENTLOG_SEQUENTIAL_READ
-    now = datetime.now(dt.timezone.utc)
-    time_threshold = now - timedelta(minutes=TIME_RANGE_MINUTES)
-    logon_events = []
-    privilege_events = []
-    task_events = []
+# Функция для генерации PDF-отчета: логи переносятся в снимки, отчет строится в фоне,
+# чтобы смена дня не задерживала обработку событий
+async def generate_pdf_report(date, send_message_func, send_document_func):
+    await commit_event_logs(send_message_func)
+    snapshots = await rotate_event_logs(date, send_message_func)
+    task = asyncio.create_task(send_pdf_report(date, snapshots, send_message_func, send_document_func))
+    _report_tasks.add(task)
+    task.add_done_callback(_report_tasks.discard)
+
+
+# Запрос отчета из обработчика: перенос логов фиксирует единицу работы, а внутри пачки это разорвало бы
+# ее фиксацию вместе с курсорами - отчет строится при сбросе логов после пачки (flush_event_logs)
+def schedule_pdf_report(date, send_message_func, send_document_func):
+    _scheduled_reports.append((date, send_message_func, send_document_func))
+
+
+async def start_scheduled_reports():
+    while _scheduled_reports:
+        await generate_pdf_report(*_scheduled_reports.pop(0))
+
+
+# Ожидание отчетов, которые ещё строятся (перед завершением работы)
+async def wait_pdf_reports():
+    await start_scheduled_reports()
+    if _report_tasks:
+        print(f"Ожидание построения отчетов: {len(_report_tasks)}")
+        await asyncio.gather(*_report_tasks, return_exceptions=True)
+
+
+# Набор правил обнаружения (компилируется один раз за процесс)
+_rule_set = None
+
+
+# Функция получения правил обнаружения из RULES_FILE
+def load_rule_set():
+    global _rule_set
+    if _rule_set is None:
+        _rule_set = load_rules(RULES_FILE)
+        print(f"Загружено правил обнаружения: {len(_rule_set)} из {RULES_FILE}")
+    return _rule_set
+
+
+# Обработчик событий по правилам (4624, 4672, 4698, 4697, 7045 и добавленные в rules.json):
+# подходящие события записываются в накопительные логи, события сеансов входа передаются в корреляцию
+# (их оповещения уходят сообщением о сеансе), остальные оповещения отправляются по правилам
+# в порядке файла правил, внутри правила - от новых к старым
+async def handle_rule_events(records, rule_set, send_message_func, host=None):
+    print(f"Обработка событий по правилам: {len(records)} записей")
+
+    correlator = load_correlator()
+    now = time.time()
+    alerts = {rule.name: [] for rule in rule_set.rules}
+    # Время сопоставления с правилами копится по пачке: замер каждой записи стоил бы дороже самой проверки
+    match_seconds = 0.0
+    for record in records:
+        started = time.perf_counter()
+        matches = rule_set.match(record)
+        match_seconds += time.perf_counter() - started
+        for rule, values in matches:
+            entry = rule.log_entry(record, values) if rule.log_file else None
+            if entry is not None:
+                await log_event_to_json(rule.log_file, entry, send_message_func, host)
+            message = rule.format_message(record, values) if rule.alerts(values) else None
+            # Критичные оповещения не придерживаются
+            if rule.severity != "critical":
+                event = SessionEvent(record.timestamp, rule.event_id, rule.name,
+                                     entry["summary"] if entry is not None else "", message)
+                if correlate_event(correlator, host, values.get("logon_id"), event, now, values.get("user"),
+                                   values.get("domain"), values.get("logon_type")):
+                    continue
+            if message is not None:
+                alerts[rule.name].append((record.timestamp, rule, message))
+    STAGE_SECONDS.observe(match_seconds, stage="rules", name="")
 
-    while True:
-        try:
-            events = win32evtlog.ReadEventLog(security_log, flags, 0)
-            if not events:
-                print("Событий больше нет.")
-                break
-        except Exception as e:
-            print(f"Ошибка чтения журнала Security: {e}")
-            break
-
-        for event in events:
-            event_id = event.EventID & 0xFFFF
-            event_time = event.TimeGenerated.replace(tzinfo=dt.timezone.utc)
-
-            if event_time < time_threshold:
-                break
-
-            if event_id == 4624:
-                event_data = event.StringInserts or []
-                if len(event_data) > 9:
-                    logon_type = event_data[8]
-                    user = event_data[5]
-                    account_domain = event_data[6]
-                    if logon_type in ["2", "7", "15"]:
-                        event_info = {
-                            "time": event_time.isoformat(),
-                            "user": user,
-                            "domain": account_domain,
-                            "logon_type": logon_type,
-                            "data": event_data
-                        }
-                        logon_events.append(event_info)
-                        # Накопительное логирование
-                        await log_event_to_json(EVENTS_4624_LOG, {
-                            "time": event_time.isoformat(),
-                            "summary": f"Пользователь: {user}, Тип: {logon_type}, Домен: {account_domain}"
-                        }, send_message_func)
-
-            elif event_id == 4672:
-                event_data = event.StringInserts or []
-                if len(event_data) >= 3:
-                    sid = event_data[0]
-                    user = event_data[1]
-                    account_domain = event_data[2]
-                    privileges = event_data[3] if len(event_data) > 3 else "Не определено"
-                    if user not in ["СИСТЕМА", "SYSTEM"] and sid != "S-1-5-18":
-                        if privileges and privileges != "Не определено":
-                            privileges = ", ".join([p.strip() for p in privileges.split("\r\n") if p.strip()])
-                        event_info = {
-                            "time": event_time.isoformat(),
-                            "user": user,
-                            "domain": account_domain,
-                            "privileges": privileges,
-                            "data": event_data
-                        }
-                        privilege_events.append(event_info)
-                        # Накопительное логирование
-                        await log_event_to_json(EVENTS_4672_LOG, {
-                            "time": event_time.isoformat(),
-                            "summary": f"Пользователь: {user}, Привилегии: {privileges}, Домен: {account_domain}"
-                        }, send_message_func)
-
-            elif event_id == 4698:
-                event_data = event.StringInserts or []
-                if len(event_data) >= 5:
-                    sid = event_data[0]
-                    user = event_data[1]
-                    account_domain = event_data[2]
-                    task_name = event_data[4]
-                    task_content = event_data[5] if len(event_data) > 5 else "Не определено"
-                    if user not in ["СИСТЕМА", "SYSTEM"] and sid != "S-1-5-18":
-                        event_info = {
-                            "time": event_time.isoformat(),
-                            "user": user,
-                            "domain": account_domain,
-                            "task_name": task_name,
-                            "task_content": task_content,
-                            "data": event_data
-                        }
-                        task_events.append(event_info)
-                        # Накопительное логирование
-                        await log_event_to_json(EVENTS_4698_LOG, {
-                            "time": event_time.isoformat(),
-                            "summary": f"Задача: {task_name}, Пользователь: {user}, Содержимое: {task_content}"
-                        }, send_message_func)
-
-    win32evtlog.CloseEventLog(security_log)
-    print("Журнал Security закрыт")
-
-    # Обработка событий входа (4624)
-    last_saved_logon_time = read_last_event_time(LOGON_LOG_FILE)
-    logon_types = {
-        "2": "Локальный вход",
-        "7": "Разблокировка",
-        "15": "Удаленный вход (RDP)"
-    }
-    for event in sorted(logon_events, key=lambda x: datetime.fromisoformat(x["time"]), reverse=True):
-        event_time = datetime.fromisoformat(event["time"])
-        if last_saved_logon_time is None or event_time > last_saved_logon_time:
-            event_time_str = event_time.strftime("%Y-%m-%d %H:%M:%S")
-            message = (
-                f"🔑 Вход пользователя:\n"
-                f"Пользователь: {event['user'] or 'Не определён'}\n"
-                f"Время: {event_time_str}\n"
-                f"Домен: {event['domain'] or 'Не определён'}\n"
-                f"Тип входа: {logon_types.get(event['logon_type'], 'Неизвестный тип')} "
-                f"(тип {event['logon_type']})\n"
-                f"Полные данные события: {event['data']}"
-            )
+    for rule_alerts in alerts.values():
+        rule_alerts.sort(key=lambda alert: alert[0], reverse=True)
+        for _, rule, message in rule_alerts:
             await send_message_func(message)
-            print(
-                f"🟢 Event ID: 4624\n    Время (МСК): {event_time_str}\n    Пользователь: {event['user']}\n    Домен: {event['domain']}\n    Тип входа: {event['logon_type']}")
+            ALERTS.inc(kind=rule.name)
+            print(f"🟢 Event ID: {rule.event_id} ({rule.name}, {rule.severity})\n{message}")
             print("-" * 50)
-    if logon_events:
-        latest_logon_time = max(datetime.fromisoformat(event["time"]) for event in logon_events)
-        if last_saved_logon_time is None or latest_logon_time > last_saved_logon_time:
-            await write_last_event_time(LOGON_LOG_FILE, latest_logon_time, send_message_func)
-
-    # Обработка событий привилегий (4672)
-    last_saved_privilege_time = read_last_event_time(PRIVILEGE_LOG_FILE)
-    for event in sorted(privilege_events, key=lambda x: datetime.fromisoformat(x["time"]), reverse=True):
-        event_time = datetime.fromisoformat(event["time"])
-        if last_saved_privilege_time is None or event_time > last_saved_privilege_time:
-            event_time_str = event_time.strftime("%Y-%m-%d %H:%M:%S")
-            message = (
-                f"🔒 Назначение привилегий:\n"
-                f"Пользователь: {event['user'] or 'Не определён'}\n"
-                f"Время: {event_time_str}\n"
-                f"Домен: {event['domain'] or 'Не определён'}\n"
-                f"Привилегии: {event['privileges'] or 'Не определено'}\n"
-                f"Полные данные события: {event['data']}"
-            )
-            await send_message_func(message)
-            print(
-                f"🟢 Event ID: 4672\n    Время (МСК): {event_time_str}\n    Пользователь: {event['user']}\n    Домен: {event['domain']}\n    Привилегии: {event['privileges']}")
-            print("-" * 50)
-    if privilege_events:
-        latest_privilege_time = max(datetime.fromisoformat(event["time"]) for event in privilege_events)
-        if last_saved_privilege_time is None or latest_privilege_time > last_saved_privilege_time:
-            await write_last_event_time(PRIVILEGE_LOG_FILE, latest_privilege_time, send_message_func)
-
-    # Обработка событий задач (4698)
-    last_saved_task_time = read_last_event_time(TASK_LOG_FILE)
-    for event in sorted(task_events, key=lambda x: datetime.fromisoformat(x["time"]), reverse=True):
-        event_time = datetime.fromisoformat(event["time"])
-        if last_saved_task_time is None or event_time > last_saved_task_time:
-            event_time_msk = event_time + timedelta(hours=3)
-            time_str = event_time_msk.strftime("%d.%m.%Y %H:%M:%S")
-            event_time_str = event_time.strftime("%Y-%m-%d %H:%M:%S")
-            print(f"🟢 Event ID: 4698")
-            print(f"    Время (МСК): {time_str}")
-            print(f"    Пользователь: {event['user'] or 'Не определён'}")
-            print(f"    Домен: {event['domain'] or 'Не определён'}")
-            print(f"    Имя задачи: {event['task_name'] or 'Не определено'}")
-            print(f"    Содержимое задачи: {event['task_content'] or 'Не определено'}")
-            print("-" * 50)
-            message = (
-                f"📋 Создана задача: {event['task_name'] or 'Не определено'}\n"
-                f"Пользователь: {event['user'] or 'Не определён'}\n"
-                f"Домен: {event['domain'] or 'Не определён'}\n"
-                f"Время: {event_time_str}\n"
-                f"Содержимое: {event['task_content'] or 'Не определено'}"
-            )
-            await send_message_func(message)
-    if task_events:
-        latest_task_time = max(datetime.fromisoformat(event["time"]) for event in task_events)
-        if last_saved_task_time is None or latest_task_time > last_saved_task_time:
-            await write_last_event_time(TASK_LOG_FILE, latest_task_time, send_message_func)
 
-    return logon_events, privilege_events, task_events
+    await send_correlation_alerts(send_message_func)
 
 
-# Функция поиска последнего события включения компьютера (Event ID 6005)
-async def check_system_startup(send_message_func, send_document_func):
-    print(f"Начало проверки событий включения за последнюю минуту...")
-
-    try:
-        system_log = win32evtlog.OpenEventLog("localhost", "System")
-        print("Журнал System открыт")
-    except Exception as e:
-        print(f"Ошибка открытия журнала: {e}")
-        await send_message_func(f"📋 Ошибка: не удалось открыть журнал System - {str(e)}")
-        return
+# Обработчик событий включения компьютера (Event ID 6005) и смены дня
+async def handle_system_startup(records, send_message_func, send_document_func, host=None):
+    print(f"Обработка событий включения: {len(records)} записей")
 
     now = datetime.now(dt.timezone.utc)
-    time_threshold = now - timedelta(minutes=TIME_RANGE_MINUTES)
-    last_saved_time = read_last_event_time(STARTUP_LOG_FILE)
+    # Время включения хранится для каждого компьютера, дата проверки смены дня - общая
+    startup_log_file = host_state_path(host, STARTUP_LOG_FILE)
+    last_saved_time = read_last_event_time(startup_log_file)
     last_startup_event = None
 
-    # Проверка смены дня для генерации отчета
-    if last_saved_time:
-        last_date = last_saved_time.date()
-        current_date = now.date()
+    # Проверка смены дня для генерации отчета; дата последней проверки хранится отдельно,
+    # чтобы отчет не формировался повторно, пока компьютер не перезагружался
+    last_check_time = read_last_event_time(LAST_CHECK_FILE) or last_saved_time
+    current_date = now.date()
+    if last_check_time:
+        last_date = last_check_time.date()
         if last_date < current_date:
             print(f"Обнаружена смена дня: последняя дата {last_date}, текущая {current_date}")
-            await generate_pdf_report(last_date, send_message_func, send_document_func)
-
-    while True:
-        try:
-            events = win32evtlog.ReadEventLog(
-                system_log,
-                win32evtlog.EVENTLOG_BACKWARDS_READ | win32evtlog.EVENTLOG_SEQUENTIAL_READ,
-                0
-            )
-            if not events:
-                print("События закончились")
-                break
-        except Exception as e:
-            print(f"Ошибка чтения журнала: {e}")
-            break
-
-        for event in events:
-            event_id = event.EventID & 0xFFFF
-            event_time = event.TimeGenerated.replace(tzinfo=dt.timezone.utc)
-
-            if event_time < time_threshold:
-                break
-
-            if event_id == 6005:
-                event_data = event.StringInserts
-                data_str = event_data[0] if event_data and isinstance(event_data, list) and len(
-                    event_data) > 0 else None
-                if not data_str:
-                    try:
-                        data_str = event.Message or "Нет данных"
-                    except AttributeError:
-                        data_str = "Нет данных"
-                print(f"Отладка 6005: StringInserts={event_data}, Message={getattr(event, 'Message', 'Недоступно')}")
-                if last_startup_event is None or event_time > last_startup_event["time"]:
-                    last_startup_event = {
-                        "time": event_time,
-                        "data": data_str
-                    }
-                print(f"Обнаружено событие 6005: Время {event_time}, Данные {data_str}")
-                # Накопительное логирование
-                await log_event_to_json(EVENTS_6005_LOG, {
-                    "time": event_time.isoformat(),
-                    "summary": f"Включение ПК, Детали: {data_str}"
-                }, send_message_func)
-
-    win32evtlog.CloseEventLog(system_log)
-    print("Журнал закрыт")
+            schedule_pdf_report(last_date, send_message_func, send_document_func)
+    if last_check_time is None or last_check_time.date() < current_date:
+        await write_last_event_time(LAST_CHECK_FILE, now, send_message_func)
+
+    for event in records:
+        event_time = event.time
+        event_data = event.inserts
+        data_str = event_data[0] if event_data else None
+        if not data_str:
+            data_str = event.message or "Нет данных"
+        print(f"Отладка 6005: StringInserts={event_data}, Message={event.message or 'Недоступно'}")
+        if last_startup_event is None or event.timestamp > last_startup_event["timestamp"]:
+            last_startup_event = {
+                "time": event_time,
+                "timestamp": event.timestamp,
+                "data": data_str
+            }
+        print(f"Обнаружено событие 6005: Время {event_time}, Данные {data_str}")
+        # Накопительное логирование
+        await log_event_to_json(EVENTS_6005_LOG, {
+            "time": event_time.isoformat(),
+            "summary": f"Включение ПК, Детали: {data_str}",
+            "event_id": 6005
+        }, send_message_func, host)
 
     if last_startup_event:
         event_time = last_startup_event["time"]
@@ -441,420 +353,484 @@ async def check_system_startup(send_message_func, send_document_func):
             event_time_str = event_time.strftime("%Y-%m-%d %H:%M:%S")
             message = f"🖥️ Компьютер включен! Время: {event_time_str}" + \
                       (f", Детали: {last_startup_event['data']}" if last_startup_event['data'] != "Нет данных" else "")
-            await write_last_event_time(STARTUP_LOG_FILE, event_time, send_message_func)
+            await write_last_event_time(startup_log_file, event_time, send_message_func)
             await send_message_func(message)
+            ALERTS.inc(kind="6005")
+
+
+# Кэши Sysmon, которые в режиме службы живут между проверками
+_seen_indexes = {}  # компьютер (None - локальный) -> индекс обработанных ProcessGuid
+_vt_cache = None
+_burst = None
+_correlator = None
+_allowlist = False  # False - индекс ещё не открывался, None - индекса нет
+VT_CLIENT = None  # Конвейер проверок VirusTotal (запускается из main)
+_backlog_summary = None  # Сводка идущего догоняющего чтения (None - чтения нет)
+_backlog_hashes = set()  # Хэши, поставленные на проверку догоняющим чтением и ещё не проверенные
+_backlog_verdicts = []  # Их вердикты, пришедшие после сводки (уходят одним сообщением)
+
+
+# Функция получения индекса обработанных ProcessGuid за последние 24 часа (загружается один раз за процесс;
+# у каждого компьютера свой индекс, прежний лог переносится только в индекс локального компьютера)
+async def load_seen_index(send_message_func, host=None):
+    seen_index = _seen_indexes.get(host)
+    if seen_index is None:
+        seen_dir = host_state_path(host, SYSMON_SEEN_DIR)
+        seen_index = GuidIndex(seen_dir)
+        try:
+            seen_index.load()
+            if host is None:
+                seen_index.migrate_log(SYSMON_LOG_FILE)
+        except Exception as e:
+            print(f"Ошибка чтения {seen_dir}: {e}")
+            await send_message_func(f"📋 Ошибка: не удалось прочитать {seen_dir} - {str(e)}")
+        _seen_indexes[host] = seen_index
+    expired = seen_index.expire()
+    if expired:
+        print(f"Удалено устаревших корзин ProcessGuid: {expired}")
+    return seen_index
+
+
+# Функция получения кэша VirusTotal (база открывается один раз за процесс)
+def load_vt_cache():
+    global _vt_cache
+    if _vt_cache is None:
+        _vt_cache = VerdictCache(SYSMON_CACHE_FILE)
+        _vt_cache.migrate_json(LEGACY_SYSMON_CACHE_FILE)
+    return _vt_cache
+
+
+# Функция получения списка разрешенных хэшей (индекс открывается один раз за процесс)
+def get_allowlist():
+    global _allowlist
+    if _allowlist is False:
+        try:
+            _allowlist = load_allowlist(ALLOWLIST_FILE)
+        except Exception as e:
+            print(f"Ошибка чтения {ALLOWLIST_FILE}: {e}")
+            _allowlist = None
+    return _allowlist
 
 
-# Функция поиска событий установки и изменения служб (Event ID 4697 и 7045)
-async def check_service_modification(send_message_func):
-    print(f"Начало проверки событий 4697 и 7045 (службы) за последнюю минуту...")
+# Функция получения детектора повторных запусков (общий для всех компьютеров, имя компьютера входит в ключ)
+def load_burst_detector():
+    global _burst
+    if _burst is None:
+        _burst = BurstDetector()
+        try:
+            _burst.load(BURST_STATE_FILE)
+        except Exception as e:
+            print(f"Ошибка чтения {BURST_STATE_FILE}: {e}")
+    return _burst
 
-    now = datetime.now(dt.timezone.utc)
-    time_threshold = now - timedelta(minutes=TIME_RANGE_MINUTES)
-    last_saved_time = read_last_event_time(SERVICE_LOG_FILE)
-    new_service_events = []
 
-    # Проверка событий 4697 (Security)
+# Сохранение состояния подавления повторов (в конце запуска)
+def save_burst_state():
+    if _burst is None:
+        return
     try:
-        security_log = win32evtlog.OpenEventLog("localhost", "Security")
-        print("Журнал Security открыт")
+        _burst.save(BURST_STATE_FILE)
     except Exception as e:
-        print(f"Ошибка открытия журнала Security: {e}")
-        await send_message_func(f"📋 Ошибка: не удалось открыть журнал Security - {str(e)}")
-        return
+        print(f"Ошибка записи {BURST_STATE_FILE}: {e}")
+
+
+# Функция подписи ключа повторных запусков в оповещениях
+def _burst_key_text(key):
+    host, image, sha256, user = key
+    text = f"{host}: {image}" if host else image
+    return f"{text} (пользователь {user or '<неизвестно>'}, SHA256 {sha256[:12] + '…' if sha256 else '<неизвестно>'})"
 
-    flags = win32evtlog.EVENTLOG_BACKWARDS_READ | win32evtlog.EVENTLOG_SEQUENTIAL_READ
 
-    while True:
+# Сводка подавленных повторных запусков (не чаще раза в BURST_ROLLUP_SECONDS)
+async def send_burst_rollup(send_message_func):
+    burst = load_burst_detector()
+    BURST_KEYS.set(len(burst.keys))
+    rollup = burst.rollup(time.time())
+    if rollup is None:
+        return
+    top, other = rollup
+    lines = [f"🔁 Повторные запуски за {BURST_ROLLUP_SECONDS // 60} мин (оповещения подавлены):"]
+    for key, suppressed, window, spiking in top:
+        lines.append(f"{'⚡ ' if spiking else ''}{_burst_key_text(key)}: ×{suppressed}, за минуту {window}")
+    if other:
+        lines.append(f"И ещё запусков других процессов: {other}")
+    await send_message_func("\n".join(lines))
+    ALERTS.inc(kind="burst_rollup")
+
+
+# Функция получения корреляции сеансов входа (общая для всех компьютеров, имя компьютера входит в ключ сеанса)
+def load_correlator():
+    global _correlator
+    if _correlator is None:
+        _correlator = Correlator()
         try:
-            events = win32evtlog.ReadEventLog(security_log, flags, 0)
-            if not events:
-                print("Событий 4697 больше нет.")
-                break
+            _correlator.load(CORRELATION_STATE_FILE)
         except Exception as e:
-            print(f"Ошибка чтения журнала Security: {e}")
-            await send_message_func(f"📋 Ошибка: не удалось прочитать журнал Security - {str(e)}")
-            break
-
-        for event in events:
-            event_id = event.EventID & 0xFFFF
-            event_time = event.TimeGenerated.replace(tzinfo=dt.timezone.utc)
-
-            if event_time < time_threshold:
-                break
-
-            if event_id == 4697:
-                event_data = event.StringInserts or []
-                sid = None
-                user = None
-                account_domain = None
-                service_name = None
-                service_file_name = None
-                service_type = None
-                service_start_type = None
-                service_account = None
-
-                if len(event_data) >= 8:
-                    sid = event_data[0]
-                    user = event_data[1]
-                    account_domain = event_data[2]
-                    service_name = event_data[4]
-                    service_file_name = event_data[5]
-                    service_type = event_data[6]
-                    service_start_type = event_data[7]
-                    service_account = event_data[8] if len(event_data) > 8 else "Не определено"
-
-                if user in ["СИСТЕМА", "SYSTEM"] or sid == "S-1-5-18":
-                    continue
+            print(f"Ошибка чтения {CORRELATION_STATE_FILE}: {e}")
+    return _correlator
 
-                event_info = {
-                    "event_id": 4697,
-                    "time": event_time.isoformat(),
-                    "user": user,
-                    "domain": account_domain,
-                    "service_name": service_name,
-                    "service_file_name": service_file_name,
-                    "service_type": service_type,
-                    "service_start_type": service_start_type,
-                    "service_account": service_account,
-                    "data": event_data
-                }
-                new_service_events.append(event_info)
-                # Накопительное логирование
-                await log_event_to_json(EVENTS_SERVICE_LOG, {
-                    "time": event_time.isoformat(),
-                    "summary": f"Новая служба: {service_name}, Тип: {service_start_type}, Пользователь: {user}"
-                }, send_message_func)
-
-    win32evtlog.CloseEventLog(security_log)
-    print("Журнал Security закрыт")
-
-    # Проверка событий 7045 (System)
+
+# Сохранение сеансов и придержанных оповещений (в конце запуска; однократная проверка отправляет их
+# в следующем запуске, режимы службы - перед сохранением, см. send_held_correlation_alerts)
+def save_correlation_state():
+    if _correlator is None:
+        return
     try:
-        system_log = win32evtlog.OpenEventLog("localhost", "System")
-        print("Журнал System открыт")
+        _correlator.save(CORRELATION_STATE_FILE)
     except Exception as e:
-        print(f"Ошибка открытия журнала System: {e}")
-        await send_message_func(f"📋 Ошибка: не удалось открыть журнал System - {str(e)}")
-        return
+        print(f"Ошибка записи {CORRELATION_STATE_FILE}: {e}")
 
-    while True:
-        try:
-            events = win32evtlog.ReadEventLog(system_log, flags, 0)
-            if not events:
-                print("Событий 7045 больше нет.")
-                break
-        except Exception as e:
-            print(f"Ошибка чтения журнала System: {e}")
-            await send_message_func(f"📋 Ошибка: не удалось прочитать журнал System - {str(e)}")
-            break
-
-        for event in events:
-            event_id = event.EventID & 0xFFFF
-            event_time = event.TimeGenerated.replace(tzinfo=dt.timezone.utc)
-
-            if event_time < time_threshold:
-                break
-
-            if event_id == 7045:
-                event_data = event.StringInserts or []
-                service_name = None
-                service_file_name = None
-                service_type = None
-                service_start_type = None
-                service_account = None
-                user = None
-
-                if len(event_data) >= 5:
-                    service_name = event_data[0]
-                    service_file_name = event_data[1]
-                    service_start_type = event_data[2]
-                    service_type = event_data[3]
-                    service_account = event_data[4]
-                    user = event_data[5] if len(event_data) > 5 else "Не определено"
-
-                if user in ["СИСТЕМА", "SYSTEM"]:
-                    continue
 
-                event_info = {
-                    "event_id": 7045,
-                    "time": event_time.isoformat(),
-                    "user": user,
-                    "domain": "Не применимо",
-                    "service_name": service_name,
-                    "service_file_name": service_file_name,
-                    "service_type": service_type,
-                    "service_start_type": service_start_type,
-                    "service_account": service_account,
-                    "data": event_data
-                }
-                new_service_events.append(event_info)
-                # Накопительное логирование
-                await log_event_to_json(EVENTS_SERVICE_LOG, {
-                    "time": event_time.isoformat(),
-                    "summary": f"Изменена служба: {service_name}, Тип: {service_start_type}, Пользователь: {user}"
-                }, send_message_func)
-
-    win32evtlog.CloseEventLog(system_log)
-    print("Журнал System закрыт")
-
-    # Сортировка событий по времени (от новых к старым)
-    new_service_events.sort(key=lambda x: datetime.fromisoformat(x["time"]), reverse=True)
-
-    # Обработка и отправка всех новых событий
-    if new_service_events:
-        latest_event_time = max(datetime.fromisoformat(event["time"]) for event in new_service_events)
-        for event in new_service_events:
-            if last_saved_time is None or datetime.fromisoformat(event["time"]) > last_saved_time:
-                event_time_str = datetime.fromisoformat(event["time"]).strftime("%Y-%m-%d %H:%M:%S")
-                start_type = event["service_start_type"]
-                # Для 4697 преобразуем числовой тип запуска
-                if event["event_id"] == 4697:
-                    start_types = {
-                        "0": "Загрузка при старте системы",
-                        "1": "Загрузка при старте ядра",
-                        "2": "Автоматический запуск",
-                        "3": "По требованию",
-                        "4": "Отключена"
-                    }
-                    start_type = start_types.get(start_type, f"Неизвестный тип ({start_type})")
-                event_type = "Новая служба" if event["event_id"] == 4697 else "Изменена служба"
-                message = (
-                    f"⚙️ {event_type}: \"{event['service_name'] or 'Не определено'}\" "
-                    f"Тип: {start_type or 'Не определено'} "
-                    f"Время: {event_time_str}"
-                )
-                await send_message_func(message)
-                print(
-                    f"⚙️ {event_type} за последнюю минуту:\n"
-                    f"Служба: {event['service_name'] or 'Не определено'}\n"
-                    f"Пользователь: {event['user'] or 'Не определён'}\n"
-                    f"Время: {event_time_str}\n"
-                    f"Домен: {event['domain'] or 'Не определён'}\n"
-                    f"Путь: {event['service_file_name'] or 'Не определено'}\n"
-                    f"Тип службы: {event['service_type'] or 'Не определено'}\n"
-                    f"Тип запуска: {start_type or 'Не определено'}\n"
-                    f"Учетная запись: {event['service_account'] or 'Не определено'}\n"
-                    f"Полные данные события: {event['data']}"
-                )
-        if last_saved_time is None or latest_event_time > last_saved_time:
-            await write_last_event_time(SERVICE_LOG_FILE, latest_event_time, send_message_func)
+# Функция передачи события в корреляцию: с LogonId - в сеанс (opens=False - только в уже известный),
+# оповещение без LogonId - в недавний сеанс с привилегиями на том же компьютере.
+# True - событие взято в сеанс и его оповещение уйдет сообщением о сеансе
+def correlate_event(correlator, host, logon_id, event, now, user=None, domain=None, logon_type=None, opens=True):
+    if logon_id:
+        taken = correlator.observe(host, logon_id, event, user, domain, logon_type, opens, now)
     else:
-        print("Новых событий 4697 или 7045 не найдено.")
+        taken = event.message is not None and correlator.observe_host(host, event, now)
+    CORRELATION_EVENTS.inc(result=("held" if event.message is not None else "context") if taken else "passed")
+    return taken
+
+
+# Отправка сообщений о сеансах, в которых наступила пауза (в конце обработки каждой пачки)
+async def send_correlation_alerts(send_message_func):
+    correlator = load_correlator()
+    messages = correlator.flush(time.time())
+    CORRELATION_SESSIONS.set(len(correlator.sessions))
+    for message in messages:
+        await send_message_func(message)
+        ALERTS.inc(kind="session")
+        print(f"🟢 Сеанс входа\n{message}")
+        print("-" * 50)
+
+
+# Отправка всех придержанных сообщений о сеансах, независимо от паузы (при остановке службы, потока
+# или сборщика: следующего запуска может не быть, а среди придержанных - создание задач и служб)
+async def send_held_correlation_alerts(send_message_func):
+    if _correlator is None:
+        return
+    for message in _correlator.flush_all():
+        await send_message_func(message)
+        ALERTS.inc(kind="session")
+        print(f"🟢 Сеанс входа (остановка)\n{message}")
+        print("-" * 50)
+
+
+# Запуск конвейера проверок VirusTotal; вердикт приходит отдельным сообщением вслед за оповещением
+async def start_vt_pipeline(send_message_func):
+    global VT_CLIENT, _backlog_hashes
+
+    # Вердикты по хэшам пропуска не отправляются по одному: во время догоняющего чтения - в его сводку,
+    # после нее - одним сообщением, когда проверены все хэши пропуска (или в конце запуска)
+    async def on_verdict(sha256, verdict, images):
+        processes = ", ".join(sorted(set(str(image) for image in images)))
+        ALERTS.inc(kind="virustotal")
+        message = f"🔎 VirusTotal: {verdict}\nSHA256: {sha256}\nПроцесс: {processes}"
+        if sha256 not in _backlog_hashes:
+            await send_message_func(message)
+            return
+        _backlog_hashes.discard(sha256)
+        if _backlog_summary is not None:
+            await _backlog_summary.send_message(message, kind="VirusTotal")
+            return
+        _backlog_verdicts.append(f"{verdict}: {sha256} ({processes})")
+        if not _backlog_hashes:
+            await send_backlog_verdicts(send_message_func)
+
+    vt_cache = load_vt_cache()
+    _backlog_hashes = load_backlog_hashes() & set(vt_cache.pending())
+    VT_CLIENT = VirusTotalClient(VIRUSTOTAL_API_KEY, vt_cache, on_verdict)
+    VT_CLIENT.start()
+    VT_CLIENT.resume()
+
+
+# Хэши пропуска, не проверенные прошлым запуском (их вердикты тоже уходят одним сообщением)
+def load_backlog_hashes():
+    if not os.path.exists(VT_BACKLOG_FILE):
+        return set()
+    try:
+        with open(VT_BACKLOG_FILE, "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    except Exception as e:
+        print(f"Ошибка чтения {VT_BACKLOG_FILE}: {e}")
+        return set()
 
 
-# Функция проверки событий Sysmon (Event ID 1)
-async def check_sysmon_process(send_message_func):
-    print(f"Начало проверки событий Sysmon (Event ID 1) за последнюю минуту...")
+# Начало догоняющего чтения: вердикты по хэшам, поставленным на проверку при нем, уходят в сводку
+def begin_backlog_verdicts(summary):
+    global _backlog_summary
+    _backlog_summary = summary
 
-    # Загружаем log, очищаем от старых
-    seen_guids = {}
-    cutoff = datetime.now(dt.UTC) - timedelta(hours=24)
-    if os.path.exists(SYSMON_LOG_FILE):
+
+# Конец догоняющего чтения (перед отправкой сводки); возвращает число хэшей пропуска, ещё ожидающих проверки
+def end_backlog_verdicts():
+    global _backlog_summary
+    _backlog_summary = None
+    return len(_backlog_hashes)
+
+
+# Отправка собранных вердиктов по хэшам пропуска одним сообщением
+async def send_backlog_verdicts(send_message_func):
+    global _backlog_verdicts
+    if not _backlog_verdicts:
+        return
+    lines = [f"🔎 VirusTotal по хэшам пропуска: {len(_backlog_verdicts)}"] + _backlog_verdicts
+    if _backlog_hashes:
+        lines.append(f"Ещё ожидают проверки: {len(_backlog_hashes)} (вердикты - после следующего запуска)")
+    _backlog_verdicts = []
+    await send_message_func("\n".join(lines))
+
+
+# Остановка конвейера проверок VirusTotal
+async def stop_vt_pipeline(send_message_func):
+    global VT_CLIENT, _vt_cache
+    if VT_CLIENT is not None:
+        await VT_CLIENT.stop()
+        VT_CLIENT = None
+        await send_backlog_verdicts(send_message_func)
         try:
-            with open(SYSMON_LOG_FILE, "r") as f:
-                for line in f:
-                    if '|' in line:
-                        guid, timestr = line.strip().split('|', 1)
-                        try:
-                            ts = datetime.strptime(timestr, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=dt.UTC)
-                            if ts > cutoff:
-                                seen_guids[guid] = ts
-                        except ValueError as e:
-                            print(f"Ошибка парсинга строки в логе {SYSMON_LOG_FILE}: {line.strip()} - {e}")
-                            continue
-            print(f"Загружено {len(seen_guids)} ProcessGuid из {SYSMON_LOG_FILE}")
+            atomic_write_json(VT_BACKLOG_FILE, sorted(_backlog_hashes))
         except Exception as e:
-            print(f"Ошибка чтения {SYSMON_LOG_FILE}: {e}")
-            await send_message_func(f"📋 Ошибка: не удалось прочитать {SYSMON_LOG_FILE} - {str(e)}")
+            print(f"Ошибка записи {VT_BACKLOG_FILE}: {e}")
+    if _vt_cache is not None:
+        print(f"Статистика: {_vt_cache.stats()}")
+        _vt_cache.close()
+        _vt_cache = None
+
+
+# Обработчик событий Sysmon (Event ID 1)
+async def handle_sysmon_process(records, send_message_func, host=None):
+    print(f"Обработка событий Sysmon (Event ID 1): {len(records)} записей")
+
+    seen_index = await load_seen_index(send_message_func, host)
+    vt_cache = load_vt_cache()
+    burst = load_burst_detector()
+    correlator = load_correlator()
+    allowlist = get_allowlist()
+    now = time.time()
 
-    # Сохраняем обновлённый лог без старых записей
+    event_count = 0
+    filtered_count = 0
+    suppressed_count = 0
+    allowed_count = 0
+    decode_seconds = 0.0  # Время разбора XML по пачке
+    for evt in records:
+        started = time.perf_counter()
+        event = decode_process_create(evt.xml)
+        decode_seconds += time.perf_counter() - started
+        if event is None:
+            filtered_count += 1
+            continue
+        # Для источников без отбора на сервере (фикстуры, классический API)
+        if ((SYSMON_IMAGE_INCLUDE and event.image not in SYSMON_IMAGE_INCLUDE)
+                or event.image in SYSMON_IMAGE_EXCLUDE):
+            filtered_count += 1
+            continue
+
+        event_id = PROCESS_CREATE_EVENT_ID
+        dt_utc = event.time
+        computer = event.computer
+
+        # Учетная запись процесса; без поля User (старые схемы Sysmon) - SID из System
+        user = event.user or event.user_sid
+        process_image = event.image
+        process_guid = event.process_guid
+        hashes = event.hashes
+        command_line = event.command_line
+
+        if not process_guid:
+            print(f"Пропущено событие: отсутствует ProcessGuid")
+            continue
+
+        if seen_index.contains(process_guid):
+            print(f"Пропущено событие: ProcessGuid {process_guid} уже обработан")
+            continue
+
+        # Извлечение SHA256
+        sha256 = sha256_from_hashes(hashes)
+
+        # Разрешенные (заведомо чистые) файлы только логируются: ни VirusTotal, ни оповещения
+        if sha256 and allowlist is not None and sha256 in allowlist:
+            await log_event_to_json(EVENTS_SYSMON_LOG, {
+                "time": dt_utc.isoformat(),
+                "summary": f"Процесс: {process_image}, Аргументы: {command_line or '<нет>'}, SHA256: {sha256}, в списке разрешенных",
+                "event_id": 1,
+                "user": user,
+                "image": process_image,
+                "sha256": sha256
+            }, send_message_func, host)
+            seen_index.add(process_guid, dt_utc)
+            ALLOWLIST_HITS.inc()
+            allowed_count += 1
+            event_count += 1
+            continue
+
+        # Повторы того же процесса (Image, SHA256, пользователь) после первого оповещения только считаются:
+        # ни сообщения, ни проверки VirusTotal; при всплеске частоты - одно отдельное оповещение
+        burst_key = (host or "", process_image or "", sha256 or "", user or "")
+        decision, spike_started = burst.observe(burst_key, event.timestamp)
+        BURST_EVENTS.inc(decision=decision)
+        # Время по МСК форматируется только для сообщений: повторы и разрешенные файлы его не выводят
+        time_str = None
+        if spike_started or decision != SUPPRESS:
+            time_str = (dt_utc + timedelta(hours=3)).strftime("%d.%m.%Y %H:%M:%S")
+        if spike_started:
+            await send_message_func(
+                f"⚡ Всплеск запусков: {_burst_key_text(burst_key)}\n"
+                f"За минуту: {burst.window_count(burst_key)}\n"
+                f"Время (МСК): {time_str}"
+            )
+            ALERTS.inc(kind="burst_spike")
+        if decision == SUPPRESS:
+            await log_event_to_json(EVENTS_SYSMON_LOG, {
+                "time": dt_utc.isoformat(),
+                "summary": f"Процесс: {process_image}, Аргументы: {command_line or '<нет>'}, SHA256: {sha256 or '<неизвестно>'}, повтор",
+                "event_id": 1,
+                "user": user,
+                "image": process_image,
+                "sha256": sha256
+            }, send_message_func, host)
+            seen_index.add(process_guid, dt_utc)
+            suppressed_count += 1
+            event_count += 1
+            continue
+
+        # Проверка VirusTotal: из кэша сразу, иначе - в очередь, вердикт придёт следом
+        vt_result = "<не проверено>"
+        if sha256:
+            cached = vt_cache.get(sha256)
+            if cached is not None:
+                vt_result = cached
+            elif VT_CLIENT is not None:
+                vt_result = "ожидает проверки"
+                # Вердикт приходит общим сообщением, поэтому процесс указывается вместе с компьютером
+                VT_CLIENT.submit(sha256, process_image if host is None else f"{host}: {process_image}")
+                if _backlog_summary is not None:
+                    _backlog_hashes.add(sha256)
+
+        # Вывод
+        print(f"🟢 Event ID: {event_id}")
+        print(f"    Время (МСК): {time_str}")
+        print(f"    Компьютер:   {computer}")
+        print(f"    Пользователь: {user}")
+        print(f"    хэш:   {hashes}")
+        print(f"    команлайн:   {command_line}")
+        if process_image:
+            print(f"    Процесс:     {process_image}")
+        print("-" * 50)
+        print(f"⚠️ Запущен процесс: {process_image}")
+        print(f"Аргументы: {command_line or '<нет>'}")
+        print(f"SHA256: {sha256 or '<неизвестно>'}")
+        print(f"VirusTotal: {vt_result}")
+        print()
+
+        # Отправка в Telegram; запуск из известного сеанса входа попадает в сообщение о сеансе
+        message = (
+            f"⚠️ Запущен процесс: {process_image}\n"
+            f"Пользователь: {user}\n"
+            f"Время (МСК): {time_str}\n"
+            f"Аргументы: {command_line or '<нет>'}\n"
+            f"SHA256: {sha256 or '<неизвестно>'}\n"
+            f"VirusTotal: {vt_result}"
+        )
+        session_event = SessionEvent(event.timestamp, PROCESS_EVENT_ID, "Запуск процесса",
+                                     f"{process_image}, Аргументы: {command_line or '<нет>'}", message)
+        if not (event.logon_id and correlate_event(correlator, host, event.logon_id, session_event, now, opens=False)):
+            await send_message_func(message)
+            ALERTS.inc(kind="sysmon")
+
+        # Накопительное логирование
+        await log_event_to_json(EVENTS_SYSMON_LOG, {
+            "time": dt_utc.isoformat(),
+            "summary": f"Процесс: {process_image}, Аргументы: {command_line or '<нет>'}, SHA256: {sha256 or '<неизвестно>'}, VirusTotal: {vt_result}",
+            "event_id": 1,
+            "user": user,
+            "image": process_image,
+            "sha256": sha256
+        }, send_message_func, host)
+
+        # Сохраняем новый GUID
+        seen_index.add(process_guid, dt_utc)
+        event_count += 1
+
+    # Записываем новые GUIDs в корзины индекса
+    try:
+        written = seen_index.flush(UNIT)
+        if written:
+            print(f"Добавлено {written} новых ProcessGuid в {seen_index.directory}")
+    except Exception as e:
+        print(f"Ошибка записи новых GUIDs в {seen_index.directory}: {e}")
+        await send_message_func(f"📋 Ошибка: не удалось записать новые GUIDs в {seen_index.directory} - {str(e)}")
     try:
-        with open(SYSMON_LOG_FILE, "w") as f:
-            for guid, ts in seen_guids.items():
-                f.write(f"{guid}|{ts.strftime('%Y-%m-%dT%H:%M:%S')}\n")
-        print(f"Обновлён {SYSMON_LOG_FILE} с {len(seen_guids)} записями")
+        vt_cache.flush_usage()
     except Exception as e:
-        print(f"Ошибка записи в {SYSMON_LOG_FILE}: {e}")
-        await send_message_func(f"📋 Ошибка: не удалось записать в {SYSMON_LOG_FILE} - {str(e)}")
+        print(f"Ошибка обновления кэша VirusTotal: {e}")
+
+    STAGE_SECONDS.observe(decode_seconds, stage="decode", name="sysmon")
+    if filtered_count:
+        print(f"Отброшено в обработчике Sysmon (не ID 1 или фильтр Image): {filtered_count}")
+    if allowed_count:
+        print(f"Запусков из списка разрешенных: {allowed_count}")
+    if suppressed_count:
+        print(f"Подавлено оповещений о повторных запусках: {suppressed_count}")
+    print(f"Всего событий Sysmon за минуту: {event_count}")
+
+    await send_burst_rollup(send_message_func)
+    await send_correlation_alerts(send_message_func)
 
-    # Загружаем кэш VirusTotal
-    vt_cache = {}
-    if os.path.exists(SYSMON_CACHE_FILE):
-        try:
-            with open(SYSMON_CACHE_FILE, "r") as f:
-                vt_cache = json.load(f)
-            print(f"Загружен кэш VirusTotal из {SYSMON_CACHE_FILE} ({len(vt_cache)} записей)")
-        except Exception as e:
-            print(f"Ошибка чтения кэша VirusTotal: {e}")
 
-    # Время
-    now_local = datetime.now()
-    now_utc = now_local - timedelta(hours=3)
-    one_minute_ago_utc = now_utc - timedelta(minutes=1)
+# Фильтр полей EventData для запроса к журналу Sysmon
+def sysmon_data_filter():
+    data_filter = {}
+    if SYSMON_IMAGE_INCLUDE:
+        data_filter["include"] = {"Image": SYSMON_IMAGE_INCLUDE}
+    if SYSMON_IMAGE_EXCLUDE:
+        data_filter["exclude"] = {"Image": SYSMON_IMAGE_EXCLUDE}
+    return data_filter
 
-    log_name = "Microsoft-Windows-Sysmon/Operational"
-    query = (
-        "*[System[TimeCreated[@SystemTime >= '{}']]]"
-        .format(one_minute_ago_utc.strftime("%Y-%m-%dT%H:%M:%S.0000000Z"))
-    )
 
-    # Запрос событий
+_sysmon_config_checked = False
+
+
+# Проверка запроса к журналу Sysmon по sysmonconfig.xml (один раз за процесс)
+def check_sysmon_query(scanner):
+    global _sysmon_config_checked
+    if _sysmon_config_checked:
+        return
+    _sysmon_config_checked = True
+    query = scanner.channel_query(SYSMON_CHANNEL)
+    print(f"Запрос к журналу Sysmon: {query}")
+    if not os.path.exists(SYSMON_CONFIG_FILE):
+        print(f"{SYSMON_CONFIG_FILE} не найден, проверка фильтров Sysmon пропущена")
+        return
     try:
-        h = win32evtlog.EvtQuery(log_name, win32evtlog.EvtQueryReverseDirection, query)
-        print("Журнал Sysmon открыт")
+        issues = check_sysmon_config(SysmonConfig(SYSMON_CONFIG_FILE), query)
     except Exception as e:
-        print(f"Ошибка открытия журнала Sysmon: {e}")
-        await send_message_func(f"📋 Ошибка: не удалось открыть журнал Sysmon - {str(e)}")
+        print(f"Ошибка чтения {SYSMON_CONFIG_FILE}: {e}")
         return
+    for issue in issues:
+        print(f"⚠️ {SYSMON_CONFIG_FILE}: {issue}")
+    if not issues:
+        print(f"Фильтры Sysmon согласованы с {SYSMON_CONFIG_FILE}")
 
-    event_count = 0
-    new_guids = []
-    while True:
-        try:
-            events = win32evtlog.EvtNext(h, 10)
-        except Exception:
-            break
-        if not events:
-            break
-
-        for evt in events:
-            xml_str = win32evtlog.EvtRender(evt, win32evtlog.EvtRenderEventXml)
-            event_dict = xmltodict.parse(xml_str)
-
-            system = event_dict.get("Event", {}).get("System", {})
-            event_data = event_dict.get("Event", {}).get("EventData", {})
-            event_id = system.get("EventID", "неизвестно")
-
-            if event_id != "1":
-                continue
-
-            utc_time_raw = system.get("TimeCreated", {}).get("@SystemTime", "")
-            computer = system.get("Computer", "неизвестно")
-
-            # Обработка даты
-            if '.' in utc_time_raw:
-                prefix, suffix = utc_time_raw.split('.')
-                fraction = suffix[:6]
-                utc_time_clean = f"{prefix}.{fraction}Z"
-            else:
-                utc_time_clean = utc_time_raw
-
-            try:
-                dt_utc = datetime.strptime(utc_time_clean, "%Y-%m-%dT%H:%M:%S.%fZ")
-            except ValueError:
-                continue
-
-            dt_msk = dt_utc + timedelta(hours=3)
-            time_str = dt_msk.strftime("%d.%m.%Y %H:%M:%S")
-
-            user_sid = system.get("Security", {}).get("@UserID", "неизвестно")
-            data_items = event_data.get("Data", [])
-
-            process_image = None
-            process_guid = None
-            hashes = None
-            command_line = None
-
-            for d in data_items if isinstance(data_items, list) else []:
-                name = d.get("@Name")
-                text = d.get("#text", "")
-                if name == "Image":
-                    process_image = text
-                elif name == "ProcessGuid":
-                    process_guid = text
-                elif name == "Hashes":
-                    hashes = text
-                elif name == "CommandLine":
-                    command_line = text
-
-            if not process_guid:
-                print(f"Пропущено событие: отсутствует ProcessGuid")
-                continue
-
-            if process_guid in seen_guids:
-                print(f"Пропущено событие: ProcessGuid {process_guid} уже обработан")
-                continue
-
-            # Извлечение SHA256
-            sha256 = None
-            if hashes:
-                for h in hashes.split(","):
-                    if h.startswith("SHA256="):
-                        sha256 = h.split("=")[1]
-                        break
-
-            # Проверка VirusTotal
-            vt_result = "<не проверено>"
-            if sha256:
-                if sha256 in vt_cache:
-                    vt_result = vt_cache[sha256]
-                else:
-                    try:
-                        response = requests.get(
-                            f"https://www.virustotal.com/api/v3/files/{sha256}",
-                            headers={"x-apikey": VIRUSTOTAL_API_KEY}
-                        )
-                        if response.status_code == 200:
-                            stats = response.json().get("data", {}).get("attributes", {}).get("last_analysis_stats", {})
-                            vt_result = f"{stats.get('malicious', 0)}/{stats.get('malicious', 0) + stats.get('undetected', 0)}"
-                            vt_cache[sha256] = vt_result
-                            try:
-                                with open(SYSMON_CACHE_FILE, "w") as f:
-                                    json.dump(vt_cache, f, indent=4)
-                                print(f"Обновлён кэш VirusTotal: добавлен SHA256 {sha256}")
-                            except Exception as e:
-                                print(f"Ошибка записи в {SYSMON_CACHE_FILE}: {e}")
-                        elif response.status_code == 404:
-                            vt_result = "0/0 (файл не найден)"
-                    except Exception as e:
-                        vt_result = f"ошибка: {str(e)}"
-
-            # Вывод
-            print(f"🟢 Event ID: {event_id}")
-            print(f"    Время (МСК): {time_str}")
-            print(f"    Компьютер:   {computer}")
-            print(f"    Пользователь: {user_sid}")
-            print(f"    хэш:   {hashes}")
-            print(f"    команлайн:   {command_line}")
-            if process_image:
-                print(f"    Процесс:     {process_image}")
-            print("-" * 50)
-            print(f"⚠️ Запущен процесс: {process_image}")
-            print(f"Аргументы: {command_line or '<нет>'}")
-            print(f"SHA256: {sha256 or '<неизвестно>'}")
-            print(f"VirusTotal: {vt_result}")
-            print()
-
-            # Отправка в Telegram
-            message = (
-                f"⚠️ Запущен процесс: {process_image}\n"
-                f"Время (МСК): {time_str}\n"
-                f"Аргументы: {command_line or '<нет>'}\n"
-                f"SHA256: {sha256 or '<неизвестно>'}\n"
-                f"VirusTotal: {vt_result}"
-            )
-            await send_message_func(message)
 
-            # Накопительное логирование
-            await log_event_to_json(EVENTS_SYSMON_LOG, {
-                "time": dt_utc.isoformat(),
-                "summary": f"Процесс: {process_image}, Аргументы: {command_line or '<нет>'}, SHA256: {sha256 or '<неизвестно>'}, VirusTotal: {vt_result}"
-            }, send_message_func)
+# Регистрация обработчиков в движке просмотра журналов; host - имя компьютера в режиме сборщика
+# (его состояние хранится отдельно, события в логах помечаются его именем)
+def register_handlers(scanner, send_message_func, send_document_func, host=None):
+    async def startup_handler(records):
+        await handle_system_startup(records, send_message_func, send_document_func, host)
 
-            # Сохраняем новый GUID
-            new_guids.append((process_guid, dt_utc))
-            event_count += 1
+    rule_set = load_rule_set()
 
-    # Записываем новые GUIDs в лог
-    if new_guids:
-        try:
-            with open(SYSMON_LOG_FILE, "a") as f:
-                for guid, ts in new_guids:
-                    f.write(f"{guid}|{ts.strftime('%Y-%m-%dT%H:%M:%S')}\n")
-            print(f"Добавлено {len(new_guids)} новых ProcessGuid в {SYSMON_LOG_FILE}")
-        except Exception as e:
-            print(f"Ошибка записи новых GUIDs в {SYSMON_LOG_FILE}: {e}")
-            await send_message_func(f"📋 Ошибка: не удалось записать новые GUIDs в {SYSMON_LOG_FILE} - {str(e)}")
+    async def rules_handler(records):
+        await handle_rule_events(records, rule_set, send_message_func, host)
+
+    async def sysmon_handler(records):
+        await handle_sysmon_process(records, send_message_func, host)
 
-    print(f"Всего событий Sysmon за минуту: {event_count}")
\ No newline at end of file
+    scanner.register("6005 (включение)", {SYSTEM_CHANNEL: [6005]}, startup_handler)
+    scanner.register(f"правила ({RULES_FILE})", rule_set.routes, rules_handler)
+    scanner.register("Sysmon (процессы)", {SYSMON_CHANNEL: [1]}, sysmon_handler,
+                     data_filters={SYSMON_CHANNEL: sysmon_data_filter()})
+    check_sysmon_query(scanner)
@@ -0,0 +1,425 @@
+import bisect
+import html
+import json
+import random
+import re
+import time
+from datetime import datetime, timedelta
+import datetime as dt
+
+# win32evtlog есть только на Windows; без него доступны источники-заглушки (JSON-фикстуры)
+try:
+    import win32evtlog
+except ImportError:
+    win32evtlog = None
+
+# Каналы журналов
+SECURITY_CHANNEL = "Security"
+SYSTEM_CHANNEL = "System"
+SYSMON_CHANNEL = "Microsoft-Windows-Sysmon/Operational"
+
+# Каналы, которые читаются через EvtQuery (новый API), а не через ReadEventLog
+EVT_CHANNELS = {SYSMON_CHANNEL}
+
+EVT_BATCH_SIZE = 100  # Количество событий за один вызов EvtNext
+
+_EVENT_ID_RE = re.compile(r"<EventID[^>]*>(\d+)</EventID>")
+_RECORD_ID_RE = re.compile(r"<EventRecordID>(\d+)</EventRecordID>")
+_SYSTEM_TIME_RE = re.compile(r"<TimeCreated SystemTime=['\"]([^'\"]+)['\"]")
+_DATA_RE = re.compile(r"<Data(?:\s+Name=['\"][^'\"]*['\"])?\s*(?:/>|>(.*?)</Data>)", re.S)
+
+
+# Единое представление записи журнала, независимое от источника
+class EventRecord:
+    __slots__ = ("channel", "record_number", "event_id", "time", "timestamp", "inserts", "message", "xml")
+
+    def __init__(self, channel, record_number, event_id, time, inserts=None, message=None, xml=None):
+        self.channel = channel
+        self.record_number = record_number
+        self.event_id = event_id
+        self.time = time  # datetime в UTC (для вывода)
+        self.timestamp = time.timestamp()  # секунды UTC: сравнение и сортировка без datetime
+        self.inserts = inserts or []
+        self.message = message
+        self.xml = xml
+
+    def to_dict(self):
+        return {
+            "channel": self.channel,
+            "record_number": self.record_number,
+            "event_id": self.event_id,
+            "time": self.time.isoformat(),
+            "inserts": self.inserts,
+            "message": self.message,
+            "xml": self.xml
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["channel"],
+            data.get("record_number"),
+            int(data["event_id"]),
+            datetime.fromisoformat(data["time"]),
+            data.get("inserts"),
+            data.get("message"),
+            data.get("xml")
+        )
+
+
+# Функция разбора времени из SystemTime (до микросекунд)
+def parse_system_time(value):
+    if '.' in value:
+        prefix, suffix = value.rstrip('Z').split('.', 1)
+        value = f"{prefix}.{suffix[:6]}"
+    else:
+        value = value.rstrip('Z')
+    return datetime.fromisoformat(value).replace(tzinfo=dt.timezone.utc)
+
+
+# Функция извлечения значений EventData в порядке следования (аналог StringInserts)
+def inserts_from_xml(xml_str):
+    start = xml_str.find("<EventData")
+    if start < 0:
+        return []
+    return [html.unescape(value or "") for value in _DATA_RE.findall(xml_str, start)]
+
+
+# Функция построения записи из XML-представления события (EvtRender);
+# для классических каналов (Security, System) заполняются и StringInserts
+def record_from_xml(channel, xml_str):
+    event_id = _EVENT_ID_RE.search(xml_str)
+    record_id = _RECORD_ID_RE.search(xml_str)
+    system_time = _SYSTEM_TIME_RE.search(xml_str)
+    return EventRecord(
+        channel,
+        int(record_id.group(1)) if record_id else None,
+        int(event_id.group(1)) if event_id else 0,
+        parse_system_time(system_time.group(1)) if system_time else datetime.now(dt.timezone.utc),
+        inserts_from_xml(xml_str) if channel not in EVT_CHANNELS else None,
+        xml=xml_str
+    )
+
+
+# Функция записи строки в XPath: в XPath 1.0 нет экранирования, поэтому кавычки выбираются по значению
+def _xpath_literal(value):
+    return f"'{value}'" if "'" not in value else f'"{value}"'
+
+
+# Фильтр запроса к каналу: EventID и точные значения полей EventData. Для каналов EvtQuery
+# (Sysmon) он превращается в XPath, и лишние события не покидают службу журналов;
+# XPath журналов Windows сравнивает только на равенство, исключения задаются через Suppress
+class ChannelQuery:
+    def __init__(self, event_ids=None, include=None, exclude=None):
+        self.event_ids = sorted(set(event_ids)) if event_ids else []
+        self.include = include or {}  # поле -> значения: нужны только записи с этими значениями
+        self.exclude = exclude or {}  # поле -> значения: записи с ними не нужны
+        self._field_patterns = {
+            name: re.compile(r"<Data Name=['\"]" + re.escape(name) + r"['\"]>([^<]*)</Data>")
+            for name in {**self.include, **self.exclude}
+        }
+
+    @staticmethod
+    def _data_conditions(fields):
+        return " or ".join(
+            f"Data[@Name='{name}']={_xpath_literal(value)}" for name, values in fields.items() for value in values
+        )
+
+    # Выражение отбора: позиция чтения (после записи after или с момента since) и EventID
+    def _select(self, since=None, after=None):
+        system = []
+        if after is not None:
+            system.append(f"EventRecordID > {after}")
+        elif since is not None:
+            system.append("TimeCreated[@SystemTime >= '{}']".format(
+                since.astimezone(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.0000000Z")))
+        if self.event_ids:
+            system.append("(" + " or ".join(f"EventID={event_id}" for event_id in self.event_ids) + ")")
+        parts = [f"System[{' and '.join(system)}]"] if system else []
+        if self.include:
+            parts.append(f"EventData[{self._data_conditions(self.include)}]")
+        return f"*[{' and '.join(parts)}]" if parts else "*"
+
+    # Аргументы EvtQuery/EvtSubscribe: (канал, запрос). С исключениями запрос структурированный
+    # (QueryList с Suppress), и канал указывается внутри него
+    def query_args(self, channel, since=None, after=None):
+        select = self._select(since, after)
+        if not self.exclude:
+            return channel, select
+        path = html.escape(channel)
+        suppress = f"*[EventData[{self._data_conditions(self.exclude)}]]"
+        return None, (
+            f'<QueryList><Query Id="0" Path="{path}">'
+            f'<Select Path="{path}">{html.escape(select, quote=False)}</Select>'
+            f'<Suppress Path="{path}">{html.escape(suppress, quote=False)}</Suppress>'
+            f'</Query></QueryList>'
+        )
+
+    def _field(self, record, name):
+        if not record.xml:
+            return None
+        found = self._field_patterns[name].search(record.xml)
+        return html.unescape(found.group(1)) if found else None
+
+    # Проверка записи тем же фильтром (источники без службы журналов и проверка на стороне Python);
+    # у записей без XML поля EventData неизвестны, для них проверяется только EventID
+    def matches(self, record):
+        if self.event_ids and record.event_id not in self.event_ids:
+            return False
+        if record.xml is None:
+            return True
+        for name, values in self.include.items():
+            if self._field(record, name) not in values:
+                return False
+        for name, values in self.exclude.items():
+            if self._field(record, name) in values:
+                return False
+        return True
+
+    def __str__(self):
+        return self._select()
+
+
+# Источник записей из журналов Windows (win32evtlog)
+class Win32EventSource:
+    def __init__(self, server="localhost"):
+        if win32evtlog is None:
+            raise RuntimeError("win32evtlog недоступен: источник журналов Windows работает только на Windows")
+        self.server = server
+        self.session = None  # Сеанс EvtOpenSession для удалённого компьютера (новый API)
+
+    # Сеанс удалённого доступа для EvtQuery; для локального компьютера не нужен
+    def _evt_session(self):
+        if self.server in (None, "", "localhost", "."):
+            return None
+        if self.session is None:
+            # Учётные данные текущего пользователя (None), проверка подлинности по умолчанию
+            self.session = win32evtlog.EvtOpenSession((self.server, None, None, None, 0),
+                                                      win32evtlog.EvtRpcLogin, 0, 0)
+        return self.session
+
+    # Чтение записей канала: после записи с номером after, а без курсора - созданных не раньше since.
+    # query (ChannelQuery) применяется службой журналов для каналов EvtQuery; классические каналы
+    # читаются целиком, и записи отбираются в Python
+    def read_channel(self, channel, since, after=None, query=None):
+        if channel in EVT_CHANNELS:
+            yield from self._query_channel(channel, since, after, query)
+        elif after is None:
+            yield from self._read_classic_channel(channel, since)
+        else:
+            yield from self._read_classic_after(channel, after)
+
+    def _make_record(self, channel, event):
+        try:
+            message = event.Message
+        except AttributeError:
+            message = None
+        return EventRecord(
+            channel,
+            event.RecordNumber,
+            event.EventID & 0xFFFF,
+            event.TimeGenerated.replace(tzinfo=dt.timezone.utc),
+            list(event.StringInserts or []),
+            message
+        )
+
+    # Первый запуск без курсора: чтение от новых к старым до границы since
+    def _read_classic_channel(self, channel, since):
+        handle = win32evtlog.OpenEventLog(self.server, channel)
+        flags = win32evtlog.EVENTLOG_BACKWARDS_READ | win32evtlog.EVENTLOG_SEQUENTIAL_READ
+        try:
+            since_timestamp = since.timestamp()
+            while True:
+                events = win32evtlog.ReadEventLog(handle, flags, 0)
+                if not events:
+                    return
+                for event in events:
+                    record = self._make_record(channel, event)
+                    if record.timestamp < since_timestamp:
+                        return
+                    yield record
+        finally:
+            win32evtlog.CloseEventLog(handle)
+
+    # Номер самой старой записи классического журнала (None - журнал пуст)
+    def oldest_record_number(self, channel):
+        handle = win32evtlog.OpenEventLog(self.server, channel)
+        try:
+            if not win32evtlog.GetNumberOfEventLogRecords(handle):
+                return None
+            return win32evtlog.GetOldestEventLogRecord(handle)
+        finally:
+            win32evtlog.CloseEventLog(handle)
+
+    # Инкрементальное чтение: от записи after + 1 вперёд до конца журнала
+    def _read_classic_after(self, channel, after):
+        handle = win32evtlog.OpenEventLog(self.server, channel)
+        try:
+            oldest = win32evtlog.GetOldestEventLogRecord(handle)
+            total = win32evtlog.GetNumberOfEventLogRecords(handle)
+            newest = oldest + total - 1
+            start = after + 1
+            if start > newest + 1:
+                print(f"Журнал {channel} был очищен (курсор {after}, последняя запись {newest}), чтение с начала")
+                start = oldest
+            elif start < oldest:
+                print(f"Журнал {channel} перезаписан: записи {start}-{oldest - 1} потеряны")
+                start = oldest
+            if total == 0 or start > newest:
+                return
+
+            flags = win32evtlog.EVENTLOG_FORWARDS_READ | win32evtlog.EVENTLOG_SEEK_READ
+            offset = start
+            while True:
+                events = win32evtlog.ReadEventLog(handle, flags, offset)
+                if not events:
+                    return
+                for event in events:
+                    if event.RecordNumber >= start:
+                        yield self._make_record(channel, event)
+                flags = win32evtlog.EVENTLOG_FORWARDS_READ | win32evtlog.EVENTLOG_SEQUENTIAL_READ
+                offset = 0
+        finally:
+            win32evtlog.CloseEventLog(handle)
+
+    def _query_channel(self, channel, since, after=None, query=None):
+        path, text = (query or ChannelQuery()).query_args(channel, since, after)
+        handle = win32evtlog.EvtQuery(path, win32evtlog.EvtQueryForwardDirection, text,
+                                      Session=self._evt_session())
+        while True:
+            try:
+                events = win32evtlog.EvtNext(handle, EVT_BATCH_SIZE)
+            except Exception:
+                return
+            if not events:
+                return
+            for evt in events:
+                xml_str = win32evtlog.EvtRender(evt, win32evtlog.EvtRenderEventXml)
+                yield record_from_xml(channel, xml_str)
+
+
+# Источник записей в памяти: синтетические записи для проверок и нагрузочных прогонов
+class MemoryEventSource:
+    def __init__(self):
+        self.records = {}  # канал -> записи в порядке возрастания номера
+        self.next_numbers = {}
+
+    # Добавление записи с очередным номером в канале
+    def add(self, channel, event_id, inserts=None, time=None, message=None, xml=None):
+        record_number = self.next_numbers.get(channel, 1)
+        self.next_numbers[channel] = record_number + 1
+        record = EventRecord(
+            channel, record_number, event_id,
+            time or datetime.now(dt.timezone.utc),
+            inserts, message, xml
+        )
+        self.records.setdefault(channel, []).append(record)
+        return record
+
+    def oldest_record_number(self, channel):
+        records = self.records.get(channel)
+        return records[0].record_number if records else None
+
+    # query имитирует отбор службой журналов, как у Win32EventSource - только для каналов EvtQuery
+    def read_channel(self, channel, since, after=None, query=None):
+        records = self.records.get(channel, [])
+        if after is not None:
+            # Номера записей возрастают, поэтому начало находим двоичным поиском
+            start = bisect.bisect_right(records, after, key=lambda r: r.record_number)
+            selected = records[start:]
+        else:
+            since_timestamp = since.timestamp()
+            selected = (record for record in records if record.timestamp >= since_timestamp)
+        if query is None or channel not in EVT_CHANNELS:
+            yield from selected
+        else:
+            yield from filter(query.matches, selected)
+
+
+SIMULATED_RETENTION = timedelta(minutes=10)  # Сколько хранит записи имитируемый журнал
+SIMULATED_SYSMON_XML = (
+    "<Event xmlns='http://schemas.microsoft.com/win/2004/08/events/event'><System>"
+    "<Provider Name='Microsoft-Windows-Sysmon'/><EventID>1</EventID>"
+    "<TimeCreated SystemTime='{time}'/><EventRecordID>{record}</EventRecordID>"
+    "<Computer>{host}</Computer><Security UserID='S-1-5-18'/></System><EventData>"
+    "<Data Name='ProcessGuid'>{{{guid}}}</Data><Data Name='Image'>{image}</Data>"
+    "<Data Name='CommandLine'>{image} /job {record}</Data>"
+    "<Data Name='Hashes'>SHA256={sha256}</Data><Data Name='LogonId'>0x3e7</Data>"
+    "<Data Name='User'>{user}</Data></EventData></Event>"
+)
+
+
+# Имитация удалённого компьютера для нагрузочных прогонов: при каждом чтении канала
+# «появляются» записи за прошедшее время с заданной частотой, а чтение ждёт latency,
+# как вызов журнала по сети
+class SimulatedEventSource(MemoryEventSource):
+    def __init__(self, host, events_per_minute=60, latency=0.05, seed=None):
+        super().__init__()
+        self.host = host
+        self.events_per_minute = events_per_minute
+        self.latency = latency
+        self.random = random.Random(seed if seed is not None else host)
+        self.generated_at = {}
+
+    def _generate(self, channel, now):
+        last = self.generated_at.get(channel, now - timedelta(minutes=1))
+        self.generated_at[channel] = now
+        # Старые записи вытесняются, как в журнале ограниченного размера
+        records = self.records.get(channel, [])
+        cut = bisect.bisect_left(records, now - SIMULATED_RETENTION, key=lambda r: r.time)
+        if cut:
+            del records[:cut]
+        count = int((now - last).total_seconds() * self.events_per_minute / 60)
+        for i in range(count):
+            event_time = last + (now - last) * (i + 1) / (count + 1)
+            if channel == SECURITY_CHANNEL:
+                logon_type = self.random.choice(["3", "3", "3", "3", "2", "10"])
+                user = f"user{self.random.randrange(50)}"
+                self.add(channel, 4624, ["S-1-5-18", f"{self.host}$", "CORP", "0x3e7", "S-1-5-21-1",
+                                         user, "CORP", "0x1234", logon_type, "User32"], event_time)
+            elif channel == SYSTEM_CHANNEL:
+                self.add(channel, 7036, ["Windows Update", "running"], event_time)
+            elif channel == SYSMON_CHANNEL:
+                number = self.next_numbers.get(channel, 1)
+                image = f"C:\\Tools\\tool{self.random.randrange(20)}.exe"
+                xml = SIMULATED_SYSMON_XML.format(
+                    time=event_time.strftime("%Y-%m-%dT%H:%M:%S.%f0Z"), record=number, host=self.host,
+                    guid=f"{self.random.getrandbits(32):08x}-0000-0000-0000-{number:012x}",
+                    image=image, sha256=f"{self.random.randrange(200):064X}",
+                    user=f"CORP\\user{self.random.randrange(50)}"
+                )
+                self.add(channel, 1, None, event_time, xml=xml)
+
+    def read_channel(self, channel, since, after=None, query=None):
+        self._generate(channel, datetime.now(dt.timezone.utc))
+        time.sleep(self.latency)
+        yield from super().read_channel(channel, since, after, query)
+
+
+# Источник записей из записанной фикстуры (JSON Lines, одна запись на строку)
+class JsonEventSource(MemoryEventSource):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = EventRecord.from_dict(json.loads(line))
+                self.records.setdefault(record.channel, []).append(record)
+        for channel, records in self.records.items():
+            records.sort(key=lambda r: r.record_number or 0)
+            self.next_numbers[channel] = (records[-1].record_number or 0) + 1
+        print(f"Загружено {sum(len(r) for r in self.records.values())} записей из {path}")
+
+
+# Функция записи фикстуры из произвольной последовательности записей
+def save_records(path, records):
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+            count += 1
+    print(f"Записано {count} записей в {path}")
+    return count
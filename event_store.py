@@ -0,0 +1,74 @@
+import json
+import os
+from journal import UnitOfWork
+
+
+# Функция переноса старого JSON-массива (events_*.json) в журнал JSON Lines
+def migrate_legacy_log(file_name):
+    legacy_name = os.path.splitext(file_name)[0] + ".json"
+    if legacy_name == file_name or not os.path.exists(legacy_name):
+        return
+    try:
+        with open(legacy_name, "r", encoding="utf-8") as f:
+            events = json.load(f)
+        with open(file_name, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        os.remove(legacy_name)
+        print(f"Перенесено {len(events)} событий из {legacy_name} в {file_name}")
+    except Exception as e:
+        print(f"Ошибка переноса {legacy_name} в {file_name}: {e}")
+
+
+# Потоковое чтение событий из журнала JSON Lines
+def iter_events(file_name):
+    migrate_legacy_log(file_name)
+    if not os.path.exists(file_name):
+        return
+    with open(file_name, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Недописанная строка после сбоя - пропускаем
+                print(f"Пропущена повреждённая строка в {file_name}: {line[:80]}")
+
+
+# Хранилище событий только на добавление: по файлу JSON Lines на категорию. Строки копятся
+# в единице работы и попадают в файлы при ее фиксации (вместе с остальным состоянием пачки)
+class EventStore:
+    def __init__(self, unit=None):
+        self.unit = unit if unit is not None else UnitOfWork(None)
+        self.migrated = set()
+
+    def append(self, file_name, event):
+        if file_name not in self.migrated:
+            migrate_legacy_log(file_name)
+            self.migrated.add(file_name)
+        self.unit.append(file_name, (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    # Фиксация накопленных событий
+    def flush(self):
+        self.unit.commit()
+
+    # Перенос журнала категории в другой файл (снимок); следующая запись начнет новый журнал.
+    # Если снимок уже есть (прошлый отчет не отправлен), журнал дописывается в него.
+    # Ещё не зафиксированные события остаются в единице работы и попадут в новый журнал
+    def rotate(self, file_name, target_name):
+        self.unit.checkpoint()
+        migrate_legacy_log(file_name)
+        if not os.path.exists(file_name):
+            return False
+        if os.path.exists(target_name):
+            with open(file_name, "rb") as src, open(target_name, "ab") as dst:
+                dst.write(src.read())
+            os.remove(file_name)
+        else:
+            os.replace(file_name, target_name)
+        return True
+
+    def close(self):
+        self.unit.close()
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import sys
+from datetime import datetime, timedelta
+import datetime as dt
+
+# Индекс обработанных ProcessGuid: GUID хранятся 16-байтовыми ключами в корзинах по часу.
+# Поиск - один словарь ключ -> корзина; сами корзины - упакованные массивы ключей (bytearray) в памяти
+# и файлы на диске, в которые только дописываются записи. Массив корзины нужен только для удаления
+# устаревших ключей из словаря и для записи: устаревшая корзина удаляется без перезаписи файлов.
+
+GUID_BUCKET_SIZE = timedelta(hours=1)  # Размер корзины
+GUID_WINDOW = timedelta(hours=24)  # Сколько помнить обработанные GUID
+GUID_KEY_SIZE = 16
+GUID_BUCKET_SUFFIX = ".bin"
+
+
+# Функция перевода ProcessGuid в 16 байт; строки не в формате GUID хэшируются
+def guid_key(guid):
+    try:
+        key = bytes.fromhex(guid.strip("{}").replace("-", ""))
+    except ValueError:
+        key = b""
+    if len(key) != GUID_KEY_SIZE:
+        key = hashlib.md5(guid.encode("utf-8")).digest()
+    return key
+
+
+class GuidIndex:
+    def __init__(self, directory, window=GUID_WINDOW, bucket_size=GUID_BUCKET_SIZE):
+        self.directory = directory
+        self.window = window
+        self.bucket_size = bucket_size
+        self.index = {}  # ключ -> номер корзины, в которую ключ добавлен последним
+        self.buckets = {}  # номер корзины -> ключи подряд (bytearray, по GUID_KEY_SIZE байт)
+        self.written = {}  # номер корзины -> байт корзины, уже записанных на диск
+        self.last_bucket = None  # Номер последней корзины: один объект на все ключи корзины в словаре
+
+    def _bucket_id(self, time):
+        return int(time.timestamp() // self.bucket_size.total_seconds())
+
+    def _bucket_path(self, bucket_id):
+        return os.path.join(self.directory, f"{bucket_id}{GUID_BUCKET_SUFFIX}")
+
+    def _oldest_bucket(self, now):
+        return self._bucket_id(now - self.window)
+
+    # Загрузка корзин, попадающих в окно; устаревшие файлы удаляются
+    def load(self, now=None):
+        now = now or datetime.now(dt.timezone.utc)
+        os.makedirs(self.directory, exist_ok=True)
+        oldest = self._oldest_bucket(now)
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(GUID_BUCKET_SUFFIX):
+                continue
+            try:
+                bucket_id = int(name[:-len(GUID_BUCKET_SUFFIX)])
+            except ValueError:
+                continue
+            path = os.path.join(self.directory, name)
+            if bucket_id < oldest:
+                os.remove(path)
+                continue
+            found.append(bucket_id)
+        # От старых корзин к новым: ключ, добавленный повторно, принадлежит последней корзине
+        for bucket_id in sorted(found):
+            path = self._bucket_path(bucket_id)
+            with open(path, "rb") as f:
+                keys = bytearray(f.read())
+            # Недописанный хвост (обрыв записи) отбрасывается и в файле: дозапись идет с границы ключа
+            usable = len(keys) - len(keys) % GUID_KEY_SIZE
+            if usable != len(keys):
+                del keys[usable:]
+                with open(path, "r+b") as f:
+                    f.truncate(usable)
+            self.buckets[bucket_id] = keys
+            self.written[bucket_id] = usable
+            for offset in range(0, usable, GUID_KEY_SIZE):
+                self.index[bytes(keys[offset:offset + GUID_KEY_SIZE])] = bucket_id
+        print(f"Загружено {len(self)} ProcessGuid из {self.directory} ({len(self.buckets)} корзин)")
+
+    # Перенос записей из прежнего текстового лога "GUID|время"
+    def migrate_log(self, log_file, now=None):
+        if not os.path.exists(log_file):
+            return
+        now = now or datetime.now(dt.timezone.utc)
+        cutoff = now - self.window
+        imported = 0
+        with open(log_file, "r") as f:
+            for line in f:
+                if '|' not in line:
+                    continue
+                guid, timestr = line.strip().split('|', 1)
+                try:
+                    ts = datetime.strptime(timestr, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=dt.timezone.utc)
+                except ValueError:
+                    continue
+                if ts > cutoff and not self.contains(guid):
+                    self.add(guid, ts)
+                    imported += 1
+        self.flush()
+        os.replace(log_file, f"{log_file}.migrated")
+        print(f"Перенесено {imported} ProcessGuid из {log_file}")
+
+    def __len__(self):
+        return len(self.index)
+
+    def contains(self, guid):
+        return guid_key(guid) in self.index
+
+    # Занимаемая память (байт): словарь поиска с ключами и массивы корзин
+    def memory_size(self):
+        return (sys.getsizeof(self.index) + sum(map(sys.getsizeof, self.index))
+                + sum(map(sys.getsizeof, self.buckets.values())))
+
+    def add(self, guid, time):
+        bucket_id = self._bucket_id(time)
+        if bucket_id == self.last_bucket:
+            bucket_id = self.last_bucket
+        else:
+            self.last_bucket = bucket_id
+        key = guid_key(guid)
+        self.index[key] = bucket_id
+        keys = self.buckets.get(bucket_id)
+        if keys is None:
+            keys = self.buckets[bucket_id] = bytearray()
+            self.written[bucket_id] = 0
+        keys += key
+
+    # Удаление корзин, вышедших из окна: ключи корзины убираются из словаря, файл удаляется целиком
+    def expire(self, now=None):
+        now = now or datetime.now(dt.timezone.utc)
+        oldest = self._oldest_bucket(now)
+        expired = [bucket_id for bucket_id in self.buckets if bucket_id < oldest]
+        index = self.index
+        for bucket_id in expired:
+            keys = self.buckets.pop(bucket_id)
+            del self.written[bucket_id]
+            for offset in range(0, len(keys), GUID_KEY_SIZE):
+                key = bytes(keys[offset:offset + GUID_KEY_SIZE])
+                # Ключ, добавленный позже в более новую корзину, остается
+                if index.get(key) == bucket_id:
+                    del index[key]
+            try:
+                os.remove(self._bucket_path(bucket_id))
+            except FileNotFoundError:
+                pass
+        return len(expired)
+
+    # Дозапись новых ключей в файлы корзин; с единицей работы (unit) записи фиксируются вместе с ней
+    def flush(self, unit=None):
+        pending = [(bucket_id, keys, self.written[bucket_id]) for bucket_id, keys in self.buckets.items()
+                   if len(keys) > self.written[bucket_id]]
+        if not pending:
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        written = 0
+        for bucket_id, keys, start in pending:
+            data = bytes(keys[start:])
+            if unit is not None:
+                unit.append(self._bucket_path(bucket_id), data)
+            else:
+                with open(self._bucket_path(bucket_id), "ab") as f:
+                    f.write(data)
+            self.written[bucket_id] = len(keys)
+            written += len(data) // GUID_KEY_SIZE
+        return written
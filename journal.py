@@ -0,0 +1,166 @@
+import json
+import os
+import struct
+import zlib
+
+# Единица работы: все записи состояния одной пачки событий (дозапись в накопительные логи и корзины
+# ProcessGuid, замена файлов курсоров и времени последнего события) копятся в памяти и фиксируются
+# вместе. Фиксация - одна запись в журнал с одним fsync; затем изменения применяются к файлам без fsync.
+# Журнал очищается на контрольной точке (fsync затронутых файлов), а после сбоя при запуске
+# все зафиксированные записи журнала применяются повторно: дозапись - с сохраненного смещения,
+# поэтому повтор не дублирует строки; недописанная последняя запись журнала отбрасывается.
+
+JOURNAL_FILE = "state.journal"  # Журнал зафиксированных изменений
+JOURNAL_CHECKPOINT_BYTES = 4 * 1024 * 1024  # Контрольная точка, когда журнал больше этого размера
+JOURNAL_MAGIC = b"UOW1"
+RECORD = struct.Struct("<4sIII")  # сигнатура, длина заголовка, длина данных, CRC32 заголовка и данных
+
+# Виды изменений
+APPEND = "append"  # Дозапись в конец файла
+REPLACE = "replace"  # Замена содержимого файла
+
+
+# Функция дозаписи с известного смещения: хвост после смещения (частично примененная запись) отрезается
+def _apply_append(file_name, offset, data):
+    with open(file_name, "ab") as f:
+        if f.seek(0, os.SEEK_END) > offset:
+            f.truncate(offset)
+        f.write(data)
+
+
+# Функция замены файла через временный файл (без fsync: устойчивость дает журнал)
+def _apply_replace(file_name, data):
+    tmp_name = f"{file_name}.tmp"
+    with open(tmp_name, "wb") as f:
+        f.write(data)
+    os.replace(tmp_name, file_name)
+
+
+def _apply(ops, payload):
+    position = 0
+    for kind, file_name, offset, length in ops:
+        data = payload[position:position + length]
+        position += length
+        if kind == APPEND:
+            _apply_append(file_name, offset, data)
+        else:
+            _apply_replace(file_name, data)
+
+
+# Функция чтения зафиксированных записей журнала: [(изменения, данные)]; чтение останавливается
+# на первой неполной или поврежденной записи (обрыв при фиксации)
+def read_journal(file_name):
+    entries = []
+    if not os.path.exists(file_name):
+        return entries
+    with open(file_name, "rb") as f:
+        data = f.read()
+    position = 0
+    while position + RECORD.size <= len(data):
+        magic, header_size, payload_size, checksum = RECORD.unpack_from(data, position)
+        start = position + RECORD.size
+        end = start + header_size + payload_size
+        if magic != JOURNAL_MAGIC or end > len(data) or zlib.crc32(data[start:end]) != checksum:
+            break
+        ops = json.loads(data[start:start + header_size].decode("utf-8"))
+        entries.append((ops, data[start + header_size:end]))
+        position = end
+    return entries
+
+
+class UnitOfWork:
+    # journal_file=None - без журнала: изменения применяются при фиксации и сбрасываются на диск
+    # только на контрольной точке (для разовых инструментов и замеров)
+    def __init__(self, journal_file=JOURNAL_FILE, checkpoint_bytes=JOURNAL_CHECKPOINT_BYTES):
+        self.journal_file = journal_file
+        self.checkpoint_bytes = checkpoint_bytes
+        self.appends = {}  # файл -> [данные], ещё не зафиксированные
+        self.replaces = {}  # файл -> новое содержимое
+        self.touched = set()  # файлы, измененные после последней контрольной точки
+        self.journal = None
+        self.journal_size = 0
+        self.commits = 0
+
+    def append(self, file_name, data):
+        self.appends.setdefault(file_name, []).append(data)
+
+    def replace(self, file_name, data):
+        self.replaces[file_name] = data
+
+    # Ещё не зафиксированное новое содержимое файла (None - замены нет)
+    def pending(self, file_name):
+        return self.replaces.get(file_name)
+
+    def __len__(self):
+        return sum(map(len, self.appends.values())) + len(self.replaces)
+
+    # Фиксация накопленных изменений: запись в журнал, fsync, применение к файлам.
+    # Возвращает число измененных файлов
+    def commit(self):
+        if not self.appends and not self.replaces:
+            return 0
+        ops = []
+        chunks = []
+        for file_name, parts in self.appends.items():
+            data = b"".join(parts)
+            offset = os.path.getsize(file_name) if os.path.exists(file_name) else 0
+            ops.append((APPEND, file_name, offset, len(data)))
+            chunks.append(data)
+        for file_name, data in self.replaces.items():
+            ops.append((REPLACE, file_name, 0, len(data)))
+            chunks.append(data)
+        payload = b"".join(chunks)
+
+        if self.journal_file is not None:
+            header = json.dumps(ops, ensure_ascii=False).encode("utf-8")
+            if self.journal is None:
+                self.journal = open(self.journal_file, "ab")
+                self.journal_size = self.journal.seek(0, os.SEEK_END)
+            self.journal.write(RECORD.pack(JOURNAL_MAGIC, len(header), len(payload),
+                                           zlib.crc32(header + payload)) + header + payload)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.journal_size += RECORD.size + len(header) + len(payload)
+        # Изменения зафиксированы: при ошибке применения они будут повторены из журнала при запуске
+        self.appends = {}
+        self.replaces = {}
+        _apply(ops, payload)
+        self.touched.update(file_name for _, file_name, _, _ in ops)
+        self.commits += 1
+        if self.journal_size >= self.checkpoint_bytes:
+            self.checkpoint()
+        return len(ops)
+
+    # Контрольная точка: fsync файлов, измененных после прошлой точки, и очистка журнала.
+    # Вызывается и перед переносом или удалением файлов, чтобы повтор журнала их не затронул
+    def checkpoint(self):
+        for file_name in self.touched:
+            if os.path.exists(file_name):
+                with open(file_name, "ab") as f:
+                    os.fsync(f.fileno())
+        self.touched = set()
+        if self.journal is not None:
+            self.journal.truncate(0)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.journal_size = 0
+
+    # Повтор журнала после сбоя (до чтения состояния из файлов); возвращает число примененных записей
+    def recover(self):
+        if self.journal_file is None:
+            return 0
+        entries = read_journal(self.journal_file)
+        for ops, payload in entries:
+            _apply([tuple(op) for op in ops], payload)
+            self.touched.update(file_name for _, file_name, _, _ in ops)
+        if entries or os.path.exists(self.journal_file):
+            self.journal = open(self.journal_file, "ab")
+            self.checkpoint()
+        return len(entries)
+
+    def close(self):
+        self.commit()
+        self.checkpoint()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
@@ -1,37 +1,273 @@
+import argparse
 import asyncio
+import contextlib
 import os
-from bot import send_message, send_document
-from event_logger import check_system_startup, check_security_events, check_service_modification, check_sysmon_process
+from datetime import datetime, timedelta
+import datetime as dt
+from bot import send_message, send_document, start_delivery, stop_delivery
+from event_logger import (TIME_RANGE_MINUTES, UNIT, register_handlers, flush_event_logs, close_event_logs,
+                          recover_state, start_vt_pipeline, stop_vt_pipeline, wait_pdf_reports, save_burst_state,
+                          save_correlation_state, send_held_correlation_alerts, begin_backlog_verdicts,
+                          end_backlog_verdicts)
+from event_source import Win32EventSource, JsonEventSource, SimulatedEventSource
+from cursor_store import CursorStore, CURSOR_FILE
+from collector import HostCollector, COLLECTOR_MAX_PARALLEL, load_inventory, host_state_path
+from metrics import STAGE_SECONDS, METRICS_SNAPSHOT_INTERVAL, start_metrics_server, snapshot_loop, profile_run
+from scanner import EventScanner, MAX_COLLECT_WORKERS
+from daemon import MonitorDaemon
+from subscription import Win32Subscription, ReplaySubscription
+from backfill import BACKFILL_MAX_HOURS, BACKFILL_MAX_RATE, BacklogSummary, CatchUp
 
 # Путь к файлу блокировки
 LOCK_FILE = "lockfile.lock"
 
+# Создание движка просмотра журналов с зарегистрированными обработчиками
+def create_scanner(source, max_workers=MAX_COLLECT_WORKERS, send_message_func=send_message):
+    scanner = EventScanner(source, CursorStore(), max_workers, unit=UNIT)
+    register_handlers(scanner, send_message_func, send_document)
+    return scanner
+
+# Создание движка компьютера для сборщика: свои курсоры и источник, общие пул чтения и блокировка обработчиков
+def create_host_scanner(host, executor, handler_lock, send_message_func, simulate=False):
+    if simulate:
+        source = SimulatedEventSource(host["name"])
+    else:
+        source = Win32EventSource(host["server"])
+    scanner = EventScanner(source, CursorStore(host_state_path(host["name"], CURSOR_FILE)),
+                           executor=executor, handler_lock=handler_lock, unit=UNIT)
+    register_handlers(scanner, send_message_func, send_document, host=host["name"])
+    return scanner
+
+# Режим сборщика: опрос списка компьютеров (однократно или по расписанию)
+async def run_collector(args):
+    if args.simulate:
+        hosts = [{"name": f"sim{number:03d}", "server": None} for number in range(1, args.simulate + 1)]
+    else:
+        hosts = load_inventory(args.hosts)
+
+    def make_scanner(host, executor, handler_lock, send_message_func):
+        return create_host_scanner(host, executor, handler_lock, send_message_func, simulate=bool(args.simulate))
+
+    collector = HostCollector(hosts, make_scanner, send_message, flush_event_logs, TIME_RANGE_MINUTES,
+                              max_parallel=args.parallel)
+    try:
+        if args.daemon:
+            await collector.run()
+        else:
+            await collector.run_once()
+    finally:
+        collector.close()
+
 # Основная функция для однократной проверки
-async def check_events():
+async def check_events(source, max_workers):
     print("Проверка событий 6005 (включение), 4624 (вход), 4672 (привилегии), 4698 (задачи), 4697/7045 (службы), Sysmon (процессы)...")
-    await check_system_startup(send_message, send_document)
-    await check_security_events(send_message)
-    await check_service_modification(send_message)
-    await check_sysmon_process(send_message)
+    scanner = create_scanner(source, max_workers)
+    since = datetime.now(dt.timezone.utc) - timedelta(minutes=TIME_RANGE_MINUTES)
+    try:
+        await scanner.scan(since, send_message)
+    finally:
+        scanner.close()
+    await flush_event_logs(send_message)
+
+# Режим службы: проверки по расписанию в одном процессе
+async def run_daemon(source, max_workers):
+    scanner = create_scanner(source, max_workers)
+    daemon = MonitorDaemon(scanner, send_message, flush_event_logs, TIME_RANGE_MINUTES)
+    try:
+        await daemon.run()
+    finally:
+        scanner.close()
+
+# Потоковый режим: подписка на журналы (EvtSubscribe) или воспроизведение файла
+async def run_stream(args):
+    scanner = create_scanner(None)
+    if args.replay:
+        subscription = ReplaySubscription(args.replay, scanner.cursors, follow=args.follow)
+    else:
+        queries = {channel: scanner.channel_query(channel) for channel in scanner.routes}
+        subscription = Win32Subscription(list(scanner.routes), scanner.cursors, queries)
+    daemon = MonitorDaemon(scanner, send_message, flush_event_logs, TIME_RANGE_MINUTES)
+    await daemon.run_stream(subscription)
+
+# Догоняющее чтение пропуска после перерыва в работе: записи от сохраненных курсоров до окна
+# TIME_RANGE_MINUTES обрабатываются пачками, их оповещения уходят одной сводкой; курсоры фиксируются
+# с каждой пачкой, и обычный режим продолжает с места, где закончилось догоняющее чтение
+async def run_backfill(source, args):
+    summary = BacklogSummary(send_message)
+    scanner = create_scanner(source, args.workers, summary.send_message)
+    summary.track(scanner)
+    since = None
+    if args.backfill is not None:
+        since = datetime.now(dt.timezone.utc) - timedelta(hours=args.backfill)
+    catch_up = CatchUp(scanner, TIME_RANGE_MINUTES, since, max_hours=max(args.backfill or 0, BACKFILL_MAX_HOURS),
+                       max_rate=args.backfill_rate, min_gap_minutes=args.backfill_min_gap)
+    # Вердикты VirusTotal по хэшам пропуска - тоже в сводку, а пришедшие после нее - одним сообщением
+    begin_backlog_verdicts(summary)
+    try:
+        try:
+            processed = await catch_up.run(send_message)
+        finally:
+            scanner.close()
+        await flush_event_logs(send_message)
+    finally:
+        waiting = end_backlog_verdicts()
+    channel_lines = catch_up.lines()
+    if not channel_lines:
+        return
+    lines = [f"⏪ Догоняющее чтение после перерыва: обработано {processed} записей за {catch_up.elapsed:.0f} с"]
+    lines.extend(channel_lines)
+    if summary.total:
+        lines.append(f"Оповещений за пропуск: {summary.total} (подробности - в накопительных логах)")
+        lines.extend(summary.lines())
+    else:
+        lines.append("Оповещений за пропуск нет")
+    if waiting:
+        lines.append(f"Хэшей пропуска на проверке VirusTotal: {waiting} (вердикты придут одним сообщением)")
+    print("\n".join(lines))
+    await send_message("\n".join(lines))
+
+# Запуск выбранного режима с фоновой доставкой сообщений
+async def run(args):
+    recover_state()
+    metrics_server = start_metrics_server(args.metrics_port) if args.metrics_port else None
+    snapshot_task = None
+    if args.metrics_file:
+        snapshot_task = asyncio.create_task(snapshot_loop(args.metrics_file, args.metrics_interval))
+    await start_delivery()
+    await start_vt_pipeline(send_message)
+    try:
+        with STAGE_SECONDS.time(stage="run", name=""):
+            # Сборщик ведет курсоры каждого компьютера отдельно - догоняющее чтение только для своих журналов
+            if not (args.hosts or args.simulate or args.no_backfill):
+                await run_backfill(create_source(args), args)
+            if args.hosts or args.simulate:
+                await run_collector(args)
+            elif args.stream:
+                await run_stream(args)
+            elif args.daemon:
+                await run_daemon(create_source(args), args.workers)
+            else:
+                await check_events(create_source(args), args.workers)
+    finally:
+        await wait_pdf_reports()
+        await stop_vt_pipeline(send_message)
+        await close_event_logs(send_message)
+        save_burst_state()
+        # Однократные запуски идут по расписанию, и сеанс продолжается в следующем; служба может не запуститься снова
+        if args.hosts or args.simulate or args.stream or args.daemon:
+            await send_held_correlation_alerts(send_message)
+        save_correlation_state()
+        await stop_delivery()
+        if snapshot_task is not None:
+            snapshot_task.cancel()
+            await asyncio.gather(snapshot_task, return_exceptions=True)
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+# Выбор источника записей: журналы Windows или записанная фикстура
+def create_source(args):
+    if args.replay:
+        return JsonEventSource(args.replay)
+    return Win32EventSource()
+
+# Проверка, что процесс с указанным PID ещё работает
+def is_process_alive(pid):
+    if os.name == "nt":
+        import ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+            return exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# Захват блокировки; блокировка процесса, который уже не работает, снимается
+def acquire_lock():
+    for _ in range(2):
+        try:
+            fd = os.open(LOCK_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(LOCK_FILE, "r") as f:
+                    pid = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                pid = 0
+            if pid and is_process_alive(pid):
+                print(f"Скрипт уже выполняется (lockfile.lock, PID {pid}). Выход.")
+                return False
+            print(f"Найдена устаревшая блокировка (PID {pid or 'не указан'}), удаляем")
+            try:
+                os.remove(LOCK_FILE)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return True
+    return False
 
 # Точка входа
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Мониторинг событий безопасности Windows")
+    parser.add_argument("--replay", help="Файл фикстуры (JSON Lines) вместо журналов Windows")
+    parser.add_argument("--daemon", action="store_true", help="Режим службы: постоянная работа с опросом по расписанию")
+    parser.add_argument("--stream", action="store_true", help="Потоковый режим: подписка на журналы вместо опроса")
+    parser.add_argument("--follow", action="store_true", help="С --stream и --replay: дочитывать новые строки файла")
+    parser.add_argument("--emulate", metavar="FILE",
+                        help="Запись журналов (JSON Lines), которая читается через эмуляцию win32evtlog")
+    parser.add_argument("--workers", type=int, default=MAX_COLLECT_WORKERS,
+                        help="Сколько журналов читать одновременно (1 - по очереди)")
+    parser.add_argument("--hosts", help="Режим сборщика: файл со списком компьютеров (hosts.json)")
+    parser.add_argument("--simulate", type=int, metavar="N",
+                        help="Режим сборщика с N имитируемыми компьютерами (нагрузочная проверка)")
+    parser.add_argument("--parallel", type=int, default=COLLECTOR_MAX_PARALLEL,
+                        help="Режим сборщика: сколько компьютеров опрашивать одновременно")
+    parser.add_argument("--backfill", type=float, metavar="HOURS",
+                        help="Догоняющее чтение и для журналов без сохраненной позиции: записи за последние HOURS ч")
+    parser.add_argument("--no-backfill", action="store_true",
+                        help="Не догонять пропуск после перерыва (только окно TIME_RANGE_MINUTES)")
+    parser.add_argument("--backfill-rate", type=float, default=BACKFILL_MAX_RATE,
+                        help="Догоняющее чтение: записей в секунду не больше")
+    parser.add_argument("--backfill-min-gap", type=float, metavar="MINUTES",
+                        help="Догонять пропуск, только если он длиннее MINUTES мин"
+                             " (по умолчанию - BACKFILL_MIN_GAP_WINDOWS окон TIME_RANGE_MINUTES)")
+    parser.add_argument("--metrics-port", type=int, help="Порт HTTP для метрик Prometheus (/metrics)")
+    parser.add_argument("--metrics-file", help="Файл снимка метрик JSON (пишется периодически и в конце запуска)")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_SNAPSHOT_INTERVAL,
+                        help="Период записи снимка метрик (с)")
+    parser.add_argument("--profile", metavar="FILE", help="Профилировать запуск (cProfile) и сохранить профиль в FILE")
+    args = parser.parse_args()
+
     if not os.path.exists("config.py"):
         print("Ошибка: файл config.py не найден")
         exit(1)
 
     # Проверка блокировки
-    if os.path.exists(LOCK_FILE):
-        print("Скрипт уже выполняется (lockfile.lock существует). Выход.")
+    if not acquire_lock():
         exit(1)
 
+    if args.emulate:
+        from replay import install_emulator
+        install_emulator(args.emulate)
+
     try:
-        # Создаем файл блокировки
-        with open(LOCK_FILE, "w") as f:
-            f.write(str(os.getpid()))
-        asyncio.run(check_events())
+        with profile_run(args.profile) if args.profile else contextlib.nullcontext():
+            asyncio.run(run(args))
     finally:
         # Удаляем файл блокировки
         if os.path.exists(LOCK_FILE):
             os.remove(LOCK_FILE)
-            print("Файл блокировки удален")
\ No newline at end of file
+            print("Файл блокировки удален")
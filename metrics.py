@@ -0,0 +1,224 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from cursor_store import atomic_write_json
+
+# Метрики конвейера мониторинга: счетчики и гистограммы задержек по этапам.
+# Выгружаются в формате Prometheus (HTTP /metrics) и снимком JSON; сбор идет и в потоках чтения,
+# поэтому значения меняются под общей блокировкой.
+
+METRICS_FILE = "metrics.json"  # Снимок метрик (режим службы - периодически, иначе - в конце запуска)
+METRICS_SNAPSHOT_INTERVAL = 60  # Период записи снимка (с)
+METRICS_PREFIX = "nbz_"
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)  # Границы гистограмм (с)
+PROFILE_TOP = 25  # Строк профиля в выводе
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry, name, help_text, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}  # значения меток -> число
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(labels.get(name, "") for name in self.labels), 0)
+
+    def prometheus(self):
+        return [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in sorted(self.values.items())]
+
+    def snapshot(self):
+        return [{"labels": dict(zip(self.labels, key)), "value": value} for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self.registry.lock:
+            self.values[key] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # значения меток -> [счетчики по корзинам..., сумма, количество]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self.registry.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    # Замер длительности блока: with STAGE_SECONDS.time(stage="read"): ...
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def prometheus(self):
+        lines = []
+        for key, state in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + ('+Inf',))} {state[-1]}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {state[-2]:.6f}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {state[-1]}")
+        return lines
+
+    def snapshot(self):
+        return [
+            {"labels": dict(zip(self.labels, key)), "count": state[-1], "sum": round(state[-2], 6),
+             "buckets": dict(zip(map(str, self.buckets), state))}
+            for key, state in sorted(self.values.items())
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(self, METRICS_PREFIX + name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(self, METRICS_PREFIX + name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, METRICS_PREFIX + name, help_text, labels, buckets))
+
+    # Текстовый формат Prometheus (exposition format 0.0.4)
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "time": time.time(),
+                "metrics": {metric.name: {"type": metric.kind, "values": metric.snapshot()} for metric in self.metrics}
+            }
+
+
+REGISTRY = MetricsRegistry()
+
+# Метрики конвейера
+EVENTS_READ = REGISTRY.counter("events_read_total", "Записей журнала передано в Python", ("channel",))
+EVENTS_MATCHED = REGISTRY.counter("events_matched_total", "Записей, отобранных для обработчиков", ("channel",))
+EVENTS_SERVER_SKIPPED = REGISTRY.counter("events_server_skipped_total",
+                                         "Записей, отброшенных запросом к журналу", ("channel",))
+ALERTS = REGISTRY.counter("alerts_total", "Отправленных оповещений", ("kind",))
+VT_CACHE_LOOKUPS = REGISTRY.counter("vt_cache_lookups_total", "Обращений к кэшу VirusTotal", ("result",))
+VT_REQUESTS = REGISTRY.counter("vt_requests_total", "Запросов к VirusTotal", ("status",))
+TELEGRAM_MESSAGES = REGISTRY.counter("telegram_messages_total", "Сообщений Telegram", ("result",))
+TELEGRAM_QUEUE = REGISTRY.gauge("telegram_queue_size", "Сообщений в очереди доставки")
+ALLOWLIST_HITS = REGISTRY.counter("allowlist_hits_total", "Запусков процессов из списка разрешенных")
+BURST_EVENTS = REGISTRY.counter("burst_events_total", "Запусков процессов по решению агрегации", ("decision",))
+BURST_KEYS = REGISTRY.gauge("burst_keys", "Ключей (процесс, хэш, пользователь) в окне агрегации")
+CORRELATION_EVENTS = REGISTRY.counter("correlation_events_total", "Событий по результату корреляции сеансов",
+                                      ("result",))
+CORRELATION_SESSIONS = REGISTRY.gauge("correlation_sessions", "Сеансов входа в памяти корреляции")
+BACKFILL_RECORDS = REGISTRY.counter("backfill_records_total", "Записей догоняющего чтения", ("result",))
+STAGE_SECONDS = REGISTRY.histogram("stage_seconds", "Длительность этапов (с)", ("stage", "name"))
+
+
+# HTTP-выгрузка для Prometheus: GET /metrics в отдельном потоке (http.server загружается только с --metrics-port)
+def start_metrics_server(port, host="127.0.0.1"):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Метрики Prometheus: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def write_snapshot(file_name=METRICS_FILE):
+    atomic_write_json(file_name, REGISTRY.snapshot())
+
+
+# Периодическая запись снимка метрик (до отмены задачи; при отмене снимок пишется последний раз)
+async def snapshot_loop(file_name=METRICS_FILE, interval=METRICS_SNAPSHOT_INTERVAL):
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(write_snapshot, file_name)
+    finally:
+        write_snapshot(file_name)
+        print(f"Снимок метрик сохранен в {file_name}")
+
+
+# Профилирование запуска (cProfile): профиль сохраняется в файл, самые дорогие функции печатаются.
+# Профилируется основной поток (цикл событий); чтение журналов в пуле потоков видно по метрикам этапов
+@contextmanager
+def profile_run(output_file):
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_file)
+        print(f"Профиль сохранен в {output_file} (просмотр: python -m pstats {output_file})")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_TOP)
@@ -0,0 +1,353 @@
+import argparse
+import bisect
+import html
+import queue
+import random
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import datetime as dt
+import event_source
+import subscription
+from event_source import (EventRecord, ChannelQuery, SECURITY_CHANNEL, SYSTEM_CHANNEL, SYSMON_CHANNEL,
+                          SIMULATED_SYSMON_XML, parse_system_time, save_records)
+
+# Запись и воспроизведение журналов Windows. Формат записи - JSON Lines с EventRecord (как у фикстур
+# --replay). Эмуляция win32evtlog отдает записанные события через те же вызовы, что и настоящий модуль
+# (ReadEventLog для классических каналов, EvtQuery/EvtNext/EvtRender и EvtSubscribe для новых),
+# поэтому Win32EventSource и Win32Subscription проверяются и замеряются без Windows:
+#   python replay.py generate capture.jsonl --minutes 10 --rate 4624=600 --rate 1=300
+#   python main.py --emulate capture.jsonl
+
+READ_BATCH_SIZE = 64  # Записей за один вызов ReadEventLog (буфер 64 КБ)
+EVENT_CHANNELS = {
+    4624: SECURITY_CHANNEL,
+    4672: SECURITY_CHANNEL,
+    4698: SECURITY_CHANNEL,
+    4697: SECURITY_CHANNEL,
+    7045: SYSTEM_CHANNEL,
+    6005: SYSTEM_CHANNEL,
+    1: SYSMON_CHANNEL
+}
+DEFAULT_RATES = {4624: 120, 4672: 30, 4698: 1, 4697: 0.5, 7045: 0.5, 6005: 0.1, 1: 60}  # Событий в минуту
+# Квалификаторы в старших битах EventID классических записей (их отбрасывает Win32EventSource)
+EVENT_ID_QUALIFIERS = {7045: 0x4000 << 16, 6005: 0x8000 << 16}
+
+_AFTER_RE = re.compile(r"EventRecordID > (\d+)")
+_SINCE_RE = re.compile(r"TimeCreated\[@SystemTime >= '([^']+)'\]")
+_EVENT_IDS_RE = re.compile(r"EventID=(\d+)")
+_DATA_CONDITION_RE = re.compile(r"Data\[@Name='([^']+)'\]=(?:'([^']*)'|\"([^\"]*)\")")
+
+
+# Синтетические записи: каждый тип события с заданной частотой (событий в минуту) за minutes минут;
+# поля StringInserts расположены так же, как в журналах Windows (и в rules.json)
+def generate_records(minutes=10, rates=None, start=None, host="BENCH-01", seed=1):
+    rates = DEFAULT_RATES if rates is None else rates
+    rng = random.Random(seed)
+    start = start or datetime.now(dt.timezone.utc) - timedelta(minutes=minutes)
+    users = [f"user{number}" for number in range(50)] + ["SYSTEM"]
+    images = [f"C:\\Tools\\tool{number}.exe" for number in range(40)] + ["C:\\Windows\\System32\\notepad.exe"]
+
+    events = []
+    for event_id, rate in rates.items():
+        if event_id not in EVENT_CHANNELS:
+            raise ValueError(f"генератор не знает EventID {event_id}")
+        count = int(rate * minutes)
+        events.extend((start + timedelta(seconds=rng.random() * minutes * 60), event_id) for _ in range(count))
+    events.sort()
+
+    numbers = {}
+    records = []
+    for event_time, event_id in events:
+        channel = EVENT_CHANNELS[event_id]
+        number = numbers[channel] = numbers.get(channel, 0) + 1
+        user = rng.choice(users)
+        sid = "S-1-5-18" if user == "SYSTEM" else f"S-1-5-21-1000-{users.index(user)}"
+        inserts, xml = None, None
+        if event_id == 4624:
+            inserts = ["S-1-5-18", f"{host}$", "CORP", "0x3e7", sid, user, "CORP", f"0x{rng.getrandbits(24):x}",
+                       rng.choice(["2", "3", "3", "3", "5", "7", "10", "11"]), "User32", "Negotiate", host]
+        elif event_id == 4672:
+            inserts = [sid, user, "CORP", f"0x{rng.getrandbits(24):x}",
+                       "SeSecurityPrivilege\r\n\t\t\tSeBackupPrivilege\r\n\t\t\tSeDebugPrivilege"]
+        elif event_id == 4698:
+            inserts = [sid, user, "CORP", "0x1234", f"\\Task{rng.randrange(100)}",
+                       "<Task><Actions><Exec><Command>cmd.exe</Command></Exec></Actions></Task>"]
+        elif event_id == 4697:
+            inserts = [sid, user, "CORP", "0x1234", f"svc{rng.randrange(100)}", "C:\\svc.exe", "0x10",
+                       rng.choice(["2", "3", "4"]), "LocalSystem"]
+        elif event_id == 7045:
+            inserts = [f"svc{rng.randrange(100)}", "C:\\svc.exe", "demand start", "user mode service",
+                       "LocalSystem", user]
+        elif event_id == 6005:
+            inserts = []
+        else:
+            xml = SIMULATED_SYSMON_XML.format(
+                time=event_time.strftime("%Y-%m-%dT%H:%M:%S.%f0Z"), record=number, host=host,
+                guid=f"{rng.getrandbits(32):08x}-0000-0000-0000-{number:012x}",
+                image=html.escape(images[rng.randrange(len(images))]), sha256=f"{rng.randrange(500):064X}",
+                user="NT AUTHORITY\\SYSTEM" if user == "SYSTEM" else f"CORP\\{user}"
+            )
+        records.append(EventRecord(channel, number, event_id, event_time, inserts, xml=xml))
+    return records
+
+
+# Запись классического журнала в виде, который возвращает ReadEventLog
+class EmulatedEventLogRecord:
+    def __init__(self, record):
+        self.RecordNumber = record.record_number
+        self.EventID = record.event_id | EVENT_ID_QUALIFIERS.get(record.event_id, 0)
+        self.TimeGenerated = record.time.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        self.StringInserts = tuple(record.inserts) if record.inserts else None
+        if record.message is not None:
+            self.Message = record.message
+
+
+# Дескриптор ReadEventLog: позиция чтения в канале
+class _LogHandle:
+    def __init__(self, channel):
+        self.channel = channel
+        self.position = None  # Индекс следующей записи
+
+
+# Дескриптор EvtQuery: записи, отобранные запросом, выдаются пачками EvtNext
+class _QueryHandle:
+    def __init__(self, records):
+        self.records = records
+        self.position = 0
+
+
+# Функция разбора запроса, который строит ChannelQuery: (канал, отбор, after, since).
+# Эмулируется только то подмножество XPath, которое порождает ChannelQuery; другой запрос - ValueError
+def parse_query(path, text):
+    channel, select, suppress = path, text, None
+    if path is None:
+        query = ET.fromstring(text).find("Query")
+        channel = query.find("Select").get("Path")
+        select = query.findtext("Select")
+        suppress = query.findtext("Suppress")
+
+    after = _AFTER_RE.search(select)
+    after = int(after.group(1)) if after else None
+    since = _SINCE_RE.search(select)
+    since = parse_system_time(since.group(1)) if since else None
+    event_ids = [int(value) for value in _EVENT_IDS_RE.findall(select)]
+    include = _data_conditions(select)
+    exclude = _data_conditions(suppress) if suppress else {}
+
+    # Запрос собирается заново и должен совпасть с исходным, иначе в нем есть неэмулируемые условия
+    channel_query = ChannelQuery(event_ids, include, exclude)
+    if channel_query.query_args(channel, since, after) != (path, text):
+        raise ValueError(f"запрос не поддерживается эмулятором: {text}")
+    return channel, channel_query, after, since
+
+
+def _data_conditions(text):
+    fields = {}
+    for name, single, double in _DATA_CONDITION_RE.findall(text):
+        fields.setdefault(name, []).append(single or double)
+    return fields
+
+
+# Функция XML-представления записи без записанного XML (классические каналы через EvtQuery)
+def render_xml(record):
+    data = "".join(f"<Data>{html.escape(str(value))}</Data>" for value in record.inserts or [])
+    return (
+        "<Event xmlns='http://schemas.microsoft.com/win/2004/08/events/event'><System>"
+        f"<EventID>{record.event_id}</EventID>"
+        f"<TimeCreated SystemTime='{record.time.strftime('%Y-%m-%dT%H:%M:%S.%f0Z')}'/>"
+        f"<EventRecordID>{record.record_number}</EventRecordID>"
+        f"<Channel>{html.escape(record.channel)}</Channel></System>"
+        f"<EventData>{data}</EventData></Event>"
+    )
+
+
+# Эмуляция модуля win32evtlog поверх записанных событий; latency - задержка каждого вызова чтения
+# (ReadEventLog, EvtNext), как у журнала на диске или по сети
+class EmulatedWin32EvtLog:
+    EVENTLOG_SEQUENTIAL_READ = 0x1
+    EVENTLOG_SEEK_READ = 0x2
+    EVENTLOG_FORWARDS_READ = 0x4
+    EVENTLOG_BACKWARDS_READ = 0x8
+    EvtQueryChannelPath = 0x1
+    EvtQueryForwardDirection = 0x100
+    EvtRenderEventXml = 1
+    EvtRpcLogin = 1
+    EvtSubscribeToFutureEvents = 1
+    EvtSubscribeStartAtOldestRecord = 2
+    EvtSubscribeActionError = 0
+    EvtSubscribeActionDeliver = 1
+
+    def __init__(self, records=(), latency=0.0):
+        self.latency = latency
+        self.records = {}  # канал -> записи по возрастанию номера
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        for record in records:
+            self.records.setdefault(record.channel, []).append(record)
+        for channel_records in self.records.values():
+            channel_records.sort(key=lambda r: r.record_number)
+        self.calls = {}  # имя вызова -> количество (для замеров)
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    # Добавление записи «на лету»: она становится видна чтению и доставляется подпискам
+    def add(self, record):
+        with self.lock:
+            channel_records = self.records.setdefault(record.channel, [])
+            if record.record_number is None:
+                record.record_number = channel_records[-1].record_number + 1 if channel_records else 1
+            channel_records.append(record)
+            subscriptions = list(self.subscriptions)
+        for channel, channel_query, deliveries in subscriptions:
+            if channel == record.channel and channel_query.matches(record):
+                deliveries.put(record)
+
+    # Классический API (ReadEventLog)
+    def OpenEventLog(self, server, channel):
+        return _LogHandle(channel)
+
+    def CloseEventLog(self, handle):
+        handle.position = None
+
+    def GetOldestEventLogRecord(self, handle):
+        channel_records = self.records.get(handle.channel, [])
+        return channel_records[0].record_number if channel_records else 0
+
+    def GetNumberOfEventLogRecords(self, handle):
+        return len(self.records.get(handle.channel, []))
+
+    def ReadEventLog(self, handle, flags, offset):
+        self._count("ReadEventLog")
+        with self.lock:
+            channel_records = list(self.records.get(handle.channel, []))
+        backwards = flags & self.EVENTLOG_BACKWARDS_READ
+        if flags & self.EVENTLOG_SEEK_READ:
+            index = bisect.bisect_left(channel_records, offset, key=lambda r: r.record_number)
+            if index >= len(channel_records) or channel_records[index].record_number != offset:
+                raise ValueError(f"запись {offset} отсутствует в журнале {handle.channel}")
+            handle.position = index
+        elif handle.position is None:
+            handle.position = len(channel_records) - 1 if backwards else 0
+        if backwards:
+            start = max(handle.position - READ_BATCH_SIZE + 1, 0)
+            batch = channel_records[start:handle.position + 1][::-1] if handle.position >= 0 else []
+            handle.position = start - 1
+        else:
+            batch = channel_records[handle.position:handle.position + READ_BATCH_SIZE]
+            handle.position += len(batch)
+        return [EmulatedEventLogRecord(record) for record in batch]
+
+    # Новый API (EvtQuery, EvtNext, EvtRender)
+    def EvtOpenSession(self, login, login_class, timeout=0, flags=0):
+        return ("session", login[0])
+
+    def EvtQuery(self, path, flags, query=None, Session=None):
+        channel, channel_query, after, since = parse_query(path, query)
+        with self.lock:
+            channel_records = list(self.records.get(channel, []))
+        if after is not None:
+            start = bisect.bisect_right(channel_records, after, key=lambda r: r.record_number)
+            selected = channel_records[start:]
+        elif since is not None:
+            since_timestamp = since.timestamp()
+            selected = [record for record in channel_records if record.timestamp >= since_timestamp]
+        else:
+            selected = channel_records
+        return _QueryHandle([record for record in selected if channel_query.matches(record)])
+
+    def EvtNext(self, handle, count, timeout=-1, flags=0):
+        self._count("EvtNext")
+        batch = handle.records[handle.position:handle.position + count]
+        handle.position += len(batch)
+        return tuple(batch)
+
+    def EvtRender(self, event, flags):
+        return event.xml if event.xml else render_xml(event)
+
+    # Подписка: записи доставляются колбэку из отдельного потока, как у службы журналов
+    def EvtSubscribe(self, path, flags, SignalEvent=None, Callback=None, Context=None, Query=None, Session=None):
+        channel, channel_query, after, since = parse_query(path, Query)
+        deliveries = queue.Queue()
+        with self.lock:
+            if flags == self.EvtSubscribeStartAtOldestRecord:
+                for record in self.records.get(channel, []):
+                    if (after is None or record.record_number > after) and channel_query.matches(record):
+                        deliveries.put(record)
+            entry = (channel, channel_query, deliveries)
+            self.subscriptions.append(entry)
+
+        def deliver():
+            while True:
+                record = deliveries.get()
+                if record is None:
+                    return
+                Callback(self.EvtSubscribeActionDeliver, Context, record)
+
+        thread = threading.Thread(target=deliver, name=f"subscription {channel}", daemon=True)
+        thread.start()
+        return entry
+
+
+# Подмена win32evtlog в модулях источников на эмуляцию (на время блока with)
+@contextmanager
+def emulated_win32evtlog(emulator):
+    previous = (event_source.win32evtlog, subscription.win32evtlog)
+    event_source.win32evtlog = subscription.win32evtlog = emulator
+    try:
+        yield emulator
+    finally:
+        event_source.win32evtlog, subscription.win32evtlog = previous
+
+
+# Функция установки эмуляции до конца процесса (main.py --emulate)
+def install_emulator(path, latency=0.0):
+    records = event_source.JsonEventSource(path).records
+    emulator = EmulatedWin32EvtLog((record for channel_records in records.values() for record in channel_records),
+                                   latency)
+    event_source.win32evtlog = subscription.win32evtlog = emulator
+    print(f"win32evtlog заменен эмуляцией по записи {path}")
+    return emulator
+
+
+# Функция записи журналов Windows за последние minutes минут (запускается на Windows)
+def capture(path, minutes, channels=(SECURITY_CHANNEL, SYSTEM_CHANNEL, SYSMON_CHANNEL)):
+    source = event_source.Win32EventSource()
+    since = datetime.now(dt.timezone.utc) - timedelta(minutes=minutes)
+    records = []
+    for channel in channels:
+        records.extend(source.read_channel(channel, since))
+    return save_records(path, records)
+
+
+def _parse_rate(value):
+    event_id, rate = value.split("=", 1)
+    return int(event_id), float(rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запись и синтетическая генерация журналов Windows")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    generate_parser = subparsers.add_parser("generate", help="Синтетическая запись")
+    generate_parser.add_argument("output")
+    generate_parser.add_argument("--minutes", type=float, default=10)
+    generate_parser.add_argument("--rate", type=_parse_rate, action="append", default=[], metavar="EVENT_ID=N",
+                                 help="Событий в минуту для EventID (остальные - по умолчанию)")
+    generate_parser.add_argument("--host", default="BENCH-01")
+    generate_parser.add_argument("--seed", type=int, default=1)
+    capture_parser = subparsers.add_parser("capture", help="Запись журналов этого компьютера (Windows)")
+    capture_parser.add_argument("output")
+    capture_parser.add_argument("--minutes", type=float, default=60)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        save_records(args.output, generate_records(args.minutes, {**DEFAULT_RATES, **dict(args.rate)},
+                                                   host=args.host, seed=args.seed))
+    else:
+        capture(args.output, args.minutes)
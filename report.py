@@ -0,0 +1,227 @@
+import os
+from collections import Counter
+from event_store import iter_events
+
+# reportlab загружается только при построении отчета (раз в день при смене дня), а не при каждом запуске
+
+# Настройки отчета
+REPORT_FONT = "DejaVuSans"
+REPORT_FONT_FILE = "DejaVuSans.ttf"
+REPORT_TOP_N = 10  # Строк в таблицах «топ»
+REPORT_DETAIL_LIMIT = 200  # Событий каждой категории в приложении, остальные только считаются
+PAGE_WIDTH, PAGE_HEIGHT = 612.0, 792.0  # Формат letter (reportlab.lib.pagesizes.letter), пункты
+MARGIN_LEFT = 50
+MARGIN_TOP = PAGE_HEIGHT - 42
+MARGIN_BOTTOM = 50
+TEXT_WIDTH = PAGE_WIDTH - 2 * MARGIN_LEFT
+HISTOGRAM_HEIGHT = 90
+
+# Заголовки таблиц «топ» для полей сохраненных событий
+TOP_FIELD_TITLES = {
+    "host": "Компьютеры",
+    "user": "Пользователи",
+    "image": "Процессы",
+    "sha256": "Хэши SHA256",
+    "task": "Задачи",
+    "service": "Службы"
+}
+
+_font_registered = False
+
+
+# Регистрация шрифта DejaVuSans для поддержки кириллицы (при первом отчете, один раз за процесс)
+def register_report_font():
+    global _font_registered
+    if _font_registered:
+        return
+    _font_registered = True
+    import reportlab
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    try:
+        font_path = os.path.join(os.path.dirname(reportlab.__file__), "fonts", REPORT_FONT_FILE)
+        if not os.path.exists(font_path):
+            # Альтернативный путь к шрифту (нужно скачать и указать)
+            font_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), REPORT_FONT_FILE)
+        pdfmetrics.registerFont(TTFont(REPORT_FONT, font_path))
+        print("Шрифт DejaVuSans зарегистрирован")
+    except Exception as e:
+        print(f"Ошибка регистрации шрифта DejaVuSans: {e}. Убедитесь, что файл DejaVuSans.ttf доступен.")
+
+
+# Сводка по категории событий за день: собирается за один проход по журналу
+class CategoryStats:
+    __slots__ = ("title", "count", "by_hour", "tops", "details", "omitted")
+
+    def __init__(self, title, top_fields):
+        self.title = title
+        self.count = 0
+        self.by_hour = [0] * 24
+        self.tops = {field: Counter() for field in top_fields}
+        self.details = []
+        self.omitted = 0
+
+    def add(self, event):
+        time_str = event["time"]
+        self.count += 1
+        self.by_hour[int(time_str[11:13])] += 1
+        for field, counter in self.tops.items():
+            value = event.get(field)
+            if value:
+                counter[value] += 1
+        if len(self.details) < REPORT_DETAIL_LIMIT:
+            self.details.append(f"{time_str[:19].replace('T', ' ')}: {event.get('summary', '')}")
+        else:
+            self.omitted += 1
+
+
+# Функция потокового подсчета сводки; время событий хранится в UTC (isoformat),
+# поэтому дата и час берутся из строки без разбора
+def aggregate_category(file_name, date, title, top_fields):
+    stats = CategoryStats(title, top_fields)
+    day = date.isoformat()
+    for event in iter_events(file_name):
+        time_str = event.get("time", "")
+        if time_str.startswith(day):
+            stats.add(event)
+    return stats
+
+
+# Холст отчета с переносом на новую страницу и нумерацией страниц
+class ReportCanvas:
+    def __init__(self, output_file):
+        from reportlab.pdfgen import canvas
+        register_report_font()
+        self.canvas = canvas.Canvas(output_file, pagesize=(PAGE_WIDTH, PAGE_HEIGHT))
+        self.page = 1
+        self.y = MARGIN_TOP
+
+    def new_page(self):
+        self._footer()
+        self.canvas.showPage()
+        self.page += 1
+        self.y = MARGIN_TOP
+
+    def ensure(self, height):
+        if self.y - height < MARGIN_BOTTOM:
+            self.new_page()
+
+    def _footer(self):
+        self.canvas.setFont(REPORT_FONT, 8)
+        self.canvas.drawRightString(PAGE_WIDTH - MARGIN_LEFT, 25, f"Страница {self.page}")
+
+    def text(self, text, size=10, indent=0):
+        self.ensure(size + 6)
+        self.canvas.setFont(REPORT_FONT, size)
+        self.canvas.drawString(MARGIN_LEFT + indent, self.y, fit_text(text, size, TEXT_WIDTH - indent))
+        self.y -= size + 6
+
+    def row(self, cells, size=9):
+        # cells: (текст, отступ, ширина)
+        self.ensure(size + 5)
+        self.canvas.setFont(REPORT_FONT, size)
+        for text, indent, width in cells:
+            self.canvas.drawString(MARGIN_LEFT + indent, self.y, fit_text(text, size, width))
+        self.y -= size + 5
+
+    def gap(self, height=10):
+        self.y -= height
+
+    def save(self):
+        self._footer()
+        self.canvas.save()
+
+
+# Функция обрезки строки по ширине (с многоточием)
+def fit_text(text, size, width):
+    from reportlab.pdfbase import pdfmetrics
+    text = str(text).replace("\r", " ").replace("\n", " ")
+    if pdfmetrics.stringWidth(text, REPORT_FONT, size) <= width:
+        return text
+    # Оценка по средней ширине символа, затем уточнение
+    cut = max(int(len(text) * width / pdfmetrics.stringWidth(text, REPORT_FONT, size)), 1)
+    while cut > 1 and pdfmetrics.stringWidth(text[:cut] + "…", REPORT_FONT, size) > width:
+        cut -= 1
+    return text[:cut] + "…"
+
+
+# Гистограмма событий по часам (UTC)
+def draw_histogram(report, by_hour):
+    report.ensure(HISTOGRAM_HEIGHT + 30)
+    c = report.canvas
+    peak = max(by_hour) or 1
+    bar_width = TEXT_WIDTH / 24
+    base_y = report.y - HISTOGRAM_HEIGHT
+    c.setFont(REPORT_FONT, 7)
+    for hour, count in enumerate(by_hour):
+        x = MARGIN_LEFT + hour * bar_width
+        height = HISTOGRAM_HEIGHT * count / peak
+        if count:
+            c.setFillGray(0.55)
+            c.rect(x + 1, base_y, bar_width - 2, height, stroke=0, fill=1)
+            c.setFillGray(0)
+            c.drawCentredString(x + bar_width / 2, base_y + height + 2, str(count))
+        c.drawCentredString(x + bar_width / 2, base_y - 9, f"{hour:02d}")
+    c.setFillGray(0)
+    report.y = base_y - 22
+
+
+def draw_top_table(report, title, counter):
+    report.text(title, size=10, indent=10)
+    for rank, (value, count) in enumerate(counter.most_common(REPORT_TOP_N), 1):
+        report.row([
+            (f"{rank}.", 20, 20),
+            (value, 40, TEXT_WIDTH - 110),
+            (str(count), TEXT_WIDTH - 60, 60)
+        ])
+    report.gap(6)
+
+
+# Функция построения отчета: сводка по категориям, гистограммы и «топы», затем ограниченное приложение.
+# Синхронная - вызывается в рабочем потоке, чтобы не останавливать цикл событий
+def build_report(output_file, date, categories):
+    all_stats = []
+    for file_name, title, top_fields in categories:
+        try:
+            all_stats.append(aggregate_category(file_name, date, title, top_fields))
+        except Exception as e:
+            print(f"Ошибка чтения {file_name} для отчета: {e}")
+
+    report = ReportCanvas(output_file)
+    report.text(f"Отчет по событиям за {date.strftime('%Y-%m-%d')}", size=16)
+    report.gap()
+    report.text("Сводка", size=12)
+    for stats in all_stats:
+        report.row([(stats.title, 10, TEXT_WIDTH - 90), (str(stats.count), TEXT_WIDTH - 60, 60)], size=10)
+    report.gap()
+
+    for stats in all_stats:
+        if not stats.count:
+            continue
+        report.ensure(HISTOGRAM_HEIGHT + 80)
+        report.text(f"{stats.title}: {stats.count} событий", size=12)
+        report.text("По часам (UTC)", size=9, indent=10)
+        draw_histogram(report, stats.by_hour)
+        for field, counter in stats.tops.items():
+            if counter:
+                draw_top_table(report, TOP_FIELD_TITLES.get(field, field), counter)
+        report.gap()
+
+    if any(stats.details for stats in all_stats):
+        report.new_page()
+        report.text("Приложение: события", size=14)
+        for stats in all_stats:
+            if not stats.details:
+                continue
+            report.gap(4)
+            report.text(stats.title, size=11)
+            for line in stats.details:
+                report.text(line, size=7, indent=10)
+            if stats.omitted:
+                report.text(f"... и ещё {stats.omitted} событий (см. сводку выше)", size=8, indent=10)
+
+    report.save()
+    print(f"PDF-отчет создан: {output_file} ({report.page} стр.,"
+          f" {sum(stats.count for stats in all_stats)} событий)")
+    return all_stats
+
@@ -0,0 +1,242 @@
+import json
+import re
+import sys
+from string import Formatter
+
+# Правила обнаружения из файла rules.json: EventID, поля StringInserts, условия, шаблон сообщения,
+# важность и запись в накопительный лог. При запуске правила компилируются в таблицу EventID -> правила
+# с готовыми проверками, поэтому запись с неинтересным EventID отбрасывается одним поиском в словаре.
+
+RULES_FILE = "rules.json"  # Файл правил
+SEVERITIES = ("info", "warning", "critical")
+RULE_KEYS = {"name", "channel", "event_id", "severity", "min_inserts", "fields", "where", "alert_when",
+             "lookups", "placeholders", "message", "log"}
+TEMPLATE_FIELDS = {"time", "event_id", "data"}  # Поля шаблонов, которые есть у любого правила
+
+# Функция компиляции условия на значение поля (eq, ne, in, not_in, regex) в проверку
+def compile_predicate(operator, expected):
+    if operator == "eq":
+        return lambda value: value == expected
+    if operator == "ne":
+        return lambda value: value != expected
+    if operator == "in":
+        values = frozenset(expected)
+        return lambda value: value in values
+    if operator == "not_in":
+        values = frozenset(expected)
+        return lambda value: value not in values
+    if operator == "regex":
+        pattern = re.compile(expected)
+        return lambda value: value is not None and pattern.search(value) is not None
+    raise ValueError(f"неизвестное условие {operator}")
+
+
+# Функция разбивки многострочного значения (список привилегий 4672) в одну строку
+def _join_lines(value):
+    return ", ".join(line.strip() for line in value.split("\r\n") if line.strip())
+
+
+TRANSFORMS = {
+    "lines": _join_lines
+}
+
+
+def _template_fields(template):
+    return {name for _, name, _, _ in Formatter().parse(template) if name}
+
+
+# Функция перевода значения поля в общую (интернированную) строку: имена пользователей, доменов и служб
+# повторяются от события к событию, и одинаковые значения не хранятся отдельными копиями
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def _compose(outer, inner):
+    if inner is None:
+        return outer
+    return lambda value: outer(inner(value))
+
+
+# Функция общих полей шаблона (names - какие из TEMPLATE_FIELDS нужны)
+def _common(record, names):
+    common = {}
+    if "time" in names:
+        common["time"] = record.time.strftime("%Y-%m-%d %H:%M:%S")
+    if "event_id" in names:
+        common["event_id"] = record.event_id
+    if "data" in names:
+        common["data"] = record.inserts
+    return common
+
+
+# Скомпилированное правило
+class Rule:
+    __slots__ = ("name", "channel", "event_id", "severity", "min_inserts", "fields", "checks", "alert_checks",
+                 "lookups", "placeholders", "message", "log_file", "log_summary", "log_fields",
+                 "message_common", "log_common")
+
+    def __init__(self, spec):
+        unknown = set(spec) - RULE_KEYS
+        if unknown:
+            raise ValueError(f"неизвестные ключи {sorted(unknown)}")
+        self.name = spec["name"]
+        self.channel = spec["channel"]
+        self.event_id = int(spec["event_id"])
+        self.severity = spec.get("severity", "info")
+        if self.severity not in SEVERITIES:
+            raise ValueError(f"важность {self.severity} не из {SEVERITIES}")
+        self.min_inserts = spec.get("min_inserts", 0)
+
+        # Поля: (имя, индекс в StringInserts, значение по умолчанию, преобразование)
+        self.fields = []
+        for name, field in spec.get("fields", {}).items():
+            if isinstance(field, int):
+                field = {"index": field}
+            transform = field.get("transform")
+            if transform is not None and transform not in TRANSFORMS:
+                raise ValueError(f"поле {name}: неизвестное преобразование {transform}")
+            self.fields.append((name, field["index"], field.get("default"), TRANSFORMS.get(transform)))
+        names = {name for name, _, _, _ in self.fields}
+
+        self.checks = self._compile_predicates(spec.get("where", {}), names)
+        self.alert_checks = self._compile_predicates(spec.get("alert_when", {}), names)
+
+        # Подстановки по значению поля: (имя, поле, {значение: текст}, шаблон по умолчанию)
+        self.lookups = []
+        for name, lookup in spec.get("lookups", {}).items():
+            if lookup["field"] not in names:
+                raise ValueError(f"подстановка {name}: нет поля {lookup['field']}")
+            default = lookup.get("default", "")
+            self._check_template(default, names)
+            self.lookups.append((name, lookup["field"], lookup["values"], default))
+        names |= {name for name, _, _, _ in self.lookups}
+
+        self.placeholders = spec.get("placeholders", {})
+        self.message = spec.get("message")
+        if self.message is not None:
+            self._check_template(self.message, names)
+        log = spec.get("log")
+        self.log_file = log["file"] if log else None
+        self.log_summary = log.get("summary", "") if log else ""
+        self.log_fields = log.get("fields", []) if log else []
+        self._check_template(self.log_summary, names)
+        missing = set(self.log_fields) - names
+        if missing:
+            raise ValueError(f"в логе неизвестные поля {sorted(missing)}")
+        # Поля, которые попадают в лог (пользователь, домен, служба), интернируются при разборе
+        self.fields = [
+            (name, index, default, _compose(_intern, transform) if name in self.log_fields else transform)
+            for name, index, default, transform in self.fields
+        ]
+        # Общие поля (время, EventID, данные), которые нужны шаблонам: время форматируется, только если оно в шаблоне
+        self.message_common = _template_fields(self.message or "") & TEMPLATE_FIELDS
+        self.log_common = _template_fields(self.log_summary) & TEMPLATE_FIELDS
+
+    @staticmethod
+    def _compile_predicates(where, names):
+        checks = []
+        for name, conditions in where.items():
+            if name not in names:
+                raise ValueError(f"условие на неизвестное поле {name}")
+            for operator, expected in conditions.items():
+                checks.append((name, compile_predicate(operator, expected)))
+        return tuple(checks)
+
+    @staticmethod
+    def _check_template(template, names):
+        unknown = _template_fields(template) - names - TEMPLATE_FIELDS
+        if unknown:
+            raise ValueError(f"в шаблоне неизвестные поля {sorted(unknown)}")
+
+    # Значения полей записи или None, если запись не подходит под правило
+    def match(self, record):
+        inserts = record.inserts or []
+        count = len(inserts)
+        if count < self.min_inserts:
+            return None
+        values = {}
+        for name, index, default, transform in self.fields:
+            if index < count:
+                value = inserts[index]
+                values[name] = transform(value) if transform and value else value
+            else:
+                values[name] = default
+        for name, check in self.checks:
+            if not check(values[name]):
+                return None
+        for name, field, mapping, default in self.lookups:
+            value = values[field]
+            values[name] = mapping[value] if value in mapping else default.format_map(values)
+        return values
+
+    # Нужно ли оповещение (без alert_when - для всех подходящих записей)
+    def alerts(self, values):
+        if self.message is None:
+            return False
+        for name, check in self.alert_checks:
+            if not check(values[name]):
+                return False
+        return True
+
+    def format_message(self, record, values):
+        shown = {
+            name: (self.placeholders[name] if not value and name in self.placeholders else value)
+            for name, value in values.items()
+        }
+        if self.message_common:
+            shown.update(_common(record, self.message_common))
+        return self.message.format_map(shown)
+
+    def log_entry(self, record, values):
+        entry = {
+            "time": record.time.isoformat(),
+            "summary": self.log_summary.format_map(
+                {**values, **_common(record, self.log_common)} if self.log_common else values
+            ),
+            "event_id": self.event_id
+        }
+        for name in self.log_fields:
+            entry[name] = values[name]
+        return entry
+
+
+# Набор правил: таблица EventID -> правила и маршруты для движка просмотра журналов
+class RuleSet:
+    def __init__(self, rules):
+        self.rules = rules
+        self.table = {}
+        self.routes = {}  # канал -> [EventID]
+        for rule in rules:
+            self.table.setdefault(rule.event_id, []).append(rule)
+            event_ids = self.routes.setdefault(rule.channel, [])
+            if rule.event_id not in event_ids:
+                event_ids.append(rule.event_id)
+
+    def __len__(self):
+        return len(self.rules)
+
+    # Правила, под которые подходит запись: [(правило, значения полей)]
+    def match(self, record):
+        rules = self.table.get(record.event_id)
+        if rules is None:
+            return ()
+        matches = []
+        for rule in rules:
+            if rule.channel == record.channel:
+                values = rule.match(record)
+                if values is not None:
+                    matches.append((rule, values))
+        return matches
+
+
+# Функция загрузки и компиляции правил; ошибка в правиле останавливает запуск с указанием правила
+def load_rules(file_name=RULES_FILE):
+    with open(file_name, "r", encoding="utf-8") as f:
+        specs = json.load(f)
+    rules = []
+    for number, spec in enumerate(specs, 1):
+        try:
+            rules.append(Rule(spec))
+        except (KeyError, TypeError, ValueError, re.error) as e:
+            raise ValueError(f"{file_name}: правило {number} ({spec.get('name', 'без имени')}): {e}") from e
+    return RuleSet(rules)
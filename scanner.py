@@ -0,0 +1,205 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from event_source import ChannelQuery
+from metrics import EVENTS_READ, EVENTS_MATCHED, EVENTS_SERVER_SKIPPED, STAGE_SECONDS
+
+MAX_COLLECT_WORKERS = 3  # Сколько каналов читается одновременно (1 - по очереди)
+
+
+# Движок однократного просмотра журналов: каждый канал читается один раз,
+# записи раздаются зарегистрированным обработчикам по EventID
+class EventScanner:
+    def __init__(self, source, cursors=None, max_workers=MAX_COLLECT_WORKERS, executor=None, handler_lock=None,
+                 unit=None):
+        self.source = source
+        self.cursors = cursors  # CursorStore или None (чтение только по окну времени)
+        self.unit = unit  # UnitOfWork: записи обработчиков и курсоры пачки фиксируются вместе (None - по отдельности)
+        self.max_workers = max_workers
+        # Пул потоков чтения каналов: общий (режим сборщика) или свой, создаваемый при первом проходе
+        self.executor = executor
+        self.own_executor = executor is None
+        # Общая блокировка обработчиков: несколько движков (компьютеров) делят файлы и кэши
+        self.handler_lock = handler_lock
+        self.handlers = []  # [(имя, функция)]
+        self.handler_channels = []  # [множество каналов обработчика]
+        self.routes = {}  # канал -> {EventID: [индексы обработчиков]}
+        self.data_filters = {}  # канал -> [фильтр полей EventData каждого обработчика канала или None]
+        self.queries = {}  # канал -> ChannelQuery (строится после регистрации обработчиков)
+
+    # Регистрация обработчика: routes = {канал: [EventID, ...]};
+    # data_filters = {канал: {"include"/"exclude": {поле: [значения]}}} - отбор по полям EventData
+    def register(self, name, routes, handler, data_filters=None):
+        index = len(self.handlers)
+        self.handlers.append((name, handler))
+        self.handler_channels.append(set(routes))
+        for channel, event_ids in routes.items():
+            table = self.routes.setdefault(channel, {})
+            for event_id in event_ids:
+                table.setdefault(event_id, []).append(index)
+            self.data_filters.setdefault(channel, []).append((data_filters or {}).get(channel))
+        self.queries = {}
+
+    # Запрос к каналу: EventID всех обработчиков канала; фильтр полей - только если он у всех
+    # обработчиков канала одинаковый (иначе одному из них не достались бы его записи)
+    def channel_query(self, channel):
+        query = self.queries.get(channel)
+        if query is None:
+            filters = self.data_filters.get(channel, [])
+            data_filter = filters[0] if filters and all(f == filters[0] for f in filters) else None
+            if data_filter is None and any(filters):
+                print(f"Канал {channel}: у обработчиков разные фильтры полей, на сервере отбор только по EventID")
+            data_filter = data_filter or {}
+            query = self.queries[channel] = ChannelQuery(
+                self.routes.get(channel, {}), data_filter.get("include"), data_filter.get("exclude")
+            )
+        return query
+
+    # Чтение одного канала с раскладкой записей по срезам обработчиков;
+    # возвращает номер последней прочитанной записи и счетчики (прочитано, отобрано, отброшено на сервере)
+    def collect_channel(self, channel, since, slices):
+        table = self.routes.get(channel, {})
+        after = self.cursors.get(channel) if self.cursors else None
+        started = time.perf_counter()
+        read_count = 0
+        matched_count = 0
+        last_number = None
+        for record in self.source.read_channel(channel, since, after, query=self.channel_query(channel)):
+            read_count += 1
+            if record.record_number is not None and (last_number is None or record.record_number > last_number):
+                last_number = record.record_number
+            indexes = table.get(record.event_id)
+            if indexes:
+                matched_count += 1
+                for index in indexes:
+                    slices[index].append(record)
+        # Отброшенные службой журналов записи видны по пропускам в номерах после курсора
+        # (без курсора их число неизвестно)
+        server_skipped = None
+        if after is not None and last_number is not None:
+            server_skipped = max(last_number - after - read_count, 0)
+        # Без новых записей курсор остаётся прежним; после очистки журнала он может уменьшиться
+        if last_number is None:
+            last_number = after
+        elapsed = time.perf_counter() - started
+        EVENTS_READ.inc(read_count, channel=channel)
+        EVENTS_MATCHED.inc(matched_count, channel=channel)
+        EVENTS_SERVER_SKIPPED.inc(server_skipped or 0, channel=channel)
+        STAGE_SECONDS.observe(elapsed, stage="read", name=channel)
+        skipped_text = "н/д" if server_skipped is None else server_skipped
+        print(f"Канал {channel}: прочитано {read_count}, отобрано {matched_count}, отброшено на сервере {skipped_text}"
+              f" за {elapsed:.3f} с (курсор {after} -> {last_number})")
+        return last_number, (read_count, matched_count, server_skipped or 0)
+
+    # Чтение канала в потоке пула: блокирующие вызовы журналов не останавливают цикл событий
+    # (и отправку сообщений); каждому каналу - свои срезы, объединяются они после чтения
+    async def _collect_in_executor(self, channel, since):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="collect")
+        slices = [[] for _ in self.handlers]
+
+        def collect():
+            started = time.perf_counter()
+            position, counts = self.collect_channel(channel, since, slices)
+            return slices, position, counts, time.perf_counter() - started
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, collect)
+
+    # Один проход по каналам (по умолчанию - по всем) и вызов обработчиков с их срезами;
+    # возвращает каналы, курсоры которых не сдвинуты из-за ошибки обработчика (см. run_handlers)
+    async def scan(self, since, send_message_func=None, channels=None):
+        channels = list(self.routes) if channels is None else [c for c in channels if c in self.routes]
+        slices = [[] for _ in self.handlers]
+        positions = {}
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(self._collect_in_executor(channel, since) for channel in channels),
+            return_exceptions=True
+        )
+        elapsed = {}
+        read_total = matched_total = server_total = 0
+        for channel, result in zip(channels, results):
+            if isinstance(result, Exception):
+                print(f"Ошибка чтения журнала {channel}: {result}")
+                if send_message_func:
+                    await send_message_func(f"📋 Ошибка: не удалось прочитать журнал {channel} - {str(result)}")
+                continue
+            channel_slices, positions[channel], (read_count, matched_count, server_skipped), elapsed[channel] = result
+            read_total += read_count
+            matched_total += matched_count
+            server_total += server_skipped
+            for merged, part in zip(slices, channel_slices):
+                merged.extend(part)
+        if len(channels) > 1:
+            print(f"Чтение {len(channels)} каналов: {time.perf_counter() - started:.3f} с"
+                  f" (сумма по каналам {sum(elapsed.values()):.3f} с, потоков {self.max_workers})")
+        print(f"Отбор за проход: отброшено на сервере {server_total}, передано в Python {read_total},"
+              f" отброшено в Python {read_total - matched_total}")
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="collect", name="")
+
+        return await self.run_handlers(slices, channels, positions, send_message_func)
+
+    # Остановка собственного пула потоков чтения
+    def close(self):
+        if self.own_executor and self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    # Раздача уже полученных записей (потоковый режим); channels - каналы, чьи обработчики
+    # вызываются даже при пустом срезе (по умолчанию - каналы самих записей)
+    async def dispatch(self, records, send_message_func=None, channels=None):
+        slices = [[] for _ in self.handlers]
+        positions = {}
+        for record in records:
+            if record.record_number is not None and record.record_number > positions.get(record.channel, 0):
+                positions[record.channel] = record.record_number
+            for index in self.routes.get(record.channel, {}).get(record.event_id, ()):
+                slices[index].append(record)
+        if channels is None:
+            channels = {record.channel for record in records}
+        return await self.run_handlers(slices, channels, positions, send_message_func)
+
+    # Вызов обработчиков затронутых каналов и сохранение курсоров; возвращает множество каналов,
+    # курсоры которых не сдвинуты из-за ошибки обработчика (пустое - пачка обработана целиком)
+    async def run_handlers(self, slices, channels, positions, send_message_func=None):
+        if self.handler_lock is not None:
+            async with self.handler_lock:
+                return await self._run_handlers(slices, channels, positions, send_message_func)
+        return await self._run_handlers(slices, channels, positions, send_message_func)
+
+    async def _run_handlers(self, slices, channels, positions, send_message_func):
+        scanned = set(channels)
+        failed = set()
+        for (name, handler), handler_channels, records in zip(self.handlers, self.handler_channels, slices):
+            if not handler_channels & scanned:
+                continue
+            try:
+                with STAGE_SECONDS.time(stage="handler", name=name):
+                    await handler(records)
+            except Exception as e:
+                failed |= handler_channels & scanned
+                print(f"Ошибка обработчика {name}: {e}")
+                if send_message_func:
+                    await send_message_func(f"📋 Ошибка: обработчик {name} завершился с ошибкой - {str(e)}")
+
+        # Курсоры сдвигаются только после обработки: при сбое записи будут прочитаны повторно.
+        # Курсор канала, обработчик которого завершился с ошибкой, остается прежним - записи пачки
+        # прочитаются следующим проходом (остальные обработчики канала получат их ещё раз).
+        # С единицей работы курсоры, события, GUID и время последних событий пачки фиксируются одной записью журнала
+        if self.cursors:
+            for channel, record_number in positions.items():
+                if channel in failed:
+                    print(f"Канал {channel}: курсор не сдвинут из-за ошибки обработчика")
+                    continue
+                self.cursors.set(channel, record_number)
+        try:
+            if self.cursors:
+                self.cursors.commit(self.unit)
+            if self.unit is not None:
+                with STAGE_SECONDS.time(stage="commit", name=""):
+                    self.unit.commit()
+        except Exception as e:
+            print(f"Ошибка сохранения курсоров и записей пачки: {e}")
+            if send_message_func:
+                await send_message_func(f"📋 Ошибка: не удалось сохранить курсоры и записи пачки - {str(e)}")
+        return failed
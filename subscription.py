@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+from event_source import EventRecord, ChannelQuery, record_from_xml
+
+try:
+    import win32evtlog
+except ImportError:
+    win32evtlog = None
+
+STREAM_QUEUE_SIZE = 10000  # Ёмкость очереди записей; при заполнении поставщик ждёт
+STREAM_BATCH_SIZE = 200  # Максимальный размер микропакета для обработчиков
+STREAM_BATCH_DELAY = 0.2  # Сколько ждать (с) добора микропакета после первой записи
+REPLAY_POLL_INTERVAL = 0.1  # Интервал опроса файла при воспроизведении (с)
+
+
+# Подписка на журналы Windows (EvtSubscribe): записи приходят сами, без опроса.
+# Колбэк вызывается в потоке Windows и передаёт записи в очередь asyncio
+class Win32Subscription:
+    def __init__(self, channels, cursors=None, queries=None):
+        if win32evtlog is None:
+            raise RuntimeError("win32evtlog недоступен: подписка на журналы работает только на Windows")
+        self.channels = channels
+        self.cursors = cursors
+        self.queries = queries or {}  # канал -> ChannelQuery: отбор записей службой журналов
+        self.handles = []
+
+    async def start(self, queue):
+        loop = asyncio.get_running_loop()
+
+        def make_callback(channel):
+            def callback(action, context, event):
+                if action != win32evtlog.EvtSubscribeActionDeliver:
+                    print(f"Ошибка подписки на {channel}: код {event}")
+                    return 0
+                xml_str = win32evtlog.EvtRender(event, win32evtlog.EvtRenderEventXml)
+                record = record_from_xml(channel, xml_str)
+                # Блокирующая передача: при переполнении очереди Windows придерживает доставку
+                asyncio.run_coroutine_threadsafe(queue.put(record), loop).result()
+                return 0
+            return callback
+
+        for channel in self.channels:
+            after = self.cursors.get(channel) if self.cursors else None
+            if after is None:
+                flags = win32evtlog.EvtSubscribeToFutureEvents
+            else:
+                # Сначала дочитываем всё после курсора, затем получаем новые записи
+                flags = win32evtlog.EvtSubscribeStartAtOldestRecord
+            query = self.queries.get(channel) or ChannelQuery()
+            path, text = query.query_args(channel, after=after)
+            handle = win32evtlog.EvtSubscribe(
+                path, flags,
+                Callback=make_callback(channel),
+                Query=text
+            )
+            self.handles.append(handle)
+            print(f"Подписка на {channel} создана (курсор {after}, запрос {query})")
+
+    def stop(self):
+        # Закрытие дескрипторов подписки прекращает вызовы колбэков
+        self.handles = []
+        print("Подписки на журналы закрыты")
+
+
+# Воспроизведение записей из файла JSON Lines с дочитыванием новых строк (как tail -f);
+# формат тот же, что у фикстур JsonEventSource
+class ReplaySubscription:
+    def __init__(self, path, cursors=None, follow=True):
+        self.path = path
+        self.cursors = cursors
+        self.follow = follow
+        self.task = None
+        self.finished = asyncio.Event()
+
+    async def start(self, queue):
+        self.task = asyncio.create_task(self._tail(queue))
+
+    async def _tail(self, queue):
+        position = 0
+        buffer = ""
+        try:
+            while True:
+                if os.path.exists(self.path):
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        f.seek(position)
+                        chunk = f.read()
+                        position = f.tell()
+                    buffer += chunk
+                    *lines, buffer = buffer.split("\n")
+                    for line in lines:
+                        if not line.strip():
+                            continue
+                        record = EventRecord.from_dict(json.loads(line))
+                        after = self.cursors.get(record.channel) if self.cursors else None
+                        if after is not None and record.record_number is not None and record.record_number <= after:
+                            continue
+                        await queue.put(record)
+                if not self.follow:
+                    break
+                await asyncio.sleep(REPLAY_POLL_INTERVAL)
+        finally:
+            self.finished.set()
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+
+# Сбор микропакета: первая запись ожидается без ограничения, остальные - не дольше STREAM_BATCH_DELAY
+async def next_batch(queue, stop_event, timeout=None):
+    getter = asyncio.ensure_future(queue.get())
+    stopper = asyncio.ensure_future(stop_event.wait())
+    done, _ = await asyncio.wait({getter, stopper}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    stopper.cancel()
+    if getter not in done:
+        getter.cancel()
+        return []
+    batch = [getter.result()]
+    deadline = asyncio.get_running_loop().time() + STREAM_BATCH_DELAY
+    while len(batch) < STREAM_BATCH_SIZE:
+        if not queue.empty():
+            batch.append(queue.get_nowait())
+            continue
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
@@ -0,0 +1,101 @@
+import xml.etree.ElementTree as ET
+
+# Проверка согласованности фильтров Sysmon с конфигурацией sysmonconfig.xml: события, которые
+# ждут обработчики, должны записываться Sysmon, а то, что Sysmon пишет зря, стоит отключить в конфигурации.
+
+SYSMON_CONFIG_FILE = "sysmonconfig.xml"
+
+# Типы событий конфигурации Sysmon и их EventID
+SYSMON_EVENT_TYPES = {
+    "ProcessCreate": [1],
+    "FileCreateTime": [2],
+    "NetworkConnect": [3],
+    "ProcessTerminate": [5],
+    "DriverLoad": [6],
+    "ImageLoad": [7],
+    "CreateRemoteThread": [8],
+    "RawAccessRead": [9],
+    "ProcessAccess": [10],
+    "FileCreate": [11],
+    "RegistryEvent": [12, 13, 14],
+    "FileCreateStreamHash": [15],
+    "PipeEvent": [17, 18],
+    "WmiEvent": [19, 20, 21],
+    "DnsQuery": [22],
+    "FileDelete": [23],
+    "ClipboardChange": [24],
+    "ProcessTampering": [25],
+    "FileDeleteDetected": [26]
+}
+
+
+# Разобранная конфигурация: алгоритмы хэшей и правила по типам событий
+class SysmonConfig:
+    def __init__(self, file_name=SYSMON_CONFIG_FILE):
+        root = ET.parse(file_name).getroot()
+        hash_algorithms = root.findtext("HashAlgorithms") or ""
+        self.hash_algorithms = {name.strip().lower() for name in hash_algorithms.split(",") if name.strip()}
+        # тип события -> [(onmatch, [(поле, условие, значение)])]
+        self.filters = {}
+        filtering = root.find("EventFiltering")
+        if filtering is None:
+            return
+        for element in filtering.iter():
+            if element.tag not in SYSMON_EVENT_TYPES:
+                continue
+            conditions = [(child.tag, child.get("condition", "is"), (child.text or "").strip()) for child in element]
+            self.filters.setdefault(element.tag, []).append((element.get("onmatch", "include"), conditions))
+
+    # Записывает ли Sysmon события типа: пустой include отключает тип, пустой exclude - пишет все события
+    def enabled(self, event_type):
+        return any(onmatch == "exclude" or conditions for onmatch, conditions in self.filters.get(event_type, []))
+
+    # Точные значения поля, которыми ограничен include (None - ограничения нет или оно не точное)
+    def included_values(self, event_type, field):
+        values = set()
+        for onmatch, conditions in self.filters.get(event_type, []):
+            if onmatch == "exclude":
+                return None
+            for name, condition, value in conditions:
+                if name != field or condition != "is":
+                    return None
+                values.add(value.lower())
+        return values or None
+
+
+# Функция проверки запроса к каналу Sysmon (ChannelQuery) по конфигурации; возвращает список замечаний
+def check_sysmon_config(config, query, need_hashes=("sha256",)):
+    issues = []
+    wanted_types = {
+        event_type for event_type, event_ids in SYSMON_EVENT_TYPES.items()
+        if set(event_ids) & set(query.event_ids)
+    }
+    for event_type in sorted(wanted_types):
+        if event_type not in config.filters:
+            issues.append(f"{event_type} (EventID {SYSMON_EVENT_TYPES[event_type]}) нужен обработчикам,"
+                          f" но в конфигурации для него нет правил")
+        elif not config.enabled(event_type):
+            issues.append(f"{event_type} (EventID {SYSMON_EVENT_TYPES[event_type]}) нужен обработчикам,"
+                          f" но отключен в конфигурации")
+    for event_type in sorted(set(config.filters) - wanted_types):
+        if config.enabled(event_type):
+            issues.append(f"{event_type} (EventID {SYSMON_EVENT_TYPES[event_type]}) записывается Sysmon,"
+                          f" но не нужен обработчикам и отбрасывается запросом")
+    if "ProcessCreate" in wanted_types:
+        missing = [name for name in need_hashes
+                   if name not in config.hash_algorithms and "*" not in config.hash_algorithms]
+        if missing:
+            issues.append(f"HashAlgorithms не содержит {', '.join(missing)}: проверка VirusTotal невозможна")
+
+        # Sysmon сравнивает без учета регистра, поэтому и списки сравниваются в нижнем регистре
+        configured = config.included_values("ProcessCreate", "Image")
+        if configured is not None:
+            include = {value.lower() for value in query.include.get("Image", [])}
+            exclude = {value.lower() for value in query.exclude.get("Image", [])}
+            for image in sorted(include - configured):
+                issues.append(f"Image {image} есть в фильтре, но Sysmon его не записывает")
+            if include:
+                configured &= include
+            if configured and configured <= exclude:
+                issues.append("все процессы, которые записывает Sysmon, исключены фильтром Image")
+    return issues
@@ -0,0 +1,92 @@
+import html
+import re
+import sys
+from event_source import parse_system_time
+
+# Быстрый разбор XML событий Sysmon: извлекаются только нужные поля, без построения дерева.
+# Текст от EvtRender имеет фиксированную структуру, поэтому достаточно регулярных выражений.
+# Компьютер, пользователь и Image интернируются: они повторяются от события к событию и служат
+# ключами агрегации повторов, поэтому одинаковые значения хранятся одной строкой.
+# Пользователь процесса - поле User из EventData: UserID в System у событий Sysmon - всегда
+# учетная запись службы Sysmon (S-1-5-18).
+
+PROCESS_CREATE_EVENT_ID = "1"  # Sysmon: создание процесса
+PROCESS_CREATE_FIELDS = {
+    "ProcessGuid": "process_guid",
+    "Image": "image",
+    "CommandLine": "command_line",
+    "Hashes": "hashes",
+    "LogonId": "logon_id",
+    "User": "user"
+}
+INTERNED_FIELDS = {"Image", "User"}  # Поля EventData, которые интернируются
+
+_EVENT_ID_RE = re.compile(r"<EventID[^>]*>(\d+)</EventID>")
+_SYSTEM_TIME_RE = re.compile(r"<TimeCreated SystemTime=['\"]([^'\"]+)['\"]")
+_COMPUTER_RE = re.compile(r"<Computer>([^<]*)</Computer>")
+_USER_ID_RE = re.compile(r"<Security\s+UserID=['\"]([^'\"]*)['\"]")
+# Только нужные поля; текст в XML экранирован, поэтому значение не содержит "<"
+_NAMED_DATA_RE = re.compile(
+    r"<Data Name=['\"](" + "|".join(PROCESS_CREATE_FIELDS) + r")['\"]>([^<]*)</Data>"
+)
+
+
+# Поля события создания процесса
+class ProcessCreateEvent:
+    __slots__ = ("time", "timestamp", "computer", "user_sid", "process_guid", "image", "command_line", "hashes",
+                 "logon_id", "user")
+
+    def __init__(self, time, computer, user_sid):
+        self.time = time  # datetime в UTC (для вывода)
+        self.timestamp = time.timestamp()  # секунды UTC
+        self.computer = computer
+        self.user_sid = user_sid
+        self.process_guid = None
+        self.image = None
+        self.command_line = None
+        self.hashes = None
+        self.logon_id = None  # Сеанс входа, из которого запущен процесс (для корреляции)
+        self.user = None  # Учетная запись процесса (DOMAIN\\user)
+
+
+def _unescape(value):
+    return html.unescape(value) if "&" in value else value
+
+
+# Функция разбора события Sysmon ID 1; для других событий и битого XML возвращает None.
+# EventID проверяется первым, до разбора остальных полей
+def decode_process_create(xml_str):
+    event_id = _EVENT_ID_RE.search(xml_str)
+    if event_id is None or event_id.group(1) != PROCESS_CREATE_EVENT_ID:
+        return None
+    system_end = xml_str.find("</System>", event_id.end())
+    if system_end < 0:
+        return None
+    system_time = _SYSTEM_TIME_RE.search(xml_str, 0, system_end)
+    if system_time is None:
+        return None
+    try:
+        time = parse_system_time(system_time.group(1))
+    except ValueError:
+        return None
+    computer = _COMPUTER_RE.search(xml_str, 0, system_end)
+    user_sid = _USER_ID_RE.search(xml_str, 0, system_end)
+    event = ProcessCreateEvent(
+        time,
+        sys.intern(_unescape(computer.group(1))) if computer else "неизвестно",
+        sys.intern(user_sid.group(1)) if user_sid else "неизвестно"
+    )
+    for name, value in _NAMED_DATA_RE.findall(xml_str, system_end):
+        value = _unescape(value)
+        setattr(event, PROCESS_CREATE_FIELDS[name], sys.intern(value) if name in INTERNED_FIELDS else value)
+    return event
+
+
+# Функция извлечения SHA256 из поля Hashes ("SHA1=...,MD5=...,SHA256=...,IMPHASH=...")
+def sha256_from_hashes(hashes):
+    if not hashes:
+        return None
+    for h in hashes.split(","):
+        if h.startswith("SHA256="):
+            return h.split("=")[1]
+    return None
@@ -0,0 +1,45 @@
+import hashlib
+import pytest
+from allowlist import Allowlist, build_index, load_allowlist, read_hash_csv
+
+
+def _digests(count):
+    return [hashlib.sha256(str(number).encode()).digest() for number in range(count)]
+
+
+def test_index_lookup(tmp_path):
+    file_name = str(tmp_path / "allowlist.idx")
+    digests = _digests(1000)
+    assert build_index(file_name, digests[:500]) == 500
+    allowlist = Allowlist(file_name)
+    assert len(allowlist) == 500
+    assert all(digest in allowlist for digest in digests[:500])
+    assert not any(digest in allowlist for digest in digests[500:])
+    # Шестнадцатеричная строка в любом регистре; не SHA256 - не в списке
+    assert digests[0].hex().upper() in allowlist
+    assert "не хэш" not in allowlist
+    assert sorted(allowlist.hashes()) == sorted(digests[:500])
+    allowlist.close()
+
+
+def test_csv_with_header_and_plain_lines(tmp_path):
+    digests = _digests(3)
+    csv_file = tmp_path / "hashes.csv"
+    csv_file.write_text(f'"Algorithm","Hash","Path"\n"SHA256","{digests[0].hex()}","C:\\a.exe"\n'
+                        f'"SHA256","{digests[1].hex()}","C:\\b.exe"\n"SHA256","short","C:\\c.exe"\n',
+                        encoding="utf-8")
+    assert read_hash_csv(str(csv_file)) == ({digests[0], digests[1]}, 1)
+
+    plain = tmp_path / "plain.txt"
+    plain.write_text(f"# эталонный образ\n{digests[2].hex()}\n", encoding="utf-8")
+    assert read_hash_csv(str(plain)) == ({digests[2]}, 0)
+
+
+def test_damaged_or_missing_index(tmp_path):
+    file_name = str(tmp_path / "allowlist.idx")
+    assert load_allowlist(file_name) is None
+    build_index(file_name, _digests(10))
+    with open(file_name, "ab") as f:
+        f.write(b"\0")
+    with pytest.raises(ValueError, match="поврежден"):
+        Allowlist(file_name)
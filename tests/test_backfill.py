@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timedelta
+import datetime as dt
+from backfill import BacklogSummary, CatchUp
+from cursor_store import CursorStore
+from event_source import MemoryEventSource
+from scanner import EventScanner
+
+NOW = datetime.now(dt.timezone.utc)
+
+
+def _setup(tmp_path, minutes_ago, cursor=0):
+    source = MemoryEventSource()
+    for minutes in minutes_ago:
+        source.add("Security", 4624, time=NOW - timedelta(minutes=minutes))
+    cursors = CursorStore(str(tmp_path / "cursors.json"))
+    if cursor is not None:
+        cursors.set("Security", cursor)
+    scanner = EventScanner(source, cursors, max_workers=1)
+    seen = []
+
+    async def handler(records):
+        seen.extend(record.record_number for record in records)
+
+    scanner.register("security", {"Security": [4624]}, handler)
+    return scanner, seen
+
+
+def _catch_up(scanner, **kwargs):
+    kwargs.setdefault("max_rate", 10 ** 9)
+    catch_up = CatchUp(scanner, 10, **kwargs)
+    processed = asyncio.run(catch_up.run())
+    return catch_up, processed
+
+
+def test_horizon_and_window_bound_the_backlog(tmp_path):
+    # 1-2 - старше предела в 24 ч, 3-5 - пропуск, 6-7 - окно обычного режима
+    scanner, seen = _setup(tmp_path, [30 * 60, 25 * 60, 12 * 60, 6 * 60, 60, 5, 1])
+    catch_up, processed = _catch_up(scanner)
+    assert processed == 3
+    assert seen == [3, 4, 5]
+    backlog = catch_up.channels[0]
+    assert (backlog.read, backlog.processed, backlog.skipped) == (5, 3, 2)
+    # Курсор - на последней записи пропуска: окно прочитает обычный режим
+    assert scanner.cursors.get("Security") == 5
+    assert "старше 24 ч пропущено 2" in catch_up.lines()[0]
+
+
+def test_interrupted_catch_up_resumes_from_cursor(tmp_path):
+    scanner, seen = _setup(tmp_path, [600 - minute for minute in range(8)])
+    calls = []
+    name, handler = scanner.handlers[0]
+
+    async def failing_once(records):
+        calls.append(len(records))
+        if len(calls) == 2:
+            raise RuntimeError("сбой")
+        await handler(records)
+
+    scanner.handlers[0] = (name, failing_once)
+    _catch_up(scanner, chunk_records=3)
+    assert seen == [1, 2, 3]
+    assert scanner.cursors.get("Security") == 3
+
+    scanner.handlers[0] = (name, handler)
+    _catch_up(scanner, chunk_records=3)
+    assert seen == [1, 2, 3, 4, 5, 6, 7, 8]
+    assert scanner.cursors.get("Security") == 8
+
+
+def test_short_gap_is_left_to_normal_mode(tmp_path):
+    scanner, seen = _setup(tmp_path, [40, 30, 20])
+    catch_up, processed = _catch_up(scanner)
+    assert processed == 0 and seen == [] and catch_up.channels == []
+    assert scanner.cursors.get("Security") == 0
+
+    _catch_up(scanner, min_gap_minutes=15)
+    assert seen == [1, 2, 3]
+
+
+def test_channel_without_cursor_needs_since(tmp_path):
+    scanner, seen = _setup(tmp_path, [120, 90, 60], cursor=None)
+    catch_up, processed = _catch_up(scanner)
+    assert processed == 0 and catch_up.channels == []
+
+    catch_up, processed = _catch_up(scanner, since=NOW - timedelta(minutes=100))
+    # Чтение идет от самой старой записи журнала, записи до since пропускаются
+    assert seen == [2, 3]
+    assert catch_up.channels[0].skipped == 1
+    assert scanner.cursors.get("Security") == 3
+
+
+def test_backlog_summary_groups_by_handler():
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    summary = BacklogSummary(send, samples=2)
+    scanner = EventScanner(MemoryEventSource())
+
+    async def handler(records):
+        for record in records:
+            await summary.send_message(f"вход {record}\nстрока 2")
+
+    scanner.register("Вход", {"Security": [4624]}, handler)
+    summary.track(scanner)
+
+    async def run():
+        await scanner.handlers[0][1](range(3))
+        await summary.send_message("вердикт", kind="VirusTotal")
+        await summary.send_message("📋 Ошибка: журнал недоступен")
+
+    asyncio.run(run())
+    assert sent == ["📋 Ошибка: журнал недоступен"]
+    assert summary.total == 4
+    assert summary.lines() == [
+        "Вход: ×3, первые 2:", "• вход 0\n  строка 2", "• вход 1\n  строка 2",
+        "VirusTotal: ×1:", "• вердикт"
+    ]
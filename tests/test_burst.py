@@ -0,0 +1,48 @@
+from burst import ALERT, BURST_ROLLUP_SECONDS, BURST_SPIKE_MIN, BURST_SUPPRESS_SECONDS, SUPPRESS, BurstDetector
+
+KEY = ("PC1", "c:\\tools\\job.exe", "ab" * 32, "CORP\\alice")
+
+
+def test_repeats_are_suppressed_and_rolled_up():
+    detector = BurstDetector()
+    assert detector.observe(KEY, 1000.0) == (ALERT, False)
+    assert detector.observe(KEY, 1010.0) == (SUPPRESS, False)
+    assert detector.observe(KEY, 1020.0) == (SUPPRESS, False)
+    # Другой пользователь - другой ключ
+    assert detector.observe(KEY[:3] + ("CORP\\bob",), 1020.0) == (ALERT, False)
+
+    assert detector.rollup(1030.0) is None
+    top, other = detector.rollup(1030.0 + BURST_ROLLUP_SECONDS)
+    assert top == [(KEY, 2, 3, False)] and other == 0
+    assert detector.rollup(1030.0 + 2 * BURST_ROLLUP_SECONDS) is None
+    # После периода подавления - снова обычное оповещение
+    assert detector.observe(KEY, 1000.0 + BURST_SUPPRESS_SECONDS)[0] == ALERT
+
+
+def test_spike_is_reported_once():
+    detector = BurstDetector()
+    starts = [detector.observe(KEY, 5000.0 + index * 0.5)[1] for index in range(BURST_SPIKE_MIN + 20)]
+    assert starts.index(True) == BURST_SPIKE_MIN - 1
+    assert starts.count(True) == 1
+
+
+def test_state_survives_restart(tmp_path):
+    file_name = str(tmp_path / "burst_state.json")
+    detector = BurstDetector()
+    detector.observe(KEY, 1000.0)
+    detector.observe(KEY, 1001.0)
+    detector.save(file_name)
+
+    restored = BurstDetector()
+    restored.load(file_name)
+    assert restored.window_count(KEY) == 2
+    assert restored.observe(KEY, 1002.0) == (SUPPRESS, False)
+
+
+def test_key_count_is_bounded():
+    detector = BurstDetector(max_keys=2)
+    for index in range(3):
+        detector.observe(("PC1", f"app{index}.exe", "", ""), 1000.0)
+        detector.observe(("PC1", f"app{index}.exe", "", ""), 1001.0)
+    assert len(detector.keys) == 2
+    assert detector.evicted_suppressed == 1
@@ -0,0 +1,64 @@
+from correlation import CORRELATION_IDLE_SECONDS, CORRELATION_MAX_HOLD_SECONDS, Correlator, SessionEvent
+
+
+def _logon(correlator, timestamp, logon_id="0x1f2e"):
+    event = SessionEvent(timestamp, 4624, "Вход", "тип 10", "🔑 Вход alice")
+    return correlator.observe("PC1", logon_id, event, "alice", "CORP", "10")
+
+
+def test_logon_followed_by_task_is_one_chain_message():
+    correlator = Correlator()
+    assert _logon(correlator, 1000.0)
+    assert correlator.observe("PC1", "0x1F2E", SessionEvent(1001.0, 4672, "Привилегии", "SeDebug", "🔒 Привилегии"))
+    assert correlator.observe("PC1", "0x1f2e", SessionEvent(1002.0, 4698, "Задача", "\\Updater", "📋 Задача"))
+    assert correlator.flush(1030.0) == []
+
+    [message] = correlator.flush(1002.0 + CORRELATION_IDLE_SECONDS)
+    assert message.startswith("🚨 Цепочка в сеансе: CORP\\alice на PC1, LogonId 0x1f2e, вход: RDP, с привилегиями")
+    assert "Событий: 3" in message and "Задача: \\Updater" in message
+    assert correlator.flush(2000.0) == []
+
+
+def test_service_without_logon_id_joins_privileged_session():
+    correlator = Correlator()
+    _logon(correlator, 1000.0)
+    correlator.observe("PC1", "0x1f2e", SessionEvent(1001.0, 4672, "Привилегии", "SeDebug"))
+    assert correlator.observe_host("PC1", SessionEvent(1005.0, 7045, "Служба", "evil", "🛠 Служба"))
+    assert not correlator.observe_host("PC2", SessionEvent(1005.0, 7045, "Служба", "evil", "🛠 Служба"))
+    [message] = correlator.flush_all()
+    assert message.startswith("🚨 Цепочка в сеансе")
+
+
+def test_single_event_keeps_its_own_message():
+    correlator = Correlator()
+    _logon(correlator, 1000.0)
+    assert correlator.flush(1000.0 + CORRELATION_IDLE_SECONDS) == ["🔑 Вход alice"]
+    # Процессы не открывают сеанс, а события без LogonId не учитываются
+    assert not correlator.observe("PC1", "0x99", SessionEvent(1000.0, 1, "Процесс", "cmd.exe"), opens=False)
+    assert not correlator.observe("PC1", "", SessionEvent(1000.0, 4624, "Вход", ""))
+
+
+def test_busy_session_is_released_after_max_hold():
+    correlator = Correlator()
+    # События каждые 30 с: паузы нет, но дольше CORRELATION_MAX_HOLD_SECONDS сеанс не придерживается
+    for offset in range(0, CORRELATION_MAX_HOLD_SECONDS, 30):
+        _logon(correlator, 1000.0 + offset)
+        assert correlator.flush(1000.0 + offset) == []
+    _logon(correlator, 1000.0 + CORRELATION_MAX_HOLD_SECONDS)
+    [message] = correlator.flush(1000.0 + CORRELATION_MAX_HOLD_SECONDS)
+    assert message.startswith("🧩 Сеанс: CORP\\alice")
+    assert "Событий: 11" in message and "И ещё: Вход ×1" in message
+    assert correlator.held == set()
+
+
+def test_state_survives_restart(tmp_path):
+    file_name = str(tmp_path / "correlation_state.json")
+    correlator = Correlator()
+    _logon(correlator, 1000.0)
+    correlator.observe("PC1", "0x1f2e", SessionEvent(1002.0, 4698, "Задача", "\\Updater", "📋 Задача"))
+    correlator.save(file_name)
+
+    restored = Correlator()
+    restored.load(file_name)
+    [message] = restored.flush(2000.0)
+    assert message.startswith("🚨 Цепочка в сеансе: CORP\\alice")
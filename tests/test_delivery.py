@@ -0,0 +1,58 @@
+import asyncio
+import bot
+from bot import DeliveryQueue, FallbackBadRequest, FallbackRetryAfter, MessageSpool, split_message
+
+
+def test_spool_compacts_only_when_acks_dominate(tmp_path):
+    file_name = str(tmp_path / "spool.jsonl")
+    spool = MessageSpool(file_name, compact_lines=100)
+    spool.load()
+    entries = [spool.add(1, f"сообщение {number}") for number in range(300)]
+    rewrites = []
+    compact = spool.compact
+    spool.compact = lambda: (rewrites.append(spool.lines), compact())
+    # Большая очередь неотправленных не переписывается при каждом подтверждении: только когда
+    # подтвержденных строк (сообщение и отметка) набирается compact_lines - раз на 50 сообщений
+    for start in range(0, 250, 10):
+        spool.ack(entry["id"] for entry in entries[start:start + 10])
+    assert rewrites == [350, 300, 250, 200, 150]
+    assert spool.lines - len(spool.pending) < 100
+    spool.close()
+
+    restored = MessageSpool(file_name)
+    assert [entry["text"] for entry in restored.load()] == [f"сообщение {number}" for number in range(250, 300)]
+    restored.close()
+
+
+class FlakyBot:
+    def __init__(self, fail_after):
+        self.fail_after = fail_after
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if len(self.sent) >= self.fail_after:
+            raise ConnectionError("сеть недоступна")
+        self.sent.append(text)
+
+
+def test_partly_sent_message_keeps_only_the_rest(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(bot, "CHAT_RATE_PER_SECOND", 1000.0)
+    file_name = str(tmp_path / "spool.jsonl")
+    flaky = FlakyBot(fail_after=1)
+    queue = DeliveryQueue(flaky, 1, spool_file=file_name, errors=(FallbackRetryAfter, FallbackBadRequest))
+    text = "\n".join(f"строка {number:05d}" for number in range(600))
+    parts = split_message(text)
+    assert len(parts) == 2
+
+    async def run():
+        queue.spool.load()
+        entry = queue.spool.add(1, text)
+        await queue._deliver([entry])
+        flaky.fail_after = 10
+        await queue._deliver(queue.failed)
+
+    asyncio.run(run())
+    queue.spool.close()
+    assert flaky.sent == parts
+    assert MessageSpool(file_name).load() == []
@@ -0,0 +1,52 @@
+import os
+from datetime import datetime, timedelta
+import datetime as dt
+from guid_index import GUID_KEY_SIZE, GuidIndex, guid_key
+
+NOW = datetime(2025, 5, 10, 12, 30, tzinfo=dt.timezone.utc)
+GUIDS = [f"{{11111111-2222-3333-4444-{number:012X}}}" for number in range(6)]
+
+
+def test_lookup_flush_and_reload(tmp_path):
+    index = GuidIndex(str(tmp_path))
+    for hours, guid in enumerate(GUIDS):
+        index.add(guid, NOW - timedelta(hours=hours))
+    assert index.contains(GUIDS[3].lower()) and not index.contains("{00000000-0000-0000-0000-000000000000}")
+    assert index.flush() == 6
+    assert index.flush() == 0
+    index.add("не GUID", NOW)
+    assert index.flush() == 1
+    assert len(guid_key("не GUID")) == GUID_KEY_SIZE
+
+    loaded = GuidIndex(str(tmp_path))
+    loaded.load(NOW)
+    assert len(loaded) == 7 and loaded.contains("не GUID")
+    assert all(loaded.contains(guid) for guid in GUIDS)
+
+
+def test_expire_keeps_keys_seen_again_later(tmp_path):
+    index = GuidIndex(str(tmp_path))
+    index.add(GUIDS[0], NOW - timedelta(hours=30))
+    index.add(GUIDS[1], NOW - timedelta(hours=30))
+    index.add(GUIDS[1], NOW)
+    index.flush()
+    assert index.expire(NOW) == 1
+    assert not index.contains(GUIDS[0]) and index.contains(GUIDS[1])
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_torn_tail_is_dropped_on_load(tmp_path):
+    index = GuidIndex(str(tmp_path))
+    index.add(GUIDS[0], NOW)
+    index.flush()
+    [name] = os.listdir(tmp_path)
+    with open(tmp_path / name, "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    loaded = GuidIndex(str(tmp_path))
+    loaded.load(NOW)
+    loaded.add(GUIDS[1], NOW)
+    loaded.flush()
+    reloaded = GuidIndex(str(tmp_path))
+    reloaded.load(NOW)
+    assert len(reloaded) == 2 and reloaded.contains(GUIDS[1])
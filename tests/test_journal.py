@@ -0,0 +1,108 @@
+import os
+from journal import JOURNAL_MAGIC, RECORD, UnitOfWork, read_journal
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_commit_applies_appends_and_replaces(tmp_path):
+    log, cursors = str(tmp_path / "events.jsonl"), str(tmp_path / "cursors.json")
+    unit = UnitOfWork(str(tmp_path / "state.journal"))
+    unit.append(log, b"a\n")
+    unit.append(log, b"b\n")
+    unit.replace(cursors, b'{"System": 1}')
+    assert unit.pending(cursors) == b'{"System": 1}'
+    assert len(unit) == 3
+
+    assert unit.commit() == 2
+    assert _read(log) == b"a\nb\n"
+    assert _read(cursors) == b'{"System": 1}'
+    assert unit.pending(cursors) is None
+    assert len(read_journal(unit.journal_file)) == 1
+    assert unit.commit() == 0
+    unit.close()
+
+
+def test_recover_after_crash_does_not_duplicate_appends(tmp_path):
+    log, journal = str(tmp_path / "events.jsonl"), str(tmp_path / "state.journal")
+    with open(log, "wb") as f:
+        f.write(b"old\n")
+    unit = UnitOfWork(journal)
+    unit.append(log, b"new\n")
+    unit.replace(str(tmp_path / "cursor"), b"7")
+    unit.commit()
+    # Сбой до контрольной точки: журнал остался, дозапись применена лишь частично
+    with open(log, "r+b") as f:
+        f.truncate(len(b"old\nne"))
+    os.remove(tmp_path / "cursor")
+
+    recovered = UnitOfWork(journal)
+    assert recovered.recover() == 1
+    assert _read(log) == b"old\nnew\n"
+    assert _read(tmp_path / "cursor") == b"7"
+    # Журнал очищен на контрольной точке; повторный повтор ничего не меняет
+    assert os.path.getsize(journal) == 0
+    assert recovered.recover() == 0
+    assert _read(log) == b"old\nnew\n"
+    recovered.close()
+
+
+def test_recover_replays_already_applied_record_idempotently(tmp_path):
+    log, journal = str(tmp_path / "events.jsonl"), str(tmp_path / "state.journal")
+    unit = UnitOfWork(journal)
+    unit.append(log, b"one\n")
+    unit.commit()
+    unit.append(log, b"two\n")
+    unit.commit()
+
+    assert UnitOfWork(journal).recover() == 2
+    assert _read(log) == b"one\ntwo\n"
+
+
+def test_torn_last_record_is_discarded(tmp_path):
+    log, journal = str(tmp_path / "events.jsonl"), str(tmp_path / "state.journal")
+    unit = UnitOfWork(journal)
+    unit.append(log, b"kept\n")
+    unit.commit()
+    unit.append(log, b"torn\n")
+    unit.commit()
+    unit.journal.close()
+    unit.journal = None
+    # Обрыв при записи второй записи журнала и файла лога: остается только первая фиксация
+    size = os.path.getsize(journal)
+    with open(journal, "r+b") as f:
+        f.truncate(size - 3)
+    with open(log, "wb") as f:
+        f.write(b"kept\nto")
+
+    assert len(read_journal(journal)) == 1
+    assert UnitOfWork(journal).recover() == 1
+    assert _read(log) == b"kept\n"
+
+
+def test_corrupted_record_stops_reading(tmp_path):
+    journal = str(tmp_path / "state.journal")
+    unit = UnitOfWork(journal)
+    for number in range(3):
+        unit.append(str(tmp_path / "log"), f"{number}\n".encode())
+        unit.commit()
+    data = bytearray(_read(journal))
+    assert data[:4] == JOURNAL_MAGIC
+    # Порча данных второй записи: CRC не сходится, чтение останавливается на ней
+    first_end = RECORD.size + sum(RECORD.unpack_from(data, 0)[1:3])
+    data[first_end + RECORD.size + 1] ^= 0xFF
+    with open(journal, "wb") as f:
+        f.write(data)
+    assert len(read_journal(journal)) == 1
+
+
+def test_checkpoint_truncates_journal(tmp_path):
+    journal = str(tmp_path / "state.journal")
+    unit = UnitOfWork(journal, checkpoint_bytes=1)
+    unit.append(str(tmp_path / "log"), b"x\n")
+    unit.commit()
+    assert os.path.getsize(journal) == 0
+    assert unit.touched == set()
+    unit.close()
@@ -0,0 +1,92 @@
+import json
+import os
+from datetime import datetime
+import datetime as dt
+import pytest
+from event_source import EventRecord
+from rules import Rule, RuleSet, load_rules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIME = datetime(2025, 5, 10, 12, 0, tzinfo=dt.timezone.utc)
+
+LOGON_SPEC = {
+    "name": "Вход",
+    "channel": "Security",
+    "event_id": 4624,
+    "severity": "info",
+    "min_inserts": 4,
+    "fields": {"user": 0, "domain": 1, "logon_type": 2, "privileges": {"index": 3, "transform": "lines"},
+               "extra": {"index": 9, "default": "нет"}},
+    "where": {"logon_type": {"in": ["2", "10"]}},
+    "alert_when": {"logon_type": {"eq": "2"}},
+    "lookups": {"kind": {"field": "logon_type", "values": {"2": "Локальный"}, "default": "Тип {logon_type}"}},
+    "placeholders": {"domain": "Не определён"},
+    "message": "{user}@{domain}: {kind} {privileges} {extra} ({event_id})",
+    "log": {"file": "events.jsonl", "summary": "{user} {kind}", "fields": ["user", "domain"]}
+}
+
+
+def _record(inserts, event_id=4624, channel="Security"):
+    return EventRecord(channel, 1, event_id, TIME, inserts)
+
+
+def test_repository_rules_compile():
+    rules = load_rules(os.path.join(ROOT, "rules.json"))
+    assert len(rules) > 0
+    assert 4624 in rules.routes["Security"]
+
+
+def test_rule_fields_conditions_and_templates():
+    rule = Rule(LOGON_SPEC)
+    values = rule.match(_record(["alice", "", "2", "SeDebug\r\n  SeBackup\r\n"]))
+    assert values["privileges"] == "SeDebug, SeBackup"
+    assert values["extra"] == "нет"
+    assert values["kind"] == "Локальный"
+    assert rule.alerts(values)
+    assert rule.format_message(_record([]), values) == "alice@Не определён: Локальный SeDebug, SeBackup нет (4624)"
+    entry = rule.log_entry(_record([]), values)
+    assert entry["summary"] == "alice Локальный"
+    assert entry["user"] == "alice" and entry["domain"] == "" and entry["event_id"] == 4624
+
+    remote = rule.match(_record(["bob", "CORP", "10", ""]))
+    assert remote["kind"] == "Тип 10"
+    assert not rule.alerts(remote)
+    # where отсекает остальные типы входа, min_inserts - короткие записи
+    assert rule.match(_record(["bob", "CORP", "3", ""])) is None
+    assert rule.match(_record(["bob", "CORP", "2"])) is None
+
+
+@pytest.mark.parametrize("change, error", [
+    ({"unknown": 1}, "неизвестные ключи"),
+    ({"severity": "fatal"}, "важность"),
+    ({"where": {"missing": {"eq": "1"}}}, "неизвестное поле"),
+    ({"where": {"user": {"like": "a"}}}, "неизвестное условие"),
+    ({"message": "{missing}"}, "в шаблоне неизвестные поля"),
+    ({"fields": {"user": {"index": 0, "transform": "upper"}}}, "неизвестное преобразование"),
+])
+def test_invalid_spec_is_rejected(change, error):
+    with pytest.raises(ValueError, match=error):
+        Rule({**LOGON_SPEC, **change})
+
+
+def test_load_rules_names_the_broken_rule(tmp_path):
+    file_name = tmp_path / "rules.json"
+    file_name.write_text(json.dumps([LOGON_SPEC, {**LOGON_SPEC, "name": "Сломанное", "severity": "x"}]),
+                         encoding="utf-8")
+    with pytest.raises(ValueError, match=r"правило 2 \(Сломанное\)"):
+        load_rules(str(file_name))
+
+
+def test_ruleset_dispatches_by_event_id_and_channel():
+    task = {"name": "Задача", "channel": "Security", "event_id": 4698, "fields": {"task": 0},
+            "message": "{task}"}
+    service = {"name": "Служба", "channel": "System", "event_id": 7045, "fields": {"service": 0},
+               "message": "{service}"}
+    rules = RuleSet([Rule(LOGON_SPEC), Rule(task), Rule(service)])
+    assert rules.routes == {"Security": [4624, 4698], "System": [7045]}
+
+    matches = rules.match(_record(["\\Updater"], event_id=4698))
+    assert [(rule.name, values) for rule, values in matches] == [("Задача", {"task": "\\Updater"})]
+    # Тот же EventID в другом канале и неизвестный EventID правилам не достаются
+    assert rules.match(_record(["\\Updater"], event_id=4698, channel="System")) == []
+    assert rules.match(_record(["x"], event_id=1)) == ()
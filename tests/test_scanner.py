@@ -0,0 +1,88 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+import datetime as dt
+from cursor_store import CursorStore
+from event_source import MemoryEventSource
+from journal import UnitOfWork
+from scanner import EventScanner
+
+SINCE = datetime.now(dt.timezone.utc) - timedelta(minutes=5)
+
+
+def _scanner(tmp_path, unit=None):
+    source = MemoryEventSource()
+    scanner = EventScanner(source, CursorStore(str(tmp_path / "cursors.json")), max_workers=1, unit=unit)
+    seen = {"security": [], "system": []}
+
+    async def security(records):
+        seen["security"].extend(record.record_number for record in records)
+
+    async def system(records):
+        seen["system"].extend(record.record_number for record in records)
+
+    scanner.register("security", {"Security": [4624]}, security)
+    scanner.register("system", {"System": [7045]}, system)
+    return scanner, source, seen
+
+
+def test_cursor_advances_and_next_scan_reads_only_new_records(tmp_path):
+    scanner, source, seen = _scanner(tmp_path)
+    source.add("Security", 4624)
+    source.add("Security", 4634)
+    source.add("System", 7045)
+    assert asyncio.run(scanner.scan(SINCE)) == set()
+    assert seen == {"security": [1], "system": [1]}
+    assert scanner.cursors.get("Security") == 2
+
+    source.add("Security", 4624)
+    asyncio.run(scanner.scan(SINCE))
+    scanner.close()
+    assert seen["security"] == [1, 3]
+    assert seen["system"] == [1]
+    with open(tmp_path / "cursors.json", encoding="utf-8") as f:
+        assert json.load(f) == {"Security": 3, "System": 1}
+
+
+def test_failed_handler_keeps_its_channel_cursor(tmp_path):
+    scanner, source, seen = _scanner(tmp_path)
+    calls = []
+
+    async def flaky(records):
+        calls.append([record.record_number for record in records])
+        if len(calls) == 1:
+            raise RuntimeError("диск занят")
+
+    scanner.register("flaky", {"Security": [4624]}, flaky)
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    source.add("Security", 4624)
+    source.add("System", 7045)
+    assert asyncio.run(scanner.scan(SINCE, send)) == {"Security"}
+    assert scanner.cursors.get("Security") is None
+    assert scanner.cursors.get("System") == 1
+    assert messages and messages[0].startswith("📋 Ошибка: обработчик flaky")
+
+    # Следующий проход получает те же записи канала ещё раз, после успеха курсор сдвигается
+    source.add("Security", 4624)
+    assert asyncio.run(scanner.scan(SINCE, send)) == set()
+    scanner.close()
+    assert calls == [[1], [1, 2]]
+    assert seen["security"] == [1, 1, 2]
+    assert scanner.cursors.get("Security") == 2
+
+
+def test_dispatch_commits_cursors_with_unit_of_work(tmp_path):
+    unit = UnitOfWork(str(tmp_path / "state.journal"))
+    scanner, source, seen = _scanner(tmp_path, unit)
+    records = [source.add("Security", 4624), source.add("Security", 4624)]
+    assert asyncio.run(scanner.dispatch(records)) == set()
+    assert seen["security"] == [1, 2]
+    assert seen["system"] == []
+    with open(tmp_path / "cursors.json", encoding="utf-8") as f:
+        assert json.load(f) == {"Security": 2}
+    assert CursorStore(str(tmp_path / "cursors.json")).get("Security") == 2
+    unit.close()
@@ -0,0 +1,64 @@
+import asyncio
+import time
+import pytest
+from virustotal import QuotaScheduler, VerdictCache, VirusTotalClient
+
+
+async def _acquired(quota, count):
+    for _ in range(count):
+        await asyncio.wait_for(quota.acquire(), timeout=0.2)
+
+
+def test_quota_is_a_sliding_minute():
+    quota = QuotaScheduler(4)
+    asyncio.run(_acquired(quota, 4))
+    # Пятый запрос той же минуты ждет, пока первый не выйдет из окна
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(_acquired(quota, 1))
+    assert len(quota.times) == 4
+
+
+def test_quota_carries_over_between_runs(tmp_path):
+    file_name = str(tmp_path / "vt_cache.sqlite3")
+    now = time.time()
+    cache = VerdictCache(file_name)
+    cache.save_quota([now - 120, now - 30, now - 20, now - 10])
+    cache.close()
+
+    cache = VerdictCache(file_name)
+    quota = QuotaScheduler(4, cache.quota_times())
+    cache.close()
+    # Запрос двухминутной давности квоту не занимает, три недавних - занимают
+    assert list(quota.times) == [now - 30, now - 20, now - 10]
+    asyncio.run(_acquired(quota, 1))
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(_acquired(quota, 1))
+
+
+def test_unchecked_hashes_are_resumed(tmp_path):
+    file_name = str(tmp_path / "vt_cache.sqlite3")
+
+    async def on_verdict(sha256, verdict, contexts):
+        pass
+
+    async def stop_unchecked():
+        client = VirusTotalClient("key", VerdictCache(file_name), on_verdict)
+        client.submit("a" * 64, {"image": "a.exe"})
+        client.submit("a" * 64, {"image": "a2.exe"})
+        client.submit("b" * 64, {"image": "b.exe"})
+        await client.stop(timeout=0)
+        client.cache.close()
+
+    asyncio.run(stop_unchecked())
+    cache = VerdictCache(file_name)
+    assert cache.pending() == {"a" * 64: [{"image": "a.exe"}, {"image": "a2.exe"}], "b" * 64: [{"image": "b.exe"}]}
+
+    async def resume():
+        client = VirusTotalClient("key", cache, on_verdict)
+        client.resume()
+        return client.waiters
+
+    assert set(asyncio.run(resume())) == {"a" * 64, "b" * 64}
+    cache.put("a" * 64, "0/70")
+    assert list(cache.pending()) == ["b" * 64]
+    cache.close()
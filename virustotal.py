@@ -0,0 +1,321 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import deque
+from metrics import VT_CACHE_LOOKUPS, VT_REQUESTS, STAGE_SECONDS
+
+# Настройки обращений к VirusTotal
+VT_API_URL = "https://www.virustotal.com/api/v3/files/{}"  # Адрес API (для проверок - адрес локальной заглушки)
+VT_REQUESTS_PER_MINUTE = 4  # Квота API (бесплатный тариф - 4 запроса в минуту)
+VT_MAX_CONCURRENCY = 4  # Одновременных запросов не больше
+VT_TIMEOUT = 15  # Таймаут одного запроса (с)
+VT_POOL_SIZE = 10  # Размер пула HTTP-соединений
+VT_QUOTA_PAUSE = 60  # Пауза после ответа 429 (с)
+VT_DRAIN_TIMEOUT = 20  # Сколько ждать незавершённых проверок при остановке (с)
+
+# Настройки кэша вердиктов
+VT_CACHE_FILE = "vt_cache.sqlite3"  # Файл кэша
+VT_CACHE_TTL = 7 * 24 * 3600  # Срок жизни вердикта по известному файлу (с)
+VT_NEGATIVE_TTL = 24 * 3600  # Срок жизни ответа «файл не найден» (с) - файл может появиться в базе
+VT_ERROR_TTL = 15 * 60  # Срок жизни ответа с ошибкой сервера (с)
+VT_CACHE_MAX_ENTRIES = 100000  # Сверх этого вытесняются давно не использованные записи
+
+
+# Функция разбора ответа VirusTotal в строку вердикта
+def parse_vt_response(status_code, data):
+    if status_code == 200:
+        stats = data.get("data", {}).get("attributes", {}).get("last_analysis_stats", {})
+        return f"{stats.get('malicious', 0)}/{stats.get('malicious', 0) + stats.get('undetected', 0)}"
+    if status_code == 404:
+        return "0/0 (файл не найден)"
+    return None
+
+
+# Кэш вердиктов в SQLite: записи со сроком жизни, вытеснение давно не использованных
+class VerdictCache:
+    def __init__(self, file_name=VT_CACHE_FILE, max_entries=VT_CACHE_MAX_ENTRIES):
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.used = {}  # sha256 -> время использования, ещё не записанное в базу
+        self.conn = sqlite3.connect(file_name)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                "sha256 TEXT PRIMARY KEY, verdict TEXT NOT NULL, "
+                "expires REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)")
+            # Хэши, не проверенные до остановки, с контекстами их оповещений (JSON)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending ("
+                "sha256 TEXT PRIMARY KEY, contexts TEXT NOT NULL, queued REAL NOT NULL)"
+            )
+            # Время запросов последней минуты: квота соблюдается и между запусками
+            self.conn.execute("CREATE TABLE IF NOT EXISTS quota (time REAL NOT NULL)")
+        self.size = self.conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        print(f"Открыт кэш VirusTotal {file_name} ({self.size} записей)")
+
+    def get(self, sha256):
+        now = time.time()
+        row = self.conn.execute("SELECT verdict, expires FROM verdicts WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None:
+            self.misses += 1
+            VT_CACHE_LOOKUPS.inc(result="miss")
+            return None
+        verdict, expires = row
+        if expires <= now:
+            self.expired += 1
+            self.misses += 1
+            VT_CACHE_LOOKUPS.inc(result="expired")
+            return None
+        self.hits += 1
+        VT_CACHE_LOOKUPS.inc(result="hit")
+        self.used[sha256] = now
+        return verdict
+
+    # Запись времени использования попавших в кэш хэшей одной транзакцией (раз за пачку событий)
+    def flush_usage(self):
+        if not self.used:
+            return
+        with self.conn:
+            self._write_usage()
+
+    def _write_usage(self):
+        self.conn.executemany("UPDATE verdicts SET last_used = ? WHERE sha256 = ?",
+                              ((used, sha256) for sha256, used in self.used.items()))
+        self.used = {}
+
+    def put(self, sha256, verdict, ttl=VT_CACHE_TTL):
+        now = time.time()
+        exists = self.conn.execute("SELECT 1 FROM verdicts WHERE sha256 = ?", (sha256,)).fetchone()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO verdicts (sha256, verdict, expires, last_used) VALUES (?, ?, ?, ?)",
+                (sha256, verdict, now + ttl, now)
+            )
+            self.conn.execute("DELETE FROM pending WHERE sha256 = ?", (sha256,))
+            if not exists:
+                self.size += 1
+            if self.size > self.max_entries:
+                self._evict(now)
+        print(f"Обновлён кэш VirusTotal: SHA256 {sha256} на {ttl / 3600:.0f} ч")
+
+    # Сохранение непроверенных хэшей при остановке: waiters = {sha256: [контексты]}.
+    # Строка удаляется, когда вердикт хэша записывается в кэш
+    def save_pending(self, waiters):
+        if not waiters:
+            return
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO pending (sha256, contexts, queued) VALUES (?, ?, ?)",
+                ((sha256, json.dumps(contexts, ensure_ascii=False), now) for sha256, contexts in waiters.items())
+            )
+        print(f"Сохранено {len(waiters)} непроверенных хэшей VirusTotal до следующего запуска")
+
+    # Непроверенные хэши прошлых запусков в порядке постановки: {sha256: [контексты]}
+    def pending(self):
+        rows = self.conn.execute("SELECT sha256, contexts FROM pending ORDER BY queued").fetchall()
+        return {sha256: json.loads(contexts) for sha256, contexts in rows}
+
+    # Сохранение времени запросов последней минуты (QuotaScheduler.times)
+    def save_quota(self, times):
+        with self.conn:
+            self.conn.execute("DELETE FROM quota")
+            self.conn.executemany("INSERT INTO quota (time) VALUES (?)", ((value,) for value in times))
+
+    def quota_times(self):
+        return [row[0] for row in self.conn.execute("SELECT time FROM quota ORDER BY time")]
+
+    # Сначала удаляются просроченные записи, затем давно не использованные сверх max_entries
+    def _evict(self, now):
+        self._write_usage()
+        removed = self.conn.execute("DELETE FROM verdicts WHERE expires <= ?", (now,)).rowcount
+        excess = self.size - removed - self.max_entries
+        if excess > 0:
+            removed += self.conn.execute(
+                "DELETE FROM verdicts WHERE sha256 IN "
+                "(SELECT sha256 FROM verdicts ORDER BY last_used LIMIT ?)",
+                (excess,)
+            ).rowcount
+        self.size -= removed
+        print(f"Из кэша VirusTotal вытеснено {removed} записей")
+
+    # Перенос записей из старого vt_cache.json (срок жизни отсчитывается с момента переноса)
+    def migrate_json(self, json_file):
+        if not os.path.exists(json_file):
+            return
+        try:
+            with open(json_file, "r") as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"Ошибка чтения старого кэша {json_file}: {e}")
+            return
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO verdicts (sha256, verdict, expires, last_used) VALUES (?, ?, ?, ?)",
+                ((sha256, str(verdict), now + VT_CACHE_TTL, now) for sha256, verdict in entries.items())
+            )
+            self.size = self.conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+            if self.size > self.max_entries:
+                self._evict(now)
+        os.replace(json_file, f"{json_file}.migrated")
+        print(f"Кэш VirusTotal перенесён из {json_file}: {len(entries)} записей")
+
+    def stats(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0
+        return (f"кэш VirusTotal: {self.size} записей, попаданий {self.hits}, промахов {self.misses}"
+                f" (из них просрочено {self.expired}), доля попаданий {ratio:.0f}%")
+
+    def close(self):
+        self.flush_usage()
+        self.conn.close()
+
+
+# Квота запросов: не больше rate_per_minute запросов за скользящую минуту - хранится время запросов
+# последней минуты (times - время запросов прошлого запуска, чтобы новый запуск не начинал с полной квотой)
+class QuotaScheduler:
+    def __init__(self, rate_per_minute, times=()):
+        self.limit = rate_per_minute
+        now = time.time()
+        self.times = deque(value for value in sorted(times) if now - 60 < value <= now)
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.time()
+            while self.times and now - self.times[0] >= 60:
+                self.times.popleft()
+            delay = self.paused_until - now
+            if delay <= 0:
+                if len(self.times) < self.limit:
+                    self.times.append(now)
+                    return
+                delay = self.times[0] + 60 - now
+            await asyncio.sleep(delay)
+
+    # Пауза по требованию сервера (ответ 429)
+    def pause(self, seconds):
+        self.paused_until = time.time() + seconds
+
+
+# Асинхронный конвейер проверки хэшей: пул соединений, ограничение параллельности,
+# объединение одновременных запросов одного хэша и очередь сверх квоты
+class VirusTotalClient:
+    def __init__(self, api_key, cache, on_verdict, api_url=VT_API_URL,
+                 requests_per_minute=VT_REQUESTS_PER_MINUTE, concurrency=VT_MAX_CONCURRENCY):
+        self.api_key = api_key
+        # Объект с get(sha256), put(sha256, verdict, ttl), pending(), save_pending(waiters), quota_times()
+        # и save_quota(times)
+        self.cache = cache
+        self.on_verdict = on_verdict  # async (sha256, verdict, contexts)
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.quota = QuotaScheduler(requests_per_minute, cache.quota_times())
+        self.session = None  # Создается при первом запросе: requests не нужен запускам без новых хэшей
+        self.pending = asyncio.Queue()
+        self.waiters = {}  # sha256 -> контексты ожидающих оповещений
+        self.workers = []
+
+    def start(self):
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    # Постановка хэша на проверку; повторный запрос того же хэша присоединяется к текущему
+    def submit(self, sha256, context):
+        if sha256 in self.waiters:
+            self.waiters[sha256].append(context)
+            return
+        self.waiters[sha256] = [context]
+        self.pending.put_nowait(sha256)
+        print(f"SHA256 {sha256} поставлен в очередь VirusTotal (в очереди: {self.pending.qsize()})")
+
+    # Постановка в очередь хэшей, не проверенных прошлыми запусками
+    def resume(self):
+        pending = self.cache.pending()
+        for sha256, contexts in pending.items():
+            for context in contexts:
+                self.submit(sha256, context)
+        if pending:
+            print(f"Возвращено в очередь VirusTotal {len(pending)} хэшей прошлого запуска")
+
+    def _open_session(self):
+        if self.session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=VT_POOL_SIZE)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+        return self.session
+
+    def _request(self, sha256):
+        with STAGE_SECONDS.time(stage="vt_request", name=""):
+            response = self.session.get(
+                self.api_url.format(sha256),
+                headers={"x-apikey": self.api_key},
+                timeout=VT_TIMEOUT
+            )
+        VT_REQUESTS.inc(status=response.status_code)
+        data = response.json() if response.status_code == 200 else {}
+        return response.status_code, data
+
+    async def _lookup(self, sha256):
+        while True:
+            await self.quota.acquire()
+            self._open_session()
+            try:
+                status_code, data = await asyncio.to_thread(self._request, sha256)
+            except Exception as e:
+                VT_REQUESTS.inc(status="error")
+                return f"ошибка: {str(e)}"
+            if status_code == 429:
+                print(f"Квота VirusTotal исчерпана, пауза {VT_QUOTA_PAUSE} с")
+                self.quota.pause(VT_QUOTA_PAUSE)
+                continue
+            verdict = parse_vt_response(status_code, data)
+            if verdict is None:
+                verdict = f"ошибка: HTTP {status_code}"
+                self.cache.put(sha256, verdict, VT_ERROR_TTL)
+            elif status_code == 404:
+                self.cache.put(sha256, verdict, VT_NEGATIVE_TTL)
+            else:
+                self.cache.put(sha256, verdict, VT_CACHE_TTL)
+            return verdict
+
+    async def _worker(self):
+        while True:
+            sha256 = await self.pending.get()
+            try:
+                verdict = await self._lookup(sha256)
+                contexts = self.waiters.pop(sha256, [])
+                await self.on_verdict(sha256, verdict, contexts)
+            except Exception as e:
+                print(f"Ошибка проверки {sha256} в VirusTotal: {e}")
+                self.waiters.pop(sha256, None)
+            finally:
+                self.pending.task_done()
+
+    # Остановка: ждём незавершённые проверки не дольше timeout; непроверенные хэши сохраняются
+    # в кэше и возвращаются в очередь следующим запуском (resume)
+    async def stop(self, timeout=VT_DRAIN_TIMEOUT):
+        try:
+            await asyncio.wait_for(self.pending.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Не дождались проверки {len(self.waiters)} хэшей в VirusTotal")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        if self.session is not None:
+            self.session.close()
+        self.cache.save_pending(self.waiters)
+        self.cache.save_quota(self.quota.times)
+        self.waiters = {}